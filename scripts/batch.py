@@ -0,0 +1,190 @@
+"""
+Columnar batch records
+Holds the NLP results of a batch of posts as NumPy columns (scores) and
+interned integer codes (categorical fields) instead of one dict per post
+"""
+
+import numpy as np
+
+from posts_schema import CATEGORY_VALUES
+
+NUMERIC_FIELDS = ('polarity', 'subjectivity', 'vader_compound', 'toxicity_score')
+CATEGORICAL_FIELDS = ('Label', 'Types', 'language', 'sentiment')
+MISSING_CODE = -1
+
+
+class Vocabulary:
+    """Interned mapping between category strings and small integer codes"""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        """Return the code of a value, adding it on first use"""
+        if value is None:
+            return MISSING_CODE
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        """Return the value of a code (None for missing)"""
+        return None if code == MISSING_CODE else self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Shared by every batch of the process so codes are comparable across batches, and
+# seeded with the stored codes of the v2 posts schema so that both agree
+VOCABULARIES = {field: Vocabulary(CATEGORY_VALUES[field]) for field in CATEGORICAL_FIELDS}
+
+
+class PostRow:
+    """Lightweight view on one row of a PostBatch"""
+
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getattr__(self, name):
+        return self.batch.get(name, self.index)
+
+    def __getitem__(self, name):
+        return self.batch.get(name, self.index)
+
+    def to_dict(self):
+        """Return the row as a plain dict of native Python values"""
+        return self.batch.row_dict(self.index)
+
+
+class PostBatch:
+    """Fixed-capacity columnar batch of analyzed posts"""
+
+    __slots__ = ('ids', 'size', 'numeric', 'codes', 'extra', 'processed_at')
+
+    def __init__(self, capacity, processed_at=None):
+        self.ids = [None] * capacity
+        self.size = 0
+        self.numeric = {field: np.zeros(capacity, dtype=np.float64) for field in NUMERIC_FIELDS}
+        self.codes = {field: np.full(capacity, MISSING_CODE, dtype=np.int16)
+                      for field in CATEGORICAL_FIELDS}
+        self.extra = {}
+        self.processed_at = processed_at
+
+    def append(self, doc_id, values):
+        """Store the fields of one post (keys outside the known columns go to extra lists)"""
+        index = self.size
+        if index >= len(self.ids):
+            raise IndexError("PostBatch is full")
+        self.ids[index] = doc_id
+        for field, value in values.items():
+            column = self.numeric.get(field)
+            if column is not None:
+                column[index] = value
+                continue
+            codes = self.codes.get(field)
+            if codes is not None:
+                codes[index] = VOCABULARIES[field].code(value)
+                continue
+            self.set_extra(index, field, value)
+        self.size += 1
+        return index
+
+    def append_analysis(self, doc_id, language, sentiment_data, toxicity_score):
+        """Store the NLP results of one post without building an intermediate dict"""
+        index = self.size
+        if index >= len(self.ids):
+            raise IndexError("PostBatch is full")
+        self.ids[index] = doc_id
+        self.codes['language'][index] = VOCABULARIES['language'].code(language)
+        self.codes['sentiment'][index] = VOCABULARIES['sentiment'].code(sentiment_data['sentiment'])
+        self.numeric['polarity'][index] = sentiment_data['polarity']
+        self.numeric['subjectivity'][index] = sentiment_data['subjectivity']
+        self.numeric['vader_compound'][index] = sentiment_data.get('vader_compound', 0.0)
+        self.numeric['toxicity_score'][index] = toxicity_score
+        self.size += 1
+        return index
+
+    def set_numeric_column(self, field, values):
+        """Store a whole float column computed for the batch at once (e.g. model scores)"""
+        column = np.zeros(len(self.ids), dtype=np.float64)
+        column[:self.size] = values
+        self.numeric[field] = column
+
+    def set_extra(self, index, field, value):
+        """Store a value of a column without a dedicated array (e.g. text fields)"""
+        self.extra.setdefault(field, [None] * len(self.ids))[index] = value
+
+    def iter_updates(self, fields, schema=None):
+        """Yield (_id, $set document) pairs for writing the batch back to MongoDB
+
+        With a PostSchema, the $set is in the stored layout: names and codes are
+        translated once per column, so the $set is the only dict built per post
+        (MongoDB updates take one document per post).
+        """
+        columns = [(field, self.column(field)) for field in fields]
+        if self.processed_at is not None:
+            columns.append(('nlp_processed_at', [self.processed_at] * self.size))
+        columns = [(field, values.tolist() if isinstance(values, np.ndarray) else values)
+                   for field, values in columns]
+        if schema is not None:
+            columns = [column for column in (schema.encode_column(field, values)
+                                             for field, values in columns)
+                       if column is not None]
+        for index in range(self.size):
+            yield self.ids[index], {field: values[index] for field, values in columns}
+
+    def column(self, field):
+        """Return a column over the filled rows (array view for numeric fields)"""
+        if field in self.numeric:
+            return self.numeric[field][:self.size]
+        if field in self.codes:
+            vocabulary = VOCABULARIES[field]
+            return [vocabulary.value(code) for code in self.codes[field][:self.size].tolist()]
+        return self.extra.get(field, [None] * len(self.ids))[:self.size]
+
+    def category_codes(self, field):
+        """Return the integer codes of a categorical column"""
+        return self.codes[field][:self.size]
+
+    def fields(self):
+        """Return the names of the columns holding data"""
+        filled = [f for f in CATEGORICAL_FIELDS
+                  if (self.codes[f][:self.size] != MISSING_CODE).any()]
+        return filled + list(self.numeric) + list(self.extra)
+
+    def get(self, field, index):
+        if field in self.numeric:
+            return float(self.numeric[field][index])
+        if field in self.codes:
+            return VOCABULARIES[field].value(int(self.codes[field][index]))
+        if field == '_id':
+            return self.ids[index]
+        if field == 'nlp_processed_at':
+            return self.processed_at
+        column = self.extra.get(field)
+        if column is None:
+            raise AttributeError(field)
+        return column[index]
+
+    def row_dict(self, index, fields=None):
+        """Return one row as a plain dict"""
+        return {field: self.get(field, index) for field in (fields or self.fields())}
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield PostRow(self, index)
@@ -0,0 +1,155 @@
+"""
+Pipeline checkpointing
+Keeps track of the last committed document of each stage so that a long run
+can be resumed after a crash instead of starting again from the first post
+"""
+
+import os
+from datetime import datetime
+
+from bson import json_util
+
+
+def iter_id_batches(collection, batch_size, start_after=None, query=None, projection=None):
+    """Yield documents in ascending _id order, one batch at a time.
+
+    Uses a range query on _id instead of skip/limit so that every batch is an
+    index seek and a run can restart right after the last committed _id.
+    """
+    query = dict(query or {})
+    id_filter = query.pop('_id', {})
+    last_id = start_after
+
+    while True:
+        batch_query = dict(query)
+        batch_id_filter = dict(id_filter)
+        if last_id is not None:
+            batch_id_filter['$gt'] = last_id
+        if batch_id_filter:
+            batch_query['_id'] = batch_id_filter
+
+        documents = list(
+            collection.find(batch_query, projection).sort('_id', 1).limit(batch_size)
+        )
+        if not documents:
+            return
+
+        yield documents
+        last_id = documents[-1]['_id']
+
+
+class MongoCheckpointStore:
+    """Store stage checkpoints in a MongoDB collection (one document per stage)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self, stage):
+        """Return the saved checkpoint of a stage or None"""
+        return self.collection.find_one({'_id': stage})
+
+    def save(self, stage, last_id, stats=None):
+        """Record the last committed _id and the running stats of a stage"""
+        self.collection.update_one(
+            {'_id': stage},
+            {'$set': {
+                'last_id': last_id,
+                'stats': stats or {},
+                'status': 'running',
+                'updated_at': datetime.now()
+            }},
+            upsert=True
+        )
+
+    def complete(self, stage):
+        """Mark a stage as fully processed"""
+        self.collection.update_one(
+            {'_id': stage},
+            {'$set': {'status': 'completed', 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+    def clear(self, stage):
+        """Forget the checkpoint of a stage"""
+        self.collection.delete_one({'_id': stage})
+
+
+class FileCheckpointStore:
+    """Store stage checkpoints in a local JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json_util.loads(f.read())
+
+    def _write(self, state):
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json_util.dumps(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load(self, stage):
+        """Return the saved checkpoint of a stage or None"""
+        return self._read().get(stage)
+
+    def save(self, stage, last_id, stats=None):
+        """Record the last committed _id and the running stats of a stage"""
+        state = self._read()
+        state[stage] = {
+            '_id': stage,
+            'last_id': last_id,
+            'stats': stats or {},
+            'status': 'running',
+            'updated_at': datetime.now()
+        }
+        self._write(state)
+
+    def complete(self, stage):
+        """Mark a stage as fully processed"""
+        state = self._read()
+        checkpoint = state.setdefault(stage, {'_id': stage, 'last_id': None, 'stats': {}})
+        checkpoint['status'] = 'completed'
+        checkpoint['updated_at'] = datetime.now()
+        self._write(state)
+
+    def clear(self, stage):
+        """Forget the checkpoint of a stage"""
+        state = self._read()
+        if state.pop(stage, None) is not None:
+            self._write(state)
+
+
+def get_checkpoint_store(db, checkpoint_path=None):
+    """Return a file store when a path is given, else the pipeline_state collection"""
+    if checkpoint_path:
+        return FileCheckpointStore(checkpoint_path)
+    return MongoCheckpointStore(db.pipeline_state)
+
+
+def resume_point(store, stage, resume):
+    """Return (last_id, stats) to start a stage from"""
+    if not resume:
+        store.clear(stage)
+        return None, {}
+
+    checkpoint = store.load(stage)
+    if not checkpoint:
+        return None, {}
+    return checkpoint.get('last_id'), dict(checkpoint.get('stats') or {})
+
+
+def add_resume_arguments(parser):
+    """Add the --resume / --checkpoint-file options shared by the stage scripts"""
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint of this stage')
+    parser.add_argument('--checkpoint-file', default=None,
+                        help='store checkpoints in this JSON file instead of the '
+                             'pipeline_state collection')
+    return parser
@@ -0,0 +1,141 @@
+"""
+Database connections
+Hands out process-wide pooled MongoDB and Elasticsearch clients shared by
+every stage. Hosts and pool settings come from environment variables
+(MONGO_URI and ES_HOST are set in docs/docker-compose.yml), with local
+defaults.
+"""
+
+import atexit
+import importlib.util
+import os
+import threading
+
+from elasticsearch import Elasticsearch
+from pymongo import MongoClient
+
+DEFAULT_MONGO_URI = "mongodb://localhost:27017/"
+DEFAULT_ES_HOST = "http://localhost:9200"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+def mongo_uri(uri=None):
+    """Return uri, else $MONGO_URI, else the local server"""
+    return uri or os.environ.get('MONGO_URI') or DEFAULT_MONGO_URI
+
+
+def es_host(host=None):
+    """Return host, else $ES_HOST, else the local node"""
+    return host or os.environ.get('ES_HOST') or DEFAULT_ES_HOST
+
+
+def mongo_compressors():
+    """Wire compressors to offer the server, best first ($MONGO_COMPRESSORS overrides)
+
+    zstd and snappy need the zstandard and python-snappy packages; zlib is always available.
+    """
+    configured = os.environ.get('MONGO_COMPRESSORS')
+    if configured is not None:
+        return [name for name in configured.split(',') if name]
+    compressors = []
+    if importlib.util.find_spec('zstandard') is not None:
+        compressors.append('zstd')
+    if importlib.util.find_spec('snappy') is not None:
+        compressors.append('snappy')
+    compressors.append('zlib')
+    return compressors
+
+
+def mongo_settings(**overrides):
+    """Pool, timeout and compression options of the shared MongoDB clients"""
+    settings = {
+        'maxPoolSize': _env_int('MONGO_MAX_POOL_SIZE', 50),
+        'minPoolSize': _env_int('MONGO_MIN_POOL_SIZE', 0),
+        'connectTimeoutMS': _env_int('MONGO_CONNECT_TIMEOUT_MS', 10000),
+        'serverSelectionTimeoutMS': _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000),
+        'socketTimeoutMS': _env_int('MONGO_SOCKET_TIMEOUT_MS', 0) or None,
+        'compressors': ','.join(mongo_compressors()),
+    }
+    settings.update(overrides)
+    return settings
+
+
+def es_settings(**overrides):
+    """Pool, timeout and compression options of the shared Elasticsearch clients"""
+    settings = {
+        'maxsize': _env_int('ES_MAX_CONNECTIONS', 25),     # pooled connections per node
+        'timeout': _env_int('ES_TIMEOUT', 30),
+        'max_retries': _env_int('ES_MAX_RETRIES', 3),
+        'retry_on_timeout': True,
+        # gzip request bodies, which mostly shrinks the bulk requests
+        'http_compress': _env_flag('ES_HTTP_COMPRESS', True),
+    }
+    settings.update(overrides)
+    return settings
+
+
+def _shared(key, create):
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = create()
+        return client
+
+
+def get_mongo_client(uri=None, **overrides):
+    """Return the process-wide MongoClient for uri (and option overrides)"""
+    uri = mongo_uri(uri)
+    key = ('mongo', uri, tuple(sorted(overrides.items())))
+    return _shared(key, lambda: MongoClient(uri, **mongo_settings(**overrides)))
+
+
+def get_mongo_db(uri=None, **overrides):
+    """Return the harcelement database on the shared client"""
+    return get_mongo_client(uri, **overrides).harcelement
+
+
+def get_es_client(host=None, serializer=None, **overrides):
+    """Return the process-wide Elasticsearch client for host (and serializer/option overrides)"""
+    host = es_host(host)
+    key = ('es', host, type(serializer).__name__, tuple(sorted(overrides.items())))
+
+    def create():
+        settings = es_settings(**overrides)
+        if serializer is not None:
+            settings['serializer'] = serializer
+        return Elasticsearch([host], **settings)
+
+    return _shared(key, create)
+
+
+def close_all():
+    """Close every shared client (registered to run at exit)"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+def _forget_after_fork():
+    # Pooled sockets must not be shared with a forked child, which opens its own
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+
+atexit.register(close_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,269 @@
+"""
+Dump loader
+Streams MongoDB Extended JSON exports (Mongodb_data.json) and Elasticsearch
+search/scroll responses (elasticsearch.json) and restores them in bounded
+batches, without ever holding the whole file in memory
+"""
+
+import argparse
+import json
+import logging
+
+from bson import json_util
+from elasticsearch import helpers
+from pymongo.errors import BulkWriteError
+
+from connections import get_mongo_db
+from es_ingest import ElasticsearchIngestor
+from posts_schema import decode_document, get_posts_schema
+from query_service import notify_index_changed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20  # characters read from disk at a time
+ES_RESPONSE_KEYS = {'_scroll_id', 'pit_id', 'took', 'timed_out', '_shards', 'hits'}
+
+
+def extended_json_hook(obj):
+    """Convert Extended JSON wrappers ($oid, $date, $numberLong...) to native values"""
+    # Only single-key {"$...": ...} objects are wrappers; skip everything else cheaply
+    if len(obj) == 1:
+        key = next(iter(obj))
+        if key.startswith('$'):
+            return json_util.object_hook(obj)
+    return obj
+
+
+class JSONStream:
+    """Incremental reader decoding one JSON value at a time from a text file"""
+
+    def __init__(self, fp, object_hook=None, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder(object_hook=object_hook)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read one more chunk, dropping the already consumed prefix"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and consume the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number ending exactly at the end of the buffer may continue
+                # in the next chunk, so only trust it once more data is read
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_array(self):
+        """Yield the items of the array starting at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_object_keys(self):
+        """Yield the keys of the object at the current position.
+
+        The caller must consume (or skip) each key's value before resuming.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def iter_path(self, path):
+        """Yield the items of the array found under the nested object keys of path"""
+        if not path:
+            yield from self.iter_array()
+            return
+        for key in self.iter_object_keys():
+            if key == path[0]:
+                yield from self.iter_path(path[1:])
+            else:
+                self.value()
+
+
+def detect_format(path):
+    """Return 'mongo' for a Mongo export (array or JSON lines) or 'es' for a search response"""
+    with open(path, 'r', encoding='utf-8') as fp:
+        stream = JSONStream(fp, chunk_size=4096)
+        first = stream.peek()
+        if first == '[':
+            return 'mongo'
+        if first != '{':
+            raise ValueError(f"{path} does not look like a JSON dump")
+        for key in stream.iter_object_keys():
+            return 'es' if key in ES_RESPONSE_KEYS else 'mongo'
+    return 'mongo'
+
+
+def iter_mongo_dump(path, chunk_size=CHUNK_SIZE):
+    """Stream documents from a mongoexport file (--jsonArray or JSON lines)"""
+    with open(path, 'r', encoding='utf-8') as fp:
+        stream = JSONStream(fp, object_hook=extended_json_hook, chunk_size=chunk_size)
+        if stream.peek() == '[':
+            yield from stream.iter_array()
+            return
+        while stream.peek():
+            yield stream.value()
+
+
+def iter_es_dump(path, chunk_size=CHUNK_SIZE):
+    """Stream (_id, _source) pairs from one or more concatenated search/scroll responses"""
+    with open(path, 'r', encoding='utf-8') as fp:
+        stream = JSONStream(fp, chunk_size=chunk_size)
+        while stream.peek():
+            for hit in stream.iter_path(('hits', 'hits')):
+                yield hit.get('_id'), hit['_source']
+
+
+def iter_batches(items, batch_size):
+    """Group an iterator into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_mongo_dump(path, collection, batch_size=1000, schema=None):
+    """Insert a Mongo export into a collection; already present _ids are skipped
+
+    With a PostSchema, documents are stored in its layout (see posts_schema.py).
+    """
+    inserted_count = 0
+    skipped_count = 0
+    for batch in iter_batches(iter_mongo_dump(path), batch_size):
+        if schema is not None:
+            batch = [schema.encode_document(decode_document(doc)) for doc in batch]
+        try:
+            inserted_count += len(collection.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate keys mean the document was restored by a previous run
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            inserted_count += e.details.get('nInserted', 0)
+            skipped_count += len(errors)
+        logger.info(f"Inserted {inserted_count} documents ({skipped_count} already present)")
+
+    return inserted_count, skipped_count
+
+
+def load_es_dump(path, es, index_name, batch_size=1000):
+    """Bulk index an Elasticsearch dump, keeping the original _id of every hit"""
+    def actions():
+        for doc_id, source in iter_es_dump(path):
+            action = {"_index": index_name, "_source": source}
+            if doc_id is not None:
+                action["_id"] = doc_id
+            yield action
+
+    # Refreshing during a restore is wasted work; restore the setting afterwards
+    settings = es.indices.get_settings(index=index_name)
+    refresh_interval = settings[index_name]['settings']['index'].get('refresh_interval')
+    es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1"}})
+
+    success_count = 0
+    error_count = 0
+    try:
+        for success, info in helpers.streaming_bulk(es, actions(), chunk_size=batch_size,
+                                                    raise_on_error=False):
+            if success:
+                success_count += 1
+            else:
+                error_count += 1
+                logger.error(f"Indexing error: {info}")
+            if (success_count + error_count) % (batch_size * 10) == 0:
+                logger.info(f"Indexed {success_count} documents, {error_count} errors")
+    finally:
+        es.indices.put_settings(index=index_name,
+                                body={"index": {"refresh_interval": refresh_interval}})
+        es.indices.refresh(index=index_name)
+
+    logger.info(f"Restore completed: {success_count} successful, {error_count} errors")
+    return success_count, error_count
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description="Restore a Mongo or Elasticsearch JSON dump")
+    parser.add_argument('path', help='Mongodb_data.json-style export or elasticsearch.json-style dump')
+    parser.add_argument('--format', choices=['auto', 'mongo', 'es'], default='auto')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    parser.add_argument('--es-host', default=None, help='default: $ES_HOST or localhost')
+    parser.add_argument('--index', default="harcelement_posts")
+    parser.add_argument('--create-index', action='store_true',
+                        help='(re)create the index with the ingestor mapping before loading')
+    args = parser.parse_args()
+
+    dump_format = detect_format(args.path) if args.format == 'auto' else args.format
+    logger.info(f"Loading {args.path} as a {dump_format} dump")
+
+    if dump_format == 'mongo':
+        db = get_mongo_db(args.mongo_uri)
+        load_mongo_dump(args.path, db.posts, batch_size=args.batch_size,
+                        schema=get_posts_schema(db))
+    else:
+        ingestor = ElasticsearchIngestor(es_host=args.es_host, mongo_uri=args.mongo_uri,
+                                         index_name=args.index)
+        if args.create_index or not ingestor.es.indices.exists(index=args.index):
+            ingestor.create_index_mapping()
+        load_es_dump(args.path, ingestor.es, args.index, batch_size=args.batch_size)
+        notify_index_changed(args.index, ingestor.db)
+
+
+if __name__ == "__main__":
+    main()
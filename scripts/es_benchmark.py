@@ -0,0 +1,159 @@
+"""
+Mapping profile benchmark
+Indexes the same posts into one scratch index per mapping profile of
+es_ingest.py and compares index size, ingest rate and the latency of the
+queries behind the Kibana dashboard
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from connections import get_mongo_db
+from dump_loader import iter_batches, iter_mongo_dump
+from es_ingest import ElasticsearchIngestor, MAPPING_PROFILES, encode_bulk_body
+
+# Queries of the dashboard panels (see README, "Tableau de Bord Kibana")
+DASHBOARD_QUERIES = {
+    'posts_over_time': {
+        "size": 0,
+        "query": {"range": {"created_at": {"gte": "now-2y"}}},
+        "aggs": {"per_month": {"date_histogram": {"field": "created_at",
+                                                  "calendar_interval": "month"}}}
+    },
+    'latest_posts': {
+        "size": 50,
+        "sort": [{"created_at": "desc"}],
+        "track_total_hits": False
+    },
+    'recent_toxic_posts': {
+        "size": 20,
+        "query": {"range": {"toxicity_score": {"gte": 0.7}}},
+        "sort": [{"created_at": "desc"}],
+        "track_total_hits": False
+    },
+    'sentiment_by_language': {
+        "size": 0,
+        "aggs": {"language": {"terms": {"field": "language"},
+                              "aggs": {"sentiment": {"terms": {"field": "sentiment"}}}}}
+    },
+    'scores_by_type': {
+        "size": 0,
+        "aggs": {"type": {"terms": {"field": "type"},
+                          "aggs": {"toxicity": {"avg": {"field": "toxicity_score"}},
+                                   "vader": {"avg": {"field": "vader_compound"}}}}}
+    },
+    'text_search': {
+        "size": 10,
+        "query": {"match": {"contenu": "stupid ugly"}}
+    },
+}
+
+
+def load_documents(dump_path=None, mongo_uri=None, copies=1):
+    """Read the benchmark posts from a mongoexport dump or the posts collection"""
+    if dump_path:
+        documents = list(iter_mongo_dump(dump_path))
+    else:
+        documents = list(get_mongo_db(mongo_uri).posts.find())
+
+    # Extra copies get their own _id so that they are indexed as new documents
+    return [dict(doc, _id=f"{doc['_id']}-{copy}") if copy else doc
+            for copy in range(copies) for doc in documents]
+
+
+def benchmark_profile(profile, documents, es_host=None,
+                      index_prefix="harcelement_posts_bench", batch_size=500, query_runs=50,
+                      keep_index=False):
+    """Index documents with one mapping profile; returns size, ingest rate and query latencies"""
+    ingestor = ElasticsearchIngestor(es_host=es_host, index_name=f"{index_prefix}_{profile}",
+                                     mapping_profile=profile)
+    es = ingestor.es
+    ingestor.create_index_mapping()
+    try:
+        start = time.perf_counter()
+        errors = 0
+        for chunk in iter_batches(documents, batch_size):
+            body = encode_bulk_body(ingestor.index_name, ingestor.transform_batch(chunk),
+                                    ingestor.serializer)
+            errors += ingestor._send_bulk_body(body)[1]
+        es.indices.refresh(index=ingestor.index_name)
+        ingest_seconds = time.perf_counter() - start
+
+        # Compare merged indices, as a long-lived index ends up merged too
+        es.indices.forcemerge(index=ingestor.index_name, max_num_segments=1)
+        stats = es.indices.stats(index=ingestor.index_name)['indices'][ingestor.index_name]
+        result = {
+            'profile': profile,
+            'documents': stats['primaries']['docs']['count'],
+            'errors': errors,
+            'store_bytes': stats['primaries']['store']['size_in_bytes'],
+            'ingest_docs_per_second': round(len(documents) / ingest_seconds),
+            'queries': {}
+        }
+
+        for name, body in DASHBOARD_QUERIES.items():
+            # Warm up, then time the query with the request cache disabled
+            es.search(index=ingestor.index_name, body=body, request_cache=False)
+            latencies = []
+            for _ in range(query_runs):
+                query_start = time.perf_counter()
+                es.search(index=ingestor.index_name, body=body, request_cache=False)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+            result['queries'][name] = {
+                'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 2)
+            }
+        return result
+    finally:
+        if not keep_index:
+            es.indices.delete(index=ingestor.index_name, ignore=[404])
+
+
+def print_comparison(results):
+    profiles = [result['profile'] for result in results]
+    print(f"{'':<28}" + ''.join(f"{profile:>14}" for profile in profiles))
+    print(f"{'store size (MB)':<28}"
+          + ''.join(f"{result['store_bytes'] / 2 ** 20:>14.2f}" for result in results))
+    print(f"{'ingest (docs/s)':<28}"
+          + ''.join(f"{result['ingest_docs_per_second']:>14}" for result in results))
+    for name in DASHBOARD_QUERIES:
+        print(f"{name + ' p50/p99 (ms)':<28}"
+              + ''.join(f"{q['p50_ms']:>7.1f}/{q['p99_ms']:<6.1f}"
+                        for q in (result['queries'][name] for result in results)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Elasticsearch mapping profiles")
+    parser.add_argument('--dump', default=None,
+                        help='mongoexport file to index (default: the posts collection)')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    parser.add_argument('--es-host', default=None, help='default: $ES_HOST or localhost')
+    parser.add_argument('--profiles', default=','.join(MAPPING_PROFILES),
+                        help='comma-separated mapping profiles to compare')
+    parser.add_argument('--copies', type=int, default=1,
+                        help='index every post this many times to get a larger index')
+    parser.add_argument('--query-runs', type=int, default=50)
+    parser.add_argument('--keep-indices', action='store_true',
+                        help='keep the scratch indices for inspection')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    documents = load_documents(args.dump, args.mongo_uri, args.copies)
+    print(f"Benchmarking {len(documents)} documents")
+    results = [
+        benchmark_profile(profile, documents, es_host=args.es_host,
+                          query_runs=args.query_runs, keep_index=args.keep_indices)
+        for profile in args.profiles.split(',') if profile
+    ]
+
+    print_comparison(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
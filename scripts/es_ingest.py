@@ -3,60 +3,304 @@ Elasticsearch ingestion script
 Transfers enriched data from MongoDB to Elasticsearch
 """
 
-from elasticsearch import Elasticsearch, helpers
+import argparse
+from elasticsearch import helpers
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
 import pymongo
-from pymongo import MongoClient
 import logging
 from datetime import datetime
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from analysis import anonymous_author
+from connections import get_es_client, get_mongo_client
+from posts_schema import decode_document
+from query_service import PostQueryService, notify_index_changed
+from checkpoint import add_resume_arguments, get_checkpoint_store, iter_id_batches, resume_point
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib json serializer is used instead
+    orjson = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One integer per harassment category; categories added to a custom lexicon
+# are mapped dynamically
+LEXICON_HIT_PROPERTIES = {
+    category: {"type": "integer"}
+    for category in ('religion', 'ethnicity', 'sexual', 'threats', 'vocational', 'political',
+                     'troll')
+}
+
+STANDARD_MAPPING = {
+    "mappings": {
+        "properties": {
+            "id_post": {"type": "keyword"},
+            "titre": {"type": "text", "analyzer": "standard"},
+            "contenu": {"type": "text", "analyzer": "standard"},
+            "original_text": {"type": "text", "analyzer": "standard",
+                              "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+            "preprocessed_text": {"type": "text", "analyzer": "standard"},
+            "auteur": {"type": "keyword"},
+            "date": {"type": "date"},
+            "url": {"type": "keyword"},
+            "language": {"type": "keyword"},
+            "sentiment": {"type": "keyword"},
+            "polarity": {"type": "float"},
+            "subjectivity": {"type": "float"},
+            "vader_compound": {"type": "float"},
+            "toxicity_score": {"type": "float"},
+            "predicted_toxicity": {"type": "float"},
+            "lexicon_hits": {"type": "object", "properties": LEXICON_HIT_PROPERTIES},
+            "lexicon_total": {"type": "integer"},
+            "label": {"type": "keyword"},
+            "type": {"type": "keyword"},
+            "created_at": {"type": "date"},
+            "nlp_processed_at": {"type": "date"}
+        }
+    },
+    "settings": {
+        "number_of_shards": 1,
+        "number_of_replicas": 0
+    }
+}
+
+# Text only matched on terms: no length norms, no positions (phrase queries are not supported)
+TERMS_ONLY_TEXT = {"type": "text", "analyzer": "standard", "norms": False,
+                   "index_options": "freqs"}
+# Only aggregated, never filtered: doc_values without an index
+AGGREGATED_FLOAT = {"type": "float", "index": False}
+
+# Stores the post text once (contenu) and drops the synthetic titre and url.
+# Fields filtered by the sample queries and alerts stay indexed, as
+# Elasticsearch 7.x cannot query fields that only have doc_values.
+LEAN_MAPPING = {
+    "mappings": {
+        "properties": {
+            "id_post": {"type": "keyword"},
+            "contenu": TERMS_ONLY_TEXT,
+            "preprocessed_text": TERMS_ONLY_TEXT,
+            "auteur": {"type": "keyword"},
+            "date": {"type": "date"},
+            "language": {"type": "keyword"},
+            "sentiment": {"type": "keyword"},
+            "polarity": AGGREGATED_FLOAT,
+            "subjectivity": AGGREGATED_FLOAT,
+            "vader_compound": AGGREGATED_FLOAT,
+            "toxicity_score": {"type": "float"},
+            "predicted_toxicity": {"type": "float"},
+            "lexicon_hits": {"type": "object", "properties": {
+                category: {"type": "integer", "index": False}
+                for category in LEXICON_HIT_PROPERTIES
+            }},
+            "lexicon_total": {"type": "integer"},
+            "label": {"type": "keyword"},
+            "type": {"type": "keyword"},
+            "created_at": {"type": "date"},
+            "nlp_processed_at": {"type": "date", "index": False}
+        }
+    },
+    "settings": {
+        "number_of_shards": 1,
+        "number_of_replicas": 0,
+        # Newest posts first on disk, so time-sorted dashboard queries terminate early
+        "index.sort.field": "created_at",
+        "index.sort.order": "desc",
+        "index.codec": "best_compression"
+    }
+}
+
+MAPPING_PROFILES = {'standard': STANDARD_MAPPING, 'lean': LEAN_MAPPING}
+
+
+class FastJSONSerializer(JSONSerializer):
+    """Client serializer backed by orjson, which encodes datetimes and numpy values natively"""
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson serializer requires orjson: pip install orjson")
+        self.options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def encode(self, data):
+        """Serialize to UTF-8 bytes, ready to be sent"""
+        try:
+            return orjson.dumps(data, default=self.default, option=self.options)
+        except TypeError as e:  # orjson.JSONEncodeError is a TypeError
+            raise SerializationError(data, e)
+
+    def dumps(self, data):
+        # The client helpers measure and join serialized actions as str
+        if isinstance(data, (str, bytes)):
+            return data
+        return self.encode(data).decode('utf-8')
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
+
+SERIALIZERS = ('auto', 'orjson', 'json')
+
+
+def get_serializer(name='auto'):
+    """Return the client serializer: orjson, the stdlib json one, or orjson when installed (auto)"""
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown serializer {name!r}, expected one of {SERIALIZERS}")
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        return FastJSONSerializer()
+    return JSONSerializer()
+
+
+def encode_bulk_body(index_name, actions, serializer):
+    """Pre-encode (ES _id, document) pairs as one NDJSON bulk request body"""
+    encode = getattr(serializer, 'encode', None)
+    if encode is None:
+        # JSONSerializer.dumps passes strings through unquoted, so call json directly
+        def encode(data):
+            return json.dumps(data, default=serializer.default, ensure_ascii=False,
+                              separators=(',', ':')).encode('utf-8')
+
+    # Every action line only differs by its _id
+    prefix = b'{"index":{"_index":' + encode(index_name) + b',"_id":'
+    lines = []
+    for doc_id, source in actions:
+        lines.append(prefix + encode(doc_id) + b'}}')
+        lines.append(encode(source))
+    lines.append(b'')
+    return b'\n'.join(lines)
+
+
+class JsonlSink:
+    """Write exported documents as JSON lines"""
+
+    def __init__(self, path):
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(row, default=str, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.f.close()
+
+
+def parquet_schema(pa, properties, fields=None):
+    """Arrow schema of exported documents, from the index mapping rather than the first rows
+
+    Dates stay the strings of _source; lexicon_hits is a map so that custom
+    lexicon categories are kept. Requested fields the mapping lacks are strings.
+    """
+    types = {'keyword': pa.string(), 'text': pa.string(), 'date': pa.string(),
+             'float': pa.float64(), 'integer': pa.int64(), 'long': pa.int64()}
+    columns = [('_id', pa.string())]
+    for field in (fields if fields is not None else properties):
+        if field == '_id':
+            continue
+        mapping = properties.get(field, {})
+        if mapping.get('type', 'object') == 'object' and 'properties' in mapping:
+            columns.append((field, pa.map_(pa.string(), pa.int64())))
+        else:
+            columns.append((field, types.get(mapping.get('type'), pa.string())))
+    return pa.schema(columns)
+
+
+class ParquetSink:
+    """Write exported documents as a Parquet file (requires pyarrow)"""
+
+    def __init__(self, path, properties, fields=None, row_group_size=50000):
+        """properties is the mapping of the exported index (its "properties" object)"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from e
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.row_group_size = row_group_size
+        self.schema = parquet_schema(pa, properties, fields)
+        self.writer = None
+        self.pending = []
+        self.unmapped = set()
+
+    def write(self, rows):
+        # Buffer pages so that row groups are large enough for efficient scans
+        self.pending.extend(rows)
+        if len(self.pending) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        unmapped = {key for row in self.pending for key in row} - set(self.schema.names)
+        if unmapped - self.unmapped:
+            logger.warning(f"Fields outside the index mapping are not exported to Parquet: "
+                           f"{sorted(unmapped - self.unmapped)}")
+            self.unmapped |= unmapped
+        table = self.pa.Table.from_pylist(self.pending, schema=self.schema)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.schema, compression='zstd')
+        self.writer.write_table(table)
+        self.pending = []
+
+    def close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
 class ElasticsearchIngestor:
+    STAGE = 'es_ingest'
+
     def __init__(self, 
-                 es_host="http://localhost:9200",
-                 mongo_uri="mongodb://localhost:27017/",
-                 index_name="harcelement_posts"):
-        """Initialize Elasticsearch and MongoDB connections"""
-        self.es = Elasticsearch([es_host])
-        self.mongo_client = MongoClient(mongo_uri)
+                 es_host=None,
+                 mongo_uri=None,
+                 index_name="harcelement_posts",
+                 checkpoint_path=None,
+                 serializer='auto',
+                 mapping_profile='standard'):
+        """Initialize Elasticsearch and MongoDB connections
+
+        es_host and mongo_uri default to $ES_HOST and $MONGO_URI; the pooled
+        clients are shared with the other stages (see connections.py).
+
+        serializer selects the JSON encoder of the client (see get_serializer);
+        orjson is used when installed.
+        mapping_profile is 'standard' or 'lean' (see MAPPING_PROFILES); fields the
+        profile does not map are left out of the indexed documents.
+        """
+        if mapping_profile not in MAPPING_PROFILES:
+            raise ValueError(f"Unknown mapping profile {mapping_profile!r}, "
+                             f"expected one of {sorted(MAPPING_PROFILES)}")
+        self.mapping_profile = mapping_profile
+        mapped_fields = MAPPING_PROFILES[mapping_profile]["mappings"]["properties"]
+        self.dropped_fields = tuple(field for field in STANDARD_MAPPING["mappings"]["properties"]
+                                    if field not in mapped_fields)
+        self.serializer = get_serializer(serializer)
+        self.es = get_es_client(es_host, serializer=self.serializer)
+        self.mongo_client = get_mongo_client(mongo_uri)
         self.db = self.mongo_client.harcelement
         self.collection = self.db.posts
         self.index_name = index_name
+        self.checkpoints = get_checkpoint_store(self.db, checkpoint_path)
+        self._queries = None
+
+    @property
+    def queries(self):
+        """Cached query service over the index, invalidated by every ingest"""
+        if self._queries is None or self._queries.es is not self.es:
+            self._queries = PostQueryService(self.es, self.index_name)
+        return self._queries
         
     def create_index_mapping(self):
-        """Create Elasticsearch index with proper mapping"""
-        mapping = {
-            "mappings": {
-                "properties": {
-                    "id_post": {"type": "keyword"},
-                    "titre": {"type": "text", "analyzer": "standard"},
-                    "contenu": {"type": "text", "analyzer": "standard"},
-                    "original_text": {"type": "text", "analyzer": "standard","fields": {"keyword": {"type": "keyword","ignore_above": 256
-    }}},
-                    "preprocessed_text": {"type": "text", "analyzer": "standard"},
-                    "auteur": {"type": "keyword"},
-                    "date": {"type": "date"},
-                    "url": {"type": "keyword"},
-                    "language": {"type": "keyword"},
-                    "sentiment": {"type": "keyword"},
-                    "polarity": {"type": "float"},
-                    "subjectivity": {"type": "float"},
-                    "vader_compound": {"type": "float"},
-                    "toxicity_score": {"type": "float"},
-                    "label": {"type": "keyword"},
-                    "type": {"type": "keyword"},
-                    "created_at": {"type": "date"},
-                    "nlp_processed_at": {"type": "date"}
-                }
-            },
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 0
-            }
-        }
-        
+        """Create Elasticsearch index with the mapping of the selected profile"""
+        mapping = MAPPING_PROFILES[self.mapping_profile]
+
         # Delete index if it exists
         if self.es.indices.exists(index=self.index_name):
             self.es.indices.delete(index=self.index_name)
@@ -64,79 +308,234 @@ class ElasticsearchIngestor:
         
         # Create new index
         self.es.indices.create(index=self.index_name, body=mapping)
+        notify_index_changed(self.index_name)
         logger.info(f"Created index: {self.index_name}")
     
-    def transform_document(self, mongo_doc):
-        """Transform MongoDB document for Elasticsearch"""
-        # Remove MongoDB ObjectId to avoid issues
-        if '_id' in mongo_doc:
-            del mongo_doc['_id']
-        
-        # Extract dates safely (MongoDB datetime to ISO string or pass as is)
+    def transform_document(self, mongo_doc, now=None):
+        """Transform MongoDB document for Elasticsearch
+
+        now replaces missing dates; transform_batch shares one value across a batch.
+        """
+        # The MongoDB ObjectId is never copied into es_doc, so the input is left untouched
+        # Dates stay datetime objects, the client serializer encodes them
+        if now is None:
+            now = datetime.now()
+
         def safe_date(val):
             if val is None:
-                return datetime.now()
+                return now
             return val
-        
+
+        id_post = str(mongo_doc.get('Id_post', ''))
+        original_text = mongo_doc.get('original_text', mongo_doc.get('Text', ''))
         es_doc = {
-            "id_post": str(mongo_doc.get('Id_post', '')),
-            "titre": f"Post {str(mongo_doc.get('Id_post', ''))[:8]}",  # Generate title
-            "contenu": mongo_doc.get('original_text', mongo_doc.get('Text', '')),
-            "original_text": mongo_doc.get('original_text', mongo_doc.get('Text', '')),
+            "id_post": id_post,
+            "titre": f"Post {id_post[:8]}",  # Generate title
+            "contenu": original_text,
+            "original_text": original_text,
             "preprocessed_text": mongo_doc.get('preprocessed_text', ''),
-            "auteur": f"user_{hash(mongo_doc.get('Id_post', '')) % 1000}",  # Anonymous author
+            "auteur": anonymous_author(mongo_doc.get('Id_post', '')),
             "date": safe_date(mongo_doc.get('created_at')),
-            "url": f"https://example.com/post/{mongo_doc.get('Id_post', '')}",
+            "url": f"https://example.com/post/{id_post}",
             "language": mongo_doc.get('language', 'unknown'),
             "sentiment": mongo_doc.get('sentiment', 'neutral'),
             "polarity": float(mongo_doc.get('polarity', 0.0)),
             "subjectivity": float(mongo_doc.get('subjectivity', 0.0)),
             "vader_compound": float(mongo_doc.get('vader_compound', 0.0)),
             "toxicity_score": float(mongo_doc.get('toxicity_score', 0.0)),
+            "predicted_toxicity": mongo_doc.get('predicted_toxicity'),
+            "lexicon_hits": mongo_doc.get('lexicon_hits', {}),
+            "lexicon_total": int(mongo_doc.get('lexicon_total', 0)),
             "label": mongo_doc.get('Label', ''),
             "type": mongo_doc.get('Types', ''),
             "created_at": safe_date(mongo_doc.get('created_at')),
             "nlp_processed_at": safe_date(mongo_doc.get('nlp_processed_at'))
         }
+        for field in self.dropped_fields:
+            del es_doc[field]
         
         return es_doc
-    
-    def bulk_index_documents(self, batch_size=100):
-        """Bulk index documents from MongoDB to Elasticsearch"""
-        total_docs = self.collection.count_documents({})
+
+    def transform_batch(self, documents):
+        """Transform a whole Mongo batch (any posts schema) into (ES _id, document) pairs"""
+        # Mongo _id as ES _id makes re-indexing a replayed batch idempotent
+        now = datetime.now()
+        transform = self.transform_document
+        return [(str(doc['_id']), transform(decode_document(doc), now)) for doc in documents]
+
+    def _send_bulk_body(self, body):
+        """Send one pre-encoded bulk body; returns (success, errors)"""
+        response = self.es.bulk(body=body)
+        success_count = 0
+        error_count = 0
+        for item in response['items']:
+            result = next(iter(item.values()))
+            if 200 <= result.get('status', 500) < 300:
+                success_count += 1
+            else:
+                error_count += 1
+                logger.error(f"Indexing error: {result}")
+        return success_count, error_count
+
+    def index_documents(self, documents):
+        """Index a batch of Mongo documents with one pre-encoded bulk request"""
+        body = encode_bulk_body(self.index_name, self.transform_batch(documents), self.serializer)
+        result = self._send_bulk_body(body)
+        notify_index_changed(self.index_name)
+        return result
+
+    def bulk_index_documents(self, batch_size=100, thread_count=4, resume=False,
+                             pre_encode=False):
+        """Bulk index documents from MongoDB to Elasticsearch
+
+        With pre_encode, each chunk of batch_size documents is encoded straight into
+        an NDJSON body and sent as is, instead of going through helpers.parallel_bulk.
+        """
+        last_id, stats = resume_point(self.checkpoints, self.STAGE, resume)
+        success_count = stats.get('success', 0)
+        error_count = stats.get('errors', 0)
+
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        total_docs = self.collection.count_documents(query)
         logger.info(f"Starting bulk indexing of {total_docs} documents")
+        if last_id is not None:
+            logger.info(f"Resuming after {last_id} ({success_count} documents already indexed)")
         
-        def doc_generator():
+        def doc_generator(actions):
             """Generator for bulk indexing"""
-            for doc in self.collection.find():
-                es_doc = self.transform_document(doc)
+            for doc_id, es_doc in actions:
                 yield {
                     "_index": self.index_name,
+                    "_id": doc_id,
                     "_source": es_doc
                 }
-        
-        # Perform bulk indexing
-        success_count = 0
-        error_count = 0
-        
-        for success, info in helpers.parallel_bulk(
-            self.es,
-            doc_generator(),
-            chunk_size=batch_size,
-            thread_count=4
-        ):
-            if success:
-                success_count += 1
+
+        # Read one Mongo batch per round of parallel bulk requests and checkpoint
+        # once every request of that round has been acknowledged
+        for documents in iter_id_batches(self.collection, batch_size * thread_count,
+                                         start_after=last_id):
+            batch_last_id = documents[-1]['_id']
+            actions = self.transform_batch(documents)
+
+            if pre_encode:
+                bodies = [
+                    encode_bulk_body(self.index_name, actions[start:start + batch_size],
+                                     self.serializer)
+                    for start in range(0, len(actions), batch_size)
+                ]
+                # Like parallel_bulk, one thread pool per round of requests
+                with ThreadPoolExecutor(max_workers=thread_count) as executor:
+                    for chunk_success, chunk_errors in executor.map(self._send_bulk_body,
+                                                                    bodies):
+                        success_count += chunk_success
+                        error_count += chunk_errors
             else:
-                error_count += 1
-                logger.error(f"Indexing error: {info}")
-            
-            if (success_count + error_count) % 100 == 0:
-                logger.info(f"Indexed {success_count} documents, {error_count} errors")
+                for success, info in helpers.parallel_bulk(
+                    self.es,
+                    doc_generator(actions),
+                    chunk_size=batch_size,
+                    thread_count=thread_count
+                ):
+                    if success:
+                        success_count += 1
+                    else:
+                        error_count += 1
+                        logger.error(f"Indexing error: {info}")
+
+            self.checkpoints.save(self.STAGE, batch_last_id,
+                                  {'success': success_count, 'errors': error_count})
+            # Query services of other processes are told once the run ends (see main)
+            notify_index_changed(self.index_name)
+            logger.info(f"Indexed {success_count} documents, {error_count} errors")
         
+        self.checkpoints.complete(self.STAGE)
         logger.info(f"Bulk indexing completed: {success_count} successful, {error_count} errors")
         return success_count, error_count
     
+    def index_properties(self):
+        """Mapped properties of the live index, whatever profile it was created with"""
+        properties = {}
+        # Keyed by concrete index: an alias may cover several
+        for index in self.es.indices.get_mapping(index=self.index_name).values():
+            properties.update(index['mappings'].get('properties', {}))
+        return properties
+
+    def export(self, output_path, fields=None, query=None, slices=4, page_size=1000,
+               keep_alive="5m", output_format=None):
+        """Export the index to JSONL or Parquet with parallel sliced search_after on a point-in-time"""
+        if output_format is None:
+            output_format = 'parquet' if output_path.endswith('.parquet') else 'jsonl'
+        if output_format == 'parquet':
+            sink = ParquetSink(output_path, self.index_properties(), fields)
+        else:
+            sink = JsonlSink(output_path)
+
+        # A point-in-time gives every slice the same consistent view of the index
+        pit_id = self.es.open_point_in_time(index=self.index_name, keep_alive=keep_alive)['id']
+        pages = queue.Queue(maxsize=slices * 2)  # bounded: slow writes throttle the searches
+        stop = threading.Event()
+
+        def export_slice(slice_id):
+            """Page through one slice and hand each page to the writer"""
+            try:
+                slice_pit_id = pit_id
+                search_after = None
+                while not stop.is_set():
+                    body = {
+                        "size": page_size,
+                        "query": query or {"match_all": {}},
+                        "pit": {"id": slice_pit_id, "keep_alive": keep_alive},
+                        "sort": [{"_shard_doc": "asc"}],
+                        "track_total_hits": False
+                    }
+                    if fields is not None:
+                        body["_source"] = fields
+                    if slices > 1:
+                        body["slice"] = {"id": slice_id, "max": slices}
+                    if search_after is not None:
+                        body["search_after"] = search_after
+
+                    result = self.es.search(body=body)
+                    slice_pit_id = result.get('pit_id', slice_pit_id)
+                    hits = result['hits']['hits']
+                    if not hits:
+                        break
+
+                    pages.put([dict(hit.get('_source', {}), _id=hit['_id']) for hit in hits])
+                    search_after = hits[-1]['sort']
+            finally:
+                pages.put(None)
+
+        exported_count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=slices) as executor:
+                futures = [executor.submit(export_slice, slice_id) for slice_id in range(slices)]
+                finished_slices = 0
+                try:
+                    while finished_slices < slices:
+                        rows = pages.get()
+                        if rows is None:
+                            finished_slices += 1
+                            continue
+                        sink.write(rows)
+                        exported_count += len(rows)
+                        if exported_count % (page_size * 10) < len(rows):
+                            logger.info(f"Exported {exported_count} documents")
+                finally:
+                    # On a writer error, unblock the slices and let them stop
+                    stop.set()
+                    while finished_slices < slices:
+                        if pages.get() is None:
+                            finished_slices += 1
+                for future in futures:
+                    future.result()
+        finally:
+            sink.close()
+            self.es.close_point_in_time(body={"id": pit_id})
+
+        logger.info(f"Export completed: {exported_count} documents written to {output_path}")
+        return exported_count
+
     def verify_indexing(self):
         """Verify that documents were indexed correctly"""
         self.es.indices.refresh(index=self.index_name)
@@ -144,65 +543,52 @@ class ElasticsearchIngestor:
         stats = self.es.indices.stats(index=self.index_name)
         doc_count = stats['indices'][self.index_name]['total']['docs']['count']
         
-        search_result = self.es.search(
-            index=self.index_name,
-            body={"query": {"match_all": {}}, "size": 3}
-        )
-        
         return {
             'document_count': doc_count,
-            'sample_documents': search_result['hits']['hits']
+            'sample_documents': self.queries.search(size=3)['documents']
         }
     
     def create_sample_queries(self):
-        """Create sample queries to test the index"""
-        queries = [
-            {
-                "name": "High toxicity posts",
-                "query": {
-                    "range": {
-                        "toxicity_score": {"gte": 0.7}
-                    }
-                }
-            },
-            {
-                "name": "Negative sentiment posts",
-                "query": {
-                    "term": {
-                        "sentiment": "negative"
-                    }
-                }
-            },
-            {
-                "name": "Bullying posts",
-                "query": {
-                    "term": {
-                        "label": "B"  # Assuming label 'B' means Bullying in your dataset
-                    }
-                }
-            }
-        ]
-        
-        results = {}
-        for query_info in queries:
-            result = self.es.search(
-                index=self.index_name,
-                body={"query": query_info["query"], "size": 5}
-            )
-            results[query_info["name"]] = {
-                "total_hits": result['hits']['total']['value'],
-                "sample_docs": result['hits']['hits']
-            }
-        
-        return results
+        """Run the sample queries (high toxicity, negative sentiment, bullying) through the cache"""
+        return {
+            name: {"total_hits": result['total_hits'], "sample_docs": result['documents']}
+            for name, result in self.queries.sample_queries().items()
+        }
 
 def main():
     """Main execution function"""
-    ingestor = ElasticsearchIngestor()
+    parser = add_resume_arguments(argparse.ArgumentParser(description="Index posts into Elasticsearch"))
+    parser.add_argument('--export', metavar='PATH', default=None,
+                        help='export the index to PATH (.jsonl or .parquet) instead of ingesting')
+    parser.add_argument('--fields', default=None,
+                        help='comma-separated _source fields to export (default: all)')
+    parser.add_argument('--slices', type=int, default=4,
+                        help='number of parallel export slices')
+    parser.add_argument('--serializer', choices=SERIALIZERS, default='auto',
+                        help='JSON encoder of the client (auto: orjson when installed)')
+    parser.add_argument('--pre-encode', action='store_true',
+                        help='encode bulk requests directly as NDJSON bodies')
+    parser.add_argument('--mapping-profile', choices=sorted(MAPPING_PROFILES), default='standard',
+                        help='index mapping (lean: text stored once, fewer indexed fields, '
+                             'sorted by created_at)')
+    args = parser.parse_args()
+
+    ingestor = ElasticsearchIngestor(checkpoint_path=args.checkpoint_file,
+                                     serializer=args.serializer,
+                                     mapping_profile=args.mapping_profile)
+
+    if args.export:
+        fields = args.fields.split(',') if args.fields else None
+        ingestor.export(args.export, fields=fields, slices=args.slices)
+        return
     
     try:
-        ingestor.create_index_mapping()
-        success_count, error_count = ingestor.bulk_index_documents()
+        # Keep the existing index when resuming, the checkpoint refers to its content
+        if not args.resume:
+            ingestor.create_index_mapping()
+        success_count, error_count = ingestor.bulk_index_documents(resume=args.resume,
+                                                                   pre_encode=args.pre_encode)
+        notify_index_changed(ingestor.index_name, ingestor.db, ingestor.es)
         verification = ingestor.verify_indexing()
         
         print(f"\nElasticsearch Ingestion Results:")
@@ -211,8 +597,7 @@ def main():
         print(f"Total documents in index: {verification['document_count']}")
         
         print(f"\nSample indexed documents:")
-        for hit in verification['sample_documents']:
-            doc = hit['_source']
+        for doc in verification['sample_documents']:
             print(f"ID: {doc['id_post'][:8]}...")
             print(f"Content: {doc['contenu'][:80]}...")
             print(f"Sentiment: {doc['sentiment']}, Toxicity: {doc['toxicity_score']:.2f}")
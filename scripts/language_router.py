@@ -0,0 +1,168 @@
+"""
+Language routing
+Detects the language of a post first and sends it to the processing chain
+configured for that language. The English chain runs the NLTK
+preprocessing and VADER/TextBlob; other languages take a cheap
+pass-through that only normalizes the text.
+
+Routing is opt-in (--language-routing). Short posts are often misdetected
+("Blonde people are bad" -> it), so a post only leaves the route of
+'unknown' (the full chain by default) when both detectors agree with
+enough confidence.
+"""
+
+import json
+
+import langid
+from langdetect import detect, detect_langs
+
+
+class LanguageChain:
+    """Analyzers applied to the posts routed to this chain"""
+
+    __slots__ = ('name', 'preprocess', 'sentiment')
+
+    def __init__(self, name, preprocess=True, sentiment=True):
+        self.name = name
+        self.preprocess = preprocess    # stopwords, POS tagging and lemmatization (English)
+        self.sentiment = sentiment      # VADER and TextBlob (English)
+
+    def __repr__(self):
+        return f"LanguageChain({self.name!r})"
+
+
+FULL_CHAIN = LanguageChain('full', preprocess=True, sentiment=True)
+PASSTHROUGH_CHAIN = LanguageChain('passthrough', preprocess=False, sentiment=False)
+CHAINS = {chain.name: chain for chain in (FULL_CHAIN, PASSTHROUGH_CHAIN)}
+
+# language code -> chain name, '*' for every other language.
+# Texts too short to detect ('unknown') are cheap, so they keep the full chain.
+DEFAULT_ROUTES = {'en': 'full', 'unknown': 'full', '*': 'passthrough'}
+
+# Below these, a detection is not trusted for routing
+MIN_ROUTING_WORDS = 5
+MIN_ROUTING_CONFIDENCE = 0.9
+
+
+def detect_language(text):
+    """Robust language detection using langdetect and langid"""
+    if not isinstance(text, str) or len(text.strip()) < 3:
+        return 'unknown'
+
+    try:
+        lang1 = detect(text)
+        lang2, _ = langid.classify(text)
+
+        # Use consensus or default to langid (more stable)
+        if lang1 == lang2:
+            return lang1
+        else:
+            return lang2
+    except Exception:
+        return 'unknown'
+
+
+def detect_language_confidence(text):
+    """(language, confidence) of a text; the language is the one of detect_language
+
+    confidence is the langdetect probability when langid agrees, 0 when they
+    disagree or the text has fewer than MIN_ROUTING_WORDS words.
+    """
+    if not isinstance(text, str) or len(text.strip()) < 3:
+        return 'unknown', 0.0
+
+    try:
+        candidates = detect_langs(text)
+        lang2, _ = langid.classify(text)
+    except Exception:
+        return 'unknown', 0.0
+    lang1 = candidates[0].lang
+    if lang1 != lang2 or len(text.split()) < MIN_ROUTING_WORDS:
+        return lang2, 0.0
+    return lang1, candidates[0].prob
+
+
+class LanguageRouter:
+    """Maps detected languages to processing chains and tracks per-language throughput"""
+
+    def __init__(self, routes=None, detector=detect_language_confidence,
+                 min_confidence=MIN_ROUTING_CONFIDENCE):
+        """detector(text) returns a language or a (language, confidence) pair"""
+        routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        unknown_chains = set(routes.values()) - set(CHAINS)
+        if unknown_chains:
+            raise ValueError(f"Unknown language chains {sorted(unknown_chains)}, "
+                             f"expected one of {sorted(CHAINS)}")
+        self.default_chain = CHAINS[routes.pop('*', PASSTHROUGH_CHAIN.name)]
+        self.routes = {language: CHAINS[name] for language, name in routes.items()}
+        self.detector = detector
+        self.min_confidence = min_confidence
+        self.stats = {}     # language -> [posts, seconds]
+
+    @classmethod
+    def from_file(cls, path, detector=detect_language_confidence):
+        """Load a {language: chain name} JSON file"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), detector=detector)
+
+    def detect(self, text):
+        """(language, chain) of a text; an uncertain detection takes the route of 'unknown'"""
+        detected = self.detector(text)
+        language, confidence = detected if isinstance(detected, tuple) else (detected, 1.0)
+        if confidence < self.min_confidence:
+            return language, self.route('unknown')
+        return language, self.route(language)
+
+    def route(self, language):
+        """Return the chain configured for a language"""
+        return self.routes.get(language, self.default_chain)
+
+    def analyze_text(self, preprocessor, text):
+        """Preprocess a text with the chain of its language; returns (language, AnalyzedDocument)"""
+        language, chain = self.detect(text)
+        if chain.preprocess:
+            return language, preprocessor.analyze_text(text)
+        return language, preprocessor.passthrough_text(text)
+
+    def record(self, language, seconds, posts=1):
+        """Account the processing time of posts of one language"""
+        stats = self.stats.setdefault(language, [0, 0.0])
+        stats[0] += posts
+        stats[1] += seconds
+
+    def throughput(self):
+        """Return {language: {'posts', 'seconds', 'posts_per_second', 'chain'}}, busiest first"""
+        report = {}
+        for language, (posts, seconds) in sorted(self.stats.items(),
+                                                 key=lambda item: -item[1][0]):
+            report[language] = {
+                'chain': self.route(language).name,
+                'posts': posts,
+                'seconds': round(seconds, 3),
+                'posts_per_second': round(posts / seconds, 1) if seconds else None
+            }
+        return report
+
+    def print_throughput(self):
+        for language, stats in self.throughput().items():
+            print(f"  {language:<8} {stats['chain']:<12} {stats['posts']:>8} posts "
+                  f"{stats['posts_per_second'] or '-':>10} posts/s")
+
+
+def add_language_arguments(parser):
+    """Add the --language-routing / --language-routes options shared by the stage scripts"""
+    parser.add_argument('--language-routing', action='store_true',
+                        help='send confidently non-English posts to the pass-through chain')
+    parser.add_argument('--language-routes', default=None, metavar='PATH',
+                        help='JSON {language: chain} routes, implies --language-routing (chains: '
+                             + ', '.join(sorted(CHAINS)) + "; '*' for other languages)")
+    return parser
+
+
+def get_language_router(args):
+    """Build the router selected on the command line, or None when routing is off (default)"""
+    if not (args.language_routing or args.language_routes):
+        return None
+    if args.language_routes:
+        return LanguageRouter.from_file(args.language_routes)
+    return LanguageRouter()
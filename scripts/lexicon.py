@@ -0,0 +1,116 @@
+"""
+Abuse lexicon matcher
+Compiles a term list grouped by harassment category (the values of
+scraper.types_mapping) into a single Aho-Corasick automaton over words and
+counts the hits of every category in one left-to-right pass over a text
+"""
+
+import json
+import os
+
+import numpy as np
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'abuse_lexicon.json')
+
+
+class AhoCorasick:
+    """Multi-pattern automaton whose alphabet is words, so matches respect word boundaries"""
+
+    def __init__(self):
+        self.goto = [{}]       # state -> {word: next state}
+        self.fail = [0]        # state -> longest proper suffix state
+        self.outputs = [[]]    # state -> payloads of the patterns ending here
+        self.compiled = False
+
+    def add(self, words, payload):
+        """Add a pattern (sequence of words) carrying a payload"""
+        state = 0
+        for word in words:
+            next_state = self.goto[state].get(word)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][word] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(payload)
+        self.compiled = False
+
+    def compile(self):
+        """Compute failure links breadth-first and merge the outputs along them"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            self.fail[state] = 0
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(word, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+        self.compiled = True
+        return self
+
+    def iter_matches(self, words):
+        """Yield the payload of every pattern occurrence in a sequence of words"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for word in words:
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if outputs[state]:
+                yield from outputs[state]
+
+
+class AbuseLexicon:
+    """Per-category term counter backed by one Aho-Corasick automaton"""
+
+    def __init__(self, terms_by_category):
+        self.categories = sorted(terms_by_category)
+        self.automaton = AhoCorasick()
+        for category_index, category in enumerate(self.categories):
+            for term in terms_by_category[category]:
+                words = term.lower().split()
+                if words:
+                    self.automaton.add(words, category_index)
+        self.automaton.compile()
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_LEXICON_PATH):
+        """Load a {category: [terms]} JSON file"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def count_word_codes(self, words):
+        """Return the hit count of every category as a list aligned with self.categories"""
+        counts = [0] * len(self.categories)
+        for category_index in self.automaton.iter_matches(words):
+            counts[category_index] += 1
+        return counts
+
+    def count_codes(self, text):
+        """Same as count_word_codes for a preprocessed text"""
+        return self.count_word_codes(text.split() if text else [])
+
+    def count_words(self, words):
+        """Return {category: hits} for already tokenized words (AnalyzedDocument.lemmas)"""
+        return dict(zip(self.categories, self.count_word_codes(words)))
+
+    def count(self, text):
+        """Return {category: hits} for a preprocessed text"""
+        return dict(zip(self.categories, self.count_codes(text)))
+
+    def count_batch(self, texts):
+        """Return an (n_texts, n_categories) matrix of hit counts"""
+        counts = np.zeros((len(texts), len(self.categories)), dtype=np.int32)
+        for row, text in enumerate(texts):
+            counts[row] = self.count_codes(text)
+        return counts
@@ -1,38 +1,83 @@
+import argparse
 import pymongo
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from textblob import TextBlob
-from langdetect import detect, DetectorFactory
-from langdetect.lang_detect_exception import LangDetectException
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from datetime import datetime
+import time
 import numpy as np
 from tqdm import tqdm  # for progress bar
-import langid
+from connections import get_mongo_client, get_mongo_db
+from checkpoint import add_resume_arguments, get_checkpoint_store, iter_id_batches, resume_point
+from work_queue import LeaseWorkQueue, run_worker, unit_query
+from batch import PostBatch
+from analysis import AnalyzedDocument
+from preprocessing import TextPreprocessor
+from lexicon import AbuseLexicon, DEFAULT_LEXICON_PATH
+from toxicity_model import ToxicityModel
+from posts_schema import decode_document, get_posts_schema
+from language_router import add_language_arguments, detect_language, get_language_router
+from spike_detector import (SPIKES_COLLECTION, add_spike_arguments, event_time, get_spike_detector,
+                            mongo_sink, replay)
+from term_sketch import SKETCHES_COLLECTION, add_term_arguments, get_term_analytics
+
+# Fields written by the NLP stage (plus nlp_processed_at)
+NLP_FIELDS = ('language', 'sentiment', 'polarity', 'subjectivity', 'vader_compound',
+              'toxicity_score')
+PREPROCESSING_FIELDS = ('original_text', 'preprocessed_text')
+LEXICON_FIELDS = ('lexicon_hits', 'lexicon_total')
+MODEL_FIELDS = ('predicted_toxicity',)
+
 class NLPPipeline:
-    def __init__(self, mongo_uri="mongodb://localhost:27017/"):
-        """Initialize MongoDB connection and NLP tools"""
-        self.vader_analyzer = SentimentIntensityAnalyzer()
-        self.client = MongoClient(mongo_uri)
+    STAGE = 'nlp'
+
+    def __init__(self, mongo_uri=None, checkpoint_path=None,
+                 preprocessor=None, lexicon=None, toxicity_model=None, router=None,
+                 spike_detector=None, vader_analyzer=None, term_analytics=None):
+        """Initialize MongoDB connection and NLP tools
+
+        mongo_uri defaults to $MONGO_URI; the pooled client is shared (see connections.py).
+
+        With a TextPreprocessor, preprocessing runs in the same pass: each post is
+        analyzed once and original_text/preprocessed_text are written too.
+        With an AbuseLexicon, per-category hit counts of preprocessed_text are
+        written to lexicon_hits and lexicon_total.
+        With a ToxicityModel, predicted_toxicity is written for every post,
+        labeled or not.
+        With a LanguageRouter, the language is detected first (or taken from the
+        routed preprocessing stage) and only posts routed to the full chain go
+        through the English analyzers.
+        With a SpikeDetector, every scored post is fed to it in created_at order
+        (see spike_detector.py): batch by batch, except for process_collection.
+        With a TermAnalytics, the preprocessed_text terms of the processed posts
+        not counted yet update the term sketches (see term_sketch.py).
+        vader_analyzer reuses an already loaded VADER analyzer (see worker_pool.py).
+        """
+        self.vader_analyzer = vader_analyzer or SentimentIntensityAnalyzer()
+        self.preprocessor = preprocessor
+        self.lexicon = lexicon
+        self.toxicity_model = toxicity_model
+        self.router = router
+        self.spike_detector = spike_detector
+        self.term_analytics = term_analytics
+        self.terms_skipped = 0
+        self._schema = None
+        self.client = get_mongo_client(mongo_uri)
         self.db = self.client.harcelement
         self.collection = self.db.posts
+        self.checkpoints = get_checkpoint_store(self.db, checkpoint_path)
     
 
+    @property
+    def schema(self):
+        """Storage layout of the posts collection (see posts_schema.py), read on first use"""
+        if self._schema is None:
+            self._schema = get_posts_schema(self.db)
+        return self._schema
+
     def detect_language(self, text):
         """Robust language detection using langdetect and langid"""
-        if not text or len(text.strip()) < 3:
-            return 'unknown'
-        
-        try:
-            lang1 = detect(text)
-            lang2, _ = langid.classify(text)
-            
-            # Use consensus or default to langid (more stable)
-            if lang1 == lang2:
-                return lang1
-            else:
-                return lang2
-        except Exception:
-            return 'unknown'
+        return detect_language(text)
 
 
     
@@ -66,7 +111,7 @@ class NLPPipeline:
         }
 
     
-    def calculate_toxicity_score(self, text, label, sentiment_data):
+    def calculate_toxicity_score(self, text, label, sentiment_data, word_count=None):
         base_score = 0.0
 
         # Labels précis pour ton dataset
@@ -86,29 +131,48 @@ class NLPPipeline:
             base_score += 0.1
 
         # Bonus si le texte est long (>10 mots)
-        if text and len(text.split()) > 10:
+        if word_count is None:
+            word_count = len(text.split()) if text else 0
+        if word_count > 10:
             base_score += 0.1
 
         return min(1.0, base_score)
 
 
-    def process_document(self, doc):
-        """Process a single document with NLP analysis"""
-        text = doc.get('preprocessed_text', doc.get('text', ''))
-        original_text = doc.get('original_text', doc.get('text', ''))
+    def analyze_document(self, doc, analyzed=None, language=None, chain=None):
+        """Run the NLP analysis of a document; returns (language, sentiment_data, toxicity_score)
+
+        analyzed is the AnalyzedDocument built by TextPreprocessor.analyze_text when
+        preprocessing runs in the same process; its text and word count are reused.
+        Sentiment runs on the raw text: VADER scores punctuation and capitals.
+        language and chain come from the LanguageRouter; a chain without sentiment
+        leaves the post neutral instead of running VADER/TextBlob on it.
+        """
+        if analyzed is None:
+            analyzed = AnalyzedDocument(doc.get('original_text', doc.get('text', '')))
+        original_text = analyzed.text
         label = doc.get('label', '')
         
         # Language detection
-        language = self.detect_language(original_text)
+        if language is None:
+            language = self.detect_language(original_text)
         
         # Sentiment analysis
-        sentiment_data = self.analyze_sentiment(original_text)
+        if chain is None or chain.sentiment:
+            sentiment_data = self.analyze_sentiment(original_text)
+        else:
+            sentiment_data = self.analyze_sentiment("")
 
         
         # Toxicity score calculation
         toxicity_score = self.calculate_toxicity_score(
-            original_text, label, sentiment_data
+            original_text, label, sentiment_data, word_count=analyzed.word_count
         )
+        return language, sentiment_data, toxicity_score
+
+    def process_document(self, doc):
+        """Process a single document with NLP analysis"""
+        language, sentiment_data, toxicity_score = self.analyze_document(doc)
         
         # Prepare update data
         update_data = {
@@ -116,39 +180,250 @@ class NLPPipeline:
             'sentiment': sentiment_data['sentiment'],
             'polarity': sentiment_data['polarity'],
             'subjectivity': sentiment_data['subjectivity'],
-            'vader_compound': sentiment_data['vader_compound'],
+            'vader_compound': sentiment_data.get('vader_compound', 0.0),
             'toxicity_score': toxicity_score,
             'nlp_processed_at': datetime.now()
         }
-
+        if self.spike_detector is not None:
+            self.spike_detector.observe(doc, toxicity_score)
         
         return update_data
+
+    def update_fields(self):
+        """Return the fields written back for each document"""
+        fields = NLP_FIELDS
+        if self.preprocessor is not None:
+            fields = fields + PREPROCESSING_FIELDS
+        if self.lexicon is not None:
+            fields = fields + LEXICON_FIELDS
+        if self.toxicity_model is not None:
+            fields = fields + MODEL_FIELDS
+        return fields
+
+    def analyze_batch(self, documents, strict=False):
+        """Analyze documents into a columnar PostBatch sharing one processing timestamp.
+
+        Failing documents are reported and left out unless strict is set.
+        """
+        batch = PostBatch(len(documents), processed_at=datetime.now())
+        failed_count = 0
+        model_texts = []
+
+        for doc in documents:
+            start = time.perf_counter()
+            try:
+                analyzed = language = chain = None
+                if self.router is not None:
+                    # Detected again: a stored language may predate the text or the routes
+                    language, chain = self.router.detect(
+                        doc.get('Text', '') if self.preprocessor is not None
+                        else doc.get('original_text', doc.get('text', '')))
+                if self.preprocessor is not None:
+                    if chain is not None and not chain.preprocess:
+                        analyzed = self.preprocessor.passthrough_text(doc.get('Text', ''))
+                    else:
+                        analyzed = self.preprocessor.analyze_text(doc.get('Text', ''))
+                language, sentiment_data, toxicity_score = self.analyze_document(
+                    doc, analyzed, language=language, chain=chain)
+            except Exception as e:
+                if strict:
+                    raise
+                print(f"Failed to process document {doc.get('_id')}: {e}")
+                failed_count += 1
+                continue
+            index = batch.append_analysis(doc.get('_id'), language, sentiment_data,
+                                          toxicity_score)
+            preprocessed_text = (analyzed.preprocessed_text if analyzed is not None
+                                 else doc.get('preprocessed_text', ''))
+            if analyzed is not None:
+                batch.set_extra(index, 'original_text', analyzed.text)
+                batch.set_extra(index, 'preprocessed_text', preprocessed_text)
+            if self.lexicon is not None:
+                hits = (self.lexicon.count_words(analyzed.lemmas) if analyzed is not None
+                        else self.lexicon.count(preprocessed_text))
+                batch.set_extra(index, 'lexicon_hits', hits)
+                batch.set_extra(index, 'lexicon_total', sum(hits.values()))
+            if self.toxicity_model is not None:
+                model_texts.append(preprocessed_text)
+            if self.router is not None:
+                self.router.record(language, time.perf_counter() - start)
+
+        # The model scores the whole batch with one sparse matrix-vector product
+        if self.toxicity_model is not None and model_texts:
+            batch.set_numeric_column('predicted_toxicity',
+                                     self.toxicity_model.predict_proba(model_texts))
+
+        return batch, failed_count
     
-    def process_collection(self, batch_size=50):
-        """Process all documents in the collection"""
-        total_docs = self.collection.count_documents({})
-        print(f"Total documents to process: {total_docs}")
-        
-        processed_count = 0
+    def process_batch(self, documents, observe_spikes=True):
+        """Analyze a batch of documents and write the results in one bulk request"""
+        documents = [decode_document(doc) for doc in documents]
+        batch, failed_count = self.analyze_batch(documents)
 
-        for skip in tqdm(range(0, total_docs, batch_size), desc="Processing Batches"):
-            documents = list(self.collection.find().skip(skip).limit(batch_size))
-            
-            for doc in documents:
-                try:
-                    update_data = self.process_document(doc)
-                    
-                    self.collection.update_one(
-                        {'_id': doc['_id']},
-                        {'$set': update_data}
-                    )
-                    processed_count += 1
-                    
-                except Exception as e:
-                    print(f"Failed to process document {doc.get('_id')}: {e}")
-                    continue
-        
+        bulk_updates = [
+            UpdateOne({'_id': row_id}, {'$set': update_data})
+            for row_id, update_data in batch.iter_updates(self.update_fields(), self.schema)
+        ]
+        if bulk_updates:
+            self.collection.bulk_write(bulk_updates, ordered=False)
+        if self.spike_detector is not None and observe_spikes:
+            self.observe_spikes(documents, batch)
+        if self.term_analytics is not None:
+            self.observe_terms(documents, batch)
+        return len(bulk_updates), failed_count
+
+    def observe_spikes(self, documents, batch):
+        """Feed the scored posts of a batch to the spike detector, in created_at order"""
+        documents_by_id = {doc.get('_id'): doc for doc in documents}
+        scored = [(documents_by_id[row_id], toxicity_score) for row_id, toxicity_score
+                  in zip(batch.ids, batch.column('toxicity_score').tolist())]
+        scored.sort(key=lambda item: event_time(item[0].get('created_at')) or 0.0)
+        for doc, toxicity_score in scored:
+            self.spike_detector.observe(doc, toxicity_score)
+
+    def observe_terms(self, documents, batch):
+        """Count the terms of the processed posts of a batch not counted yet in the sketches
+
+        Posts with terms_counted_at are already in the stored sketches, so re-runs,
+        replayed batches and retried work units do not count them again.
+        """
+        documents_by_id = {doc.get('_id'): doc for doc in documents}
+        for row_id, preprocessed_text in zip(batch.ids, batch.column('preprocessed_text')):
+            doc = documents_by_id[row_id]
+            if doc.get('terms_counted_at') is None:
+                self.term_analytics.observe(doc, preprocessed_text)
+            else:
+                self.terms_skipped += 1
+
+    def flush_terms(self):
+        if self.term_analytics is not None:
+            self.term_analytics.flush()
+
+    def report_terms(self):
+        if self.term_analytics is not None and self.terms_skipped:
+            print(f"Term sketches: {self.term_analytics.counted} posts counted, "
+                  f"{self.terms_skipped} already counted")
+            if not self.term_analytics.counted:
+                print("⚠️ No post counted: every processed post was already in the term "
+                      "sketches (run term_sketch.py build to recompute them)")
+
+    def process_collection(self, batch_size=50, resume=False):
+        """Process all documents in the collection
+
+        Posts are processed in _id order, not created_at order: with a spike
+        detector, the posts processed by the run are replayed to it in
+        created_at order once they are all scored.
+        """
+        last_id, stats = resume_point(self.checkpoints, self.STAGE, resume)
+        processed_count = stats.get('processed', 0)
+        failed_count = stats.get('failed', 0)
+
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        remaining_docs = self.collection.count_documents(query)
+        print(f"Total documents to process: {remaining_docs}")
+        if last_id is not None:
+            print(f"Resuming after {last_id} ({processed_count} documents already processed)")
+
+        progress = tqdm(total=remaining_docs, desc="Processing Documents")
+        for documents in iter_id_batches(self.collection, batch_size, start_after=last_id):
+            batch_processed, batch_failed = self.process_batch(documents, observe_spikes=False)
+            processed_count += batch_processed
+            failed_count += batch_failed
+
+            # Only checkpoint once the batch is committed
+            self.checkpoints.save(self.STAGE, documents[-1]['_id'],
+                                  {'processed': processed_count, 'failed': failed_count})
+            progress.update(len(documents))
+        progress.close()
+        self.flush_terms()
+        self.report_terms()
+        if self.spike_detector is not None:
+            replay(self.collection, self.spike_detector, self.schema, query=query)
+            print(f"Spike detector: {self.spike_detector.spikes} spikes")
+
+        self.checkpoints.complete(self.STAGE)
         print(f"✅ Finished processing {processed_count} documents.")
+        self.print_language_throughput()
+        return processed_count
+
+    def process_unit(self, unit, heartbeat=None, batch_size=50):
+        """Process the documents of one leased work unit"""
+        processed_count = 0
+        failed_count = 0
+
+        for documents in iter_id_batches(self.collection, batch_size, query=unit_query(unit)):
+            # Stop early if the lease expired and another worker took the unit over
+            if heartbeat is not None and heartbeat.lost.is_set():
+                break
+            batch_processed, batch_failed = self.process_batch(documents)
+            processed_count += batch_processed
+            failed_count += batch_failed
+
+        # Counts not saved when a worker dies are redone by the next run: the posts
+        # are only marked as counted once the sketches are saved
+        self.flush_terms()
+        return {'processed': processed_count, 'failed': failed_count}
+
+    def run_distributed_worker(self, job_name=STAGE, batch_size=50, unit_size=1000,
+                               lease_seconds=60):
+        """Join a distributed run: claim work units from pipeline_jobs until all are done"""
+        if self.spike_detector is not None:
+            # Each worker only sees its units, in _id order
+            raise ValueError("Spike detection needs the posts in created_at order: "
+                             "run spike_detector.py after a distributed run")
+        queue = LeaseWorkQueue(self.db.pipeline_jobs, job_name, lease_seconds=lease_seconds)
+        planned = queue.plan(self.collection, unit_size=unit_size)
+        if planned:
+            print(f"Planned {planned} work units of {unit_size} documents for job '{job_name}'")
+
+        print(f"Worker {queue.worker_id} joining job '{job_name}'")
+        completed_units = run_worker(
+            queue,
+            lambda unit, heartbeat: self.process_unit(unit, heartbeat, batch_size=batch_size)
+        )
+        print(f"✅ Worker {queue.worker_id} completed {completed_units} units. "
+              f"Job progress: {queue.progress()}")
+        self.report_terms()
+        self.print_language_throughput()
+        return completed_units
+
+    def print_language_throughput(self):
+        if self.router is not None and self.router.stats:
+            print("Throughput per language:")
+            self.router.print_throughput()
+
+    def _nlp_columns(self, batch):
+        fields = NLP_FIELDS + (LEXICON_FIELDS if self.lexicon is not None else ())
+        fields += MODEL_FIELDS if self.toxicity_model is not None else ()
+        columns = {field: batch.column(field) for field in fields}
+        columns['nlp_processed_at'] = [batch.processed_at] * len(batch)
+        return columns
+
+    def process_dataset(self, dataset):
+        """Run the NLP analysis on a file-backed Parquet dataset (see parquet_dataset.py)"""
+        if self.preprocessor is not None:
+            # Preprocessing and NLP share one analysis per post; both stage files are written
+            processed_count = 0
+            for part in dataset.parts():
+                batch, _ = self.analyze_batch(dataset.read_columns(part, ['Text', 'Label'])
+                                              .to_pylist(), strict=True)
+                dataset.write_stage(part, 'preprocessing',
+                                    {field: batch.column(field) for field in PREPROCESSING_FIELDS})
+                dataset.write_stage(part, self.STAGE, self._nlp_columns(batch))
+                processed_count += len(batch)
+            print(f"✅ Finished processing {processed_count} rows in {dataset.path}")
+            self.print_language_throughput()
+            return processed_count
+
+        input_columns = ['original_text', 'preprocessed_text', 'Label']
+
+        def process_part(table):
+            batch, _ = self.analyze_batch(table.to_pylist(), strict=True)
+            return self._nlp_columns(batch)
+
+        processed_count = dataset.map_stage(self.STAGE, input_columns, process_part)
+        print(f"✅ Finished processing {processed_count} rows in {dataset.path}")
+        self.print_language_throughput()
         return processed_count
 
     
@@ -159,12 +434,12 @@ class NLPPipeline:
                 '$group': {
                     '_id': None,
                     'total_docs': {'$sum': 1},
-                    'avg_toxicity': {'$avg': '$toxicity_score'},
+                    'avg_toxicity': {'$avg': '$' + self.schema.field('toxicity_score')},
                     'sentiment_distribution': {
-                        '$push': '$sentiment'
+                        '$push': '$' + self.schema.field('sentiment')
                     },
                     'language_distribution': {
-                        '$push': '$language'
+                        '$push': '$' + self.schema.field('language')
                     }
                 }
             }
@@ -175,7 +450,8 @@ class NLPPipeline:
             data = result[0]
             
             # Count sentiment distribution
-            sentiments = data['sentiment_distribution']
+            sentiments = [self.schema.decode_value('sentiment', value)
+                          for value in data['sentiment_distribution']]
             sentiment_counts = {
                 'positive': sentiments.count('positive'),
                 'negative': sentiments.count('negative'),
@@ -183,7 +459,8 @@ class NLPPipeline:
             }
             
             # Count language distribution
-            languages = data['language_distribution']
+            languages = [self.schema.decode_value('language', value)
+                         for value in data['language_distribution']]
             language_counts = {}
             for lang in set(languages):
                 language_counts[lang] = languages.count(lang)
@@ -199,10 +476,53 @@ class NLPPipeline:
 
 def main():
     """Main execution function"""
-    nlp_pipeline = NLPPipeline()
+    parser = add_resume_arguments(argparse.ArgumentParser(description="Run NLP analysis on posts"))
+    parser.add_argument('--distributed', action='store_true',
+                        help='run as one of several workers sharing the job through leases')
+    parser.add_argument('--job-name', default=NLPPipeline.STAGE,
+                        help='name of the distributed job (new name = new run)')
+    parser.add_argument('--unit-size', type=int, default=1000,
+                        help='documents per distributed work unit')
+    parser.add_argument('--lease-seconds', type=float, default=60,
+                        help='lease duration before a silent worker loses its unit')
+    parser.add_argument('--with-preprocessing', action='store_true',
+                        help='preprocess Text in the same pass (each post is tokenized once)')
+    parser.add_argument('--lexicon', nargs='?', const=DEFAULT_LEXICON_PATH, default=None,
+                        metavar='PATH',
+                        help='count abuse lexicon hits per category (default list if no PATH)')
+    parser.add_argument('--toxicity-model', default=None, metavar='PATH',
+                        help='write predicted_toxicity with a model trained by toxicity_model.py')
+    parser.add_argument('--detect-spikes', action='store_true',
+                        help=f'write toxicity spikes per type and auteur to {SPIKES_COLLECTION}')
+    parser.add_argument('--term-analytics', action='store_true',
+                        help=f'update the top/trending term sketches in {SKETCHES_COLLECTION}')
+    add_language_arguments(parser)
+    add_spike_arguments(parser)
+    add_term_arguments(parser)
+    args = parser.parse_args()
+    if args.distributed and args.detect_spikes:
+        parser.error("--detect-spikes needs the posts in created_at order, which --distributed "
+                     "workers do not see: run spike_detector.py after the run")
+
+    preprocessor = TextPreprocessor() if args.with_preprocessing else None
+    lexicon = AbuseLexicon.from_file(args.lexicon) if args.lexicon else None
+    toxicity_model = ToxicityModel.load(args.toxicity_model) if args.toxicity_model else None
+    spike_detector = (get_spike_detector(args, mongo_sink(get_mongo_db()[SPIKES_COLLECTION]))
+                      if args.detect_spikes else None)
+    term_analytics = get_term_analytics(args, get_mongo_db()) if args.term_analytics else None
+    nlp_pipeline = NLPPipeline(checkpoint_path=args.checkpoint_file, preprocessor=preprocessor,
+                               lexicon=lexicon, toxicity_model=toxicity_model,
+                               router=get_language_router(args), spike_detector=spike_detector,
+                               term_analytics=term_analytics)
     
     # Process all documents
-    processed_count = nlp_pipeline.process_collection()
+    if args.distributed:
+        nlp_pipeline.run_distributed_worker(job_name=args.job_name, unit_size=args.unit_size,
+                                            lease_seconds=args.lease_seconds)
+        processed_count = nlp_pipeline.collection.count_documents(
+            nlp_pipeline.schema.query({'nlp_processed_at': {'$exists': True}}))
+    else:
+        processed_count = nlp_pipeline.process_collection(resume=args.resume)
     
     # Get analysis summary
     summary = nlp_pipeline.get_analysis_summary()
@@ -218,7 +538,7 @@ def main():
         print(f"Language distribution: {summary['language_distribution']}")
     
     # Show sample processed documents
-    sample_docs = list(nlp_pipeline.collection.find().limit(3))
+    sample_docs = map(decode_document, nlp_pipeline.collection.find().limit(3))
     print("\nSample processed documents:")
     for doc in sample_docs:
         print(f"Text: {doc.get('original_text', '')[:80]}...")
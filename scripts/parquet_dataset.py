@@ -0,0 +1,237 @@
+"""
+Parquet dataset
+File-backed, columnar alternative to passing full documents through MongoDB
+between stages. The scraper writes the raw posts as row-partitioned Parquet
+files; each stage reads only the columns it needs (memory-mapped through
+Arrow) and stores its result columns in a sidecar file next to every part.
+MongoDB and Elasticsearch are then loaded from the final dataset.
+
+Layout:
+    dataset/part-00000.parquet                 raw posts from the scraper
+    dataset/part-00000.preprocessing.parquet   original_text, preprocessed_text
+    dataset/part-00000.nlp.parquet             language, sentiment, scores...
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+
+from bson import ObjectId
+from elasticsearch import helpers
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pymongo import ReplaceOne
+
+from connections import get_mongo_db
+from posts_schema import get_posts_schema
+from language_router import add_language_arguments, get_language_router
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_STAGE = 'base'
+
+
+class ParquetDataset:
+    """A directory of row-aligned Parquet parts plus one sidecar file per stage"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def parts(self):
+        """Return the names of the row partitions, in order"""
+        names = []
+        for file_path in sorted(glob.glob(os.path.join(self.path, 'part-*.parquet'))):
+            name = os.path.basename(file_path)[:-len('.parquet')]
+            if '.' not in name:
+                names.append(name)
+        return names
+
+    def stage_path(self, part, stage=BASE_STAGE):
+        """Return the file holding the columns a stage wrote for a part"""
+        suffix = '' if stage == BASE_STAGE else f'.{stage}'
+        return os.path.join(self.path, f'{part}{suffix}.parquet')
+
+    def stages(self, part):
+        """Return the stages available for a part, base first"""
+        stages = [BASE_STAGE]
+        for file_path in sorted(glob.glob(os.path.join(self.path, f'{part}.*.parquet'))):
+            stages.append(os.path.basename(file_path)[len(part) + 1:-len('.parquet')])
+        return stages
+
+    def write_table(self, table, rows_per_file=100000):
+        """Write raw posts as row partitions, replacing any previous dataset"""
+        os.makedirs(self.path, exist_ok=True)
+        for file_path in glob.glob(os.path.join(self.path, 'part-*.parquet')):
+            os.remove(file_path)
+
+        part_count = 0
+        for offset in range(0, max(table.num_rows, 1), rows_per_file):
+            part = f'part-{part_count:05d}'
+            pq.write_table(table.slice(offset, rows_per_file), self.stage_path(part),
+                           compression='zstd')
+            part_count += 1
+        logger.info(f"Wrote {table.num_rows} rows in {part_count} parts to {self.path}")
+        return part_count
+
+    def write_dataframe(self, df, rows_per_file=100000):
+        """Write a pandas DataFrame of raw posts as row partitions"""
+        return self.write_table(pa.Table.from_pandas(df, preserve_index=False), rows_per_file)
+
+    def read_columns(self, part, columns=None):
+        """Read the requested columns of a part, whichever stage file they live in"""
+        tables = []
+        missing = set(columns) if columns is not None else None
+        for stage in self.stages(part):
+            path = self.stage_path(part, stage)
+            schema = pq.read_schema(path, memory_map=True)
+            wanted = schema.names if missing is None else [c for c in schema.names if c in missing]
+            if not wanted:
+                continue
+            tables.append(pq.read_table(path, columns=wanted, memory_map=True))
+            if missing is not None:
+                missing.difference_update(wanted)
+
+        if missing:
+            raise KeyError(f"Columns {sorted(missing)} not found in {part}")
+
+        # Stage files are row-aligned with the base part, so join them side by side
+        table = tables[0]
+        for other in tables[1:]:
+            for name, column in zip(other.column_names, other.columns):
+                if name in table.column_names:
+                    table = table.set_column(table.column_names.index(name), name, column)
+                else:
+                    table = table.append_column(name, column)
+        if columns is not None:
+            table = table.select(list(columns))
+        return table
+
+    def write_stage(self, part, stage, columns):
+        """Store the result columns of a stage for a part (dict of name -> list or array)"""
+        table = pa.table(columns)
+        base_rows = pq.read_metadata(self.stage_path(part)).num_rows
+        if table.num_rows != base_rows:
+            raise ValueError(f"{stage} produced {table.num_rows} rows for {part}, "
+                             f"expected {base_rows}")
+        tmp_path = self.stage_path(part, stage) + '.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, self.stage_path(part, stage))
+
+    def map_stage(self, stage, input_columns, func):
+        """Run func(table) -> dict of result columns over every part"""
+        row_count = 0
+        for part in self.parts():
+            table = self.read_columns(part, input_columns)
+            self.write_stage(part, stage, func(table))
+            row_count += table.num_rows
+            logger.info(f"{stage}: processed {part} ({row_count} rows)")
+        return row_count
+
+    def iter_documents(self, columns=None):
+        """Yield every row of the final dataset as a document dict"""
+        for part in self.parts():
+            for batch in self.read_columns(part, columns).to_batches():
+                yield from batch.to_pylist()
+
+
+def post_object_id(doc):
+    """Deterministic MongoDB _id of a dataset row, derived from its Id_post
+
+    Loading the dataset again replaces the same documents, and the
+    Elasticsearch _id (the Mongo _id, as in es_ingest) is the same whichever
+    path indexes the post.
+    """
+    return ObjectId(hashlib.blake2b(f"post:{doc['Id_post']}".encode('utf-8'),
+                                    digest_size=12).digest())
+
+
+def load_to_mongo(dataset, collection, batch_size=1000, schema=None):
+    """Upsert the final dataset into a MongoDB collection (in the layout of schema, if given)"""
+    def write(batch):
+        collection.bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+                               for doc in batch], ordered=False)
+
+    batch = []
+    loaded_count = 0
+    for doc in dataset.iter_documents():
+        doc['_id'] = post_object_id(doc)
+        batch.append(schema.encode_document(doc) if schema is not None else doc)
+        if len(batch) >= batch_size:
+            write(batch)
+            loaded_count += len(batch)
+            batch = []
+    if batch:
+        write(batch)
+        loaded_count += len(batch)
+    logger.info(f"Loaded {loaded_count} documents into MongoDB")
+    return loaded_count
+
+
+def load_to_elasticsearch(dataset, ingestor, batch_size=500):
+    """Index the final dataset with the ingestor's transformation and index"""
+    def actions():
+        for doc in dataset.iter_documents():
+            yield {
+                "_index": ingestor.index_name,
+                "_id": str(post_object_id(doc)),
+                "_source": ingestor.transform_document(doc)
+            }
+
+    success_count = 0
+    error_count = 0
+    for success, info in helpers.streaming_bulk(ingestor.es, actions(), chunk_size=batch_size,
+                                                raise_on_error=False):
+        if success:
+            success_count += 1
+        else:
+            error_count += 1
+            logger.error(f"Indexing error: {info}")
+    logger.info(f"Indexed {success_count} documents, {error_count} errors")
+    return success_count, error_count
+
+
+def main():
+    """Run the pipeline stages on a Parquet dataset, then load the sinks"""
+    parser = argparse.ArgumentParser(description="Process a Parquet posts dataset offline")
+    parser.add_argument('path', help='dataset directory written by scraper.py --parquet')
+    parser.add_argument('--stages', default='preprocessing,nlp',
+                        help='comma-separated stages to run (preprocessing, nlp)')
+    parser.add_argument('--load', default='',
+                        help='comma-separated sinks to load afterwards (mongo, es)')
+    add_language_arguments(parser)
+    args = parser.parse_args()
+
+    dataset = ParquetDataset(args.path)
+    stages = [s for s in args.stages.split(',') if s]
+    sinks = [s for s in args.load.split(',') if s]
+
+    if 'preprocessing' in stages and 'nlp' in stages:
+        # Run both stages in one pass so every post is analyzed once
+        from nlp_pipeline import NLPPipeline
+        from preprocessing import TextPreprocessor
+        NLPPipeline(preprocessor=TextPreprocessor(),
+                    router=get_language_router(args)).process_dataset(dataset)
+    elif 'preprocessing' in stages:
+        from preprocessing import preprocess_dataset
+        preprocess_dataset(dataset)
+    elif 'nlp' in stages:
+        from nlp_pipeline import NLPPipeline
+        NLPPipeline(router=get_language_router(args)).process_dataset(dataset)
+
+    if 'mongo' in sinks:
+        db = get_mongo_db()
+        load_to_mongo(dataset, db.posts, schema=get_posts_schema(db))
+    if 'es' in sinks:
+        from es_ingest import ElasticsearchIngestor
+        from query_service import notify_index_changed
+        ingestor = ElasticsearchIngestor()
+        ingestor.create_index_mapping()
+        load_to_elasticsearch(dataset, ingestor)
+        notify_index_changed(ingestor.index_name, ingestor.db, ingestor.es)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Posts storage schema
+Version 1 stores posts with their long field names and category strings
+(see Mongodb_data.json). Version 2 is compact: the raw text is stored once
+(original_text is the unchanged Text), field names are short and
+categories are small integer codes.
+
+Stages read and write posts through PostSchema, which maps the logical
+(version 1) field names to the stored layout. The version of the posts
+collection is recorded in the schema_versions collection, and
+`python posts_schema.py migrate` rewrites the collection in batches.
+"""
+
+import argparse
+
+from pymongo import ReplaceOne
+
+from checkpoint import add_resume_arguments, get_checkpoint_store, iter_id_batches, resume_point
+from connections import get_mongo_db
+
+SCHEMA_COLLECTION = 'schema_versions'
+SCHEMA_VERSIONS = (1, 2)
+VERSION_FIELD = '_v'  # set on every version 2 document
+
+# Logical name -> stored name in version 2
+V2_FIELD_NAMES = {
+    'Id_post': 'i',
+    'Text': 't',
+    'preprocessed_text': 'p',
+    'Label': 'l',
+    'Types': 'y',
+    'created_at': 'c',
+    'language': 'g',
+    'sentiment': 's',
+    'polarity': 'po',
+    'subjectivity': 'su',
+    'vader_compound': 'v',
+    'toxicity_score': 'x',
+    'predicted_toxicity': 'px',
+    'lexicon_hits': 'h',
+    'lexicon_total': 'ht',
+    'nlp_processed_at': 'n',
+    'terms_counted_at': 'tc',
+}
+V2_LOGICAL_NAMES = {stored: logical for logical, stored in V2_FIELD_NAMES.items()}
+
+# Fields not stored in version 2 because they copy another field
+DERIVED_FIELDS = {'original_text': 'Text'}
+
+# Code tables of the categorical fields. Codes are positions, so values may only
+# be appended. Values outside a table are stored as plain strings.
+CATEGORY_VALUES = {
+    'Label': ('NB', 'B'),
+    'Types': ('none', 'religion', 'ethnicity', 'sexual', 'threats', 'vocational', 'troll',
+              'political', 'unknown'),
+    'sentiment': ('neutral', 'positive', 'negative'),
+    'language': ('en', 'unknown', 'es', 'it', 'fr', 'de', 'id', 'nl', 'da', 'fi', 'sv', 'ro',
+                 'pt', 'mt', 'pl', 'sw', 'cs', 'xh', 'et', 'eo', 'ms', 'ca', 'br', 'zh'),
+}
+CATEGORY_CODES = {field: {value: code for code, value in enumerate(values)}
+                  for field, values in CATEGORY_VALUES.items()}
+
+QUERY_VALUE_OPERATORS = ('$eq', '$ne')
+QUERY_LIST_OPERATORS = ('$in', '$nin')
+
+
+def decode_document(doc):
+    """Return a stored post with its logical field names and values, whatever its version"""
+    if doc.get(VERSION_FIELD) != 2:
+        return doc
+
+    logical = {}
+    for key, value in doc.items():
+        if key == VERSION_FIELD:
+            continue
+        name = V2_LOGICAL_NAMES.get(key, key)
+        values = CATEGORY_VALUES.get(name)
+        if values is not None and isinstance(value, int):
+            value = values[value]
+        logical[name] = value
+    for derived, source in DERIVED_FIELDS.items():
+        if source in logical:
+            logical.setdefault(derived, logical[source])
+    return logical
+
+
+class PostSchema:
+    """Accessor layer between the logical post fields and one storage layout"""
+
+    def __init__(self, version=1):
+        if version not in SCHEMA_VERSIONS:
+            raise ValueError(f"Unknown posts schema version {version}, "
+                             f"expected one of {SCHEMA_VERSIONS}")
+        self.version = version
+
+    def field(self, name):
+        """Stored name of a logical field (for queries, projections and aggregations)"""
+        if self.version == 1:
+            return name
+        name = DERIVED_FIELDS.get(name, name)
+        return V2_FIELD_NAMES.get(name, name)
+
+    def encode_value(self, name, value):
+        """Stored value of a logical field"""
+        if self.version == 1:
+            return value
+        codes = CATEGORY_CODES.get(name)
+        if codes is None or not isinstance(value, str):
+            return value
+        return codes.get(value, value)
+
+    def decode_value(self, name, value):
+        """Logical value of a stored field, given its logical name"""
+        values = CATEGORY_VALUES.get(name)
+        if self.version == 1 or values is None or not isinstance(value, int):
+            return value
+        return values[value]
+
+    def decode(self, doc):
+        return decode_document(doc)
+
+    def encode(self, fields):
+        """Stored form of logical fields, e.g. the $set of an update"""
+        if self.version == 1:
+            return fields
+        return {self.field(name): self.encode_value(name, value)
+                for name, value in fields.items() if name not in DERIVED_FIELDS}
+
+    def encode_column(self, name, values):
+        """Stored name and values of a logical column (None for fields derived on read)"""
+        if self.version == 1:
+            return name, values
+        if name in DERIVED_FIELDS:
+            return None
+        return self.field(name), [self.encode_value(name, value) for value in values]
+
+    def encode_document(self, doc):
+        """Stored form of a whole logical post (for inserts and replacements)"""
+        if self.version == 1:
+            return doc
+        stored = self.encode(doc)
+        stored[VERSION_FIELD] = self.version
+        return stored
+
+    def projection(self, names):
+        """Projection of logical fields that decode() can read back"""
+        projection = {self.field(name): 1 for name in names}
+        if self.version != 1:
+            projection[VERSION_FIELD] = 1
+        return projection
+
+    def query(self, query):
+        """Translate a filter on logical fields (top-level fields, $and/$or/$nor)"""
+        if self.version == 1 or not query:
+            return query
+        translated = {}
+        for key, condition in query.items():
+            if key in ('$and', '$or', '$nor'):
+                translated[key] = [self.query(part) for part in condition]
+            elif key.startswith('$'):
+                translated[key] = condition
+            else:
+                translated[self.field(key)] = self._encode_condition(key, condition)
+        return translated
+
+    def _encode_condition(self, name, condition):
+        if not isinstance(condition, dict) or not any(op.startswith('$') for op in condition):
+            return self.encode_value(name, condition)
+        encoded = {}
+        for op, operand in condition.items():
+            if op in QUERY_VALUE_OPERATORS:
+                operand = self.encode_value(name, operand)
+            elif op in QUERY_LIST_OPERATORS:
+                operand = [self.encode_value(name, value) for value in operand]
+            encoded[op] = operand
+        return encoded
+
+
+def get_posts_schema(db):
+    """Return the schema of db.posts, as recorded by the last migration (version 1 if none)"""
+    info = db[SCHEMA_COLLECTION].find_one({'_id': 'posts'}) or {}
+    if info.get('migrating_to') is not None:
+        raise RuntimeError(f"posts is being migrated to schema v{info['migrating_to']}; "
+                           "finish it with: python posts_schema.py migrate "
+                           f"--to {info['migrating_to']} --resume")
+    return PostSchema(info.get('version', 1))
+
+
+def collection_stats(db):
+    """Document count and sizes (bytes) of db.posts"""
+    stats = db.command('collStats', 'posts')
+    return {key: stats.get(key, 0)
+            for key in ('count', 'size', 'avgObjSize', 'storageSize', 'totalIndexSize')}
+
+
+def migrate_collection(db, target_version, batch_size=1000, resume=False, checkpoint_path=None):
+    """Rewrite every post of db.posts in the target layout, batch by batch"""
+    target = PostSchema(target_version)
+    collection = db.posts
+    checkpoints = get_checkpoint_store(db, checkpoint_path)
+    stage = f'schema_v{target_version}'
+    last_id, stats = resume_point(checkpoints, stage, resume)
+    migrated_count = stats.get('migrated', 0)
+
+    # Stages refuse to run on a half-migrated collection (see get_posts_schema)
+    db[SCHEMA_COLLECTION].update_one({'_id': 'posts'},
+                                     {'$set': {'migrating_to': target_version}}, upsert=True)
+
+    for documents in iter_id_batches(collection, batch_size, start_after=last_id):
+        # The _id of a replaced document is unchanged, so the _id walk is unaffected
+        collection.bulk_write([
+            ReplaceOne({'_id': doc['_id']}, target.encode_document(decode_document(doc)))
+            for doc in documents
+        ], ordered=False)
+        migrated_count += len(documents)
+        checkpoints.save(stage, documents[-1]['_id'], {'migrated': migrated_count})
+        print(f"Migrated {migrated_count} documents")
+
+    db[SCHEMA_COLLECTION].update_one(
+        {'_id': 'posts'},
+        {'$set': {'version': target_version}, '$unset': {'migrating_to': ''}},
+        upsert=True
+    )
+    checkpoints.complete(stage)
+    return migrated_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or migrate the posts storage schema")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='print the schema version and collection sizes')
+    migrate_parser = add_resume_arguments(
+        subparsers.add_parser('migrate', help='rewrite the posts collection in another layout'))
+    migrate_parser.add_argument('--to', type=int, choices=SCHEMA_VERSIONS, default=2)
+    migrate_parser.add_argument('--batch-size', type=int, default=1000)
+    migrate_parser.add_argument('--compact', action='store_true',
+                                help='run compact afterwards so the freed space is released')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    args = parser.parse_args()
+
+    db = get_mongo_db(args.mongo_uri)
+    info = db[SCHEMA_COLLECTION].find_one({'_id': 'posts'}) or {}
+    print(f"Schema version: {info.get('version', 1)}"
+          + (f" (migrating to v{info['migrating_to']})" if 'migrating_to' in info else ""))
+    print(f"Collection: {collection_stats(db)}")
+    if args.command == 'status':
+        return
+
+    migrated_count = migrate_collection(db, args.to, batch_size=args.batch_size,
+                                        resume=args.resume, checkpoint_path=args.checkpoint_file)
+    if args.compact:
+        db.command('compact', 'posts')
+    print(f"✅ Migrated {migrated_count} documents to schema v{args.to}")
+    print(f"Collection: {collection_stats(db)}")
+
+
+if __name__ == "__main__":
+    main()
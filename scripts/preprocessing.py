@@ -5,13 +5,19 @@ from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import word_tokenize
 from bs4 import BeautifulSoup
-from pymongo import MongoClient
 import nltk
 import warnings
 from bs4 import MarkupResemblesLocatorWarning
-from pymongo import MongoClient, UpdateOne 
+from pymongo import UpdateOne
 from nltk.corpus import wordnet
 from nltk import pos_tag 
+import argparse
+import time
+from analysis import AnalyzedDocument
+from connections import get_mongo_client
+from checkpoint import add_resume_arguments, get_checkpoint_store, iter_id_batches, resume_point
+from posts_schema import decode_document, get_posts_schema
+from language_router import add_language_arguments, get_language_router
 # Ignore BeautifulSoup's warning
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
@@ -68,12 +74,13 @@ class TextPreprocessor:
     
 
     # Apply lemmatization to tokens
-    def lemmatize_tokens(self, tokens):
+    def lemmatize_tokens(self, tokens, pos_tags=None):
         if not isinstance(tokens, list):
             raise ValueError("Input should be a list of tokens")
 
         try:
-            pos_tags = pos_tag(tokens)  # List of (token, POS) tuples
+            if pos_tags is None:
+                pos_tags = pos_tag(tokens)  # List of (token, POS) tuples
             return [
                 self.lemmatizer.lemmatize(token, self.get_wordnet_pos(tag))
                 for token, tag in pos_tags
@@ -81,13 +88,9 @@ class TextPreprocessor:
         except LookupError:
             # Fallback to simple lemmatization if POS tagging fails
             return [self.lemmatizer.lemmatize(token) for token in tokens]
-        
-    # Complete preprocessing pipeline
-    def preprocess_text(self, text):
-        if pd.isna(text) or text == "":
-            return ""
-        
 
+    # Lowercase and clean a text (language independent)
+    def normalize_text(self, text):
         text = str(text).lower()
         
         # Remove HTML tags
@@ -100,73 +103,146 @@ class TextPreprocessor:
         text = self.clean_special_chars(text)
         
         # Remove punctuation and digits
-        text = self.remove_punctuation_and_digits(text)
+        return self.remove_punctuation_and_digits(text)
+
+    # Analyze a text once, keeping the lemmas for the lexicon
+    def analyze_text(self, text):
+        analyzed = AnalyzedDocument(text)
+        if pd.isna(text) or text == "":
+            return analyzed
+
+        text = self.normalize_text(text)
         
         # Tokenize
         tokens = word_tokenize(text, preserve_line=True)
         
         # Remove stopwords
         tokens = self.remove_stopwords(tokens)
+
+        # POS tagging (lemmatization falls back without it)
+        try:
+            analyzed.pos_tags = pos_tag(tokens)
+        except LookupError:
+            analyzed.pos_tags = None
         
         # Lemmatization
-        tokens = self.lemmatize_tokens(tokens)
+        tokens = self.lemmatize_tokens(tokens, analyzed.pos_tags)
         
         # Filter out empty tokens
-        tokens = [token for token in tokens if len(token) > 1]
+        analyzed.lemmas = [token for token in tokens if len(token) > 1]
+        analyzed.preprocessed_text = ' '.join(analyzed.lemmas)
+        
+        return analyzed
         
-        return ' '.join(tokens)
+    # Cheap chain for languages the English tools don't support: normalization only
+    def passthrough_text(self, text):
+        analyzed = AnalyzedDocument(text)
+        if pd.isna(text) or text == "":
+            return analyzed
+
+        analyzed.lemmas = self.normalize_text(text).split()
+        analyzed.preprocessed_text = ' '.join(analyzed.lemmas)
+        return analyzed
+
+    # Complete preprocessing pipeline
+    def preprocess_text(self, text):
+        return self.analyze_text(text).preprocessed_text
 
 
 class MongoPreprocessor:
+    STAGE = 'preprocessing'
+
     # Initialize MongoDB connection and preprocessor
-    def __init__(self, mongo_uri="mongodb://localhost:27017/"):
-        self.client = MongoClient(mongo_uri)
+    # With a LanguageRouter, the language is detected first and written too; only the
+    # posts routed to the full chain go through the English preprocessing
+    # mongo_uri defaults to $MONGO_URI (see connections.py)
+    def __init__(self, mongo_uri=None, checkpoint_path=None, router=None):
+        self.client = get_mongo_client(mongo_uri)
         self.db = self.client.harcelement
         self.collection = self.db.posts
         self.preprocessor = TextPreprocessor()
+        self.router = router
+        self.checkpoints = get_checkpoint_store(self.db, checkpoint_path)
         
     # Preprocess documents in the MongoDB collection
-    def preprocess_collection(self, batch_size=100):
-        total_docs = self.collection.count_documents({})
-        processed_count = 0
-
-        for skip in range(0, total_docs, batch_size):
-            documents = list(self.collection.find().skip(skip).limit(batch_size))
+    def preprocess_collection(self, batch_size=100, resume=False):
+        schema = get_posts_schema(self.db)
+        last_id, stats = resume_point(self.checkpoints, self.STAGE, resume)
+        processed_count = stats.get('processed', 0)
+
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        total_docs = processed_count + self.collection.count_documents(query)
+        if last_id is not None:
+            print(f"Resuming after {last_id} ({processed_count} documents already processed)")
+
+        for documents in iter_id_batches(self.collection, batch_size, start_after=last_id,
+                                         projection=schema.projection(['Text'])):
             bulk_updates = []
 
-            for doc in documents:
+            for doc in map(decode_document, documents):
                 original_text = doc.get('Text', '')
-                preprocessed_text = self.preprocessor.preprocess_text(original_text)
-
-                bulk_updates.append(
-                    UpdateOne(
-                        {'_id': doc['_id']},
-                        {'$set': {
-                            'original_text': original_text,
-                            'preprocessed_text': preprocessed_text
-                        }}
-                    )
-                )
+                update_data = {'original_text': original_text}
+                if self.router is not None:
+                    start = time.perf_counter()
+                    language, analyzed = self.router.analyze_text(self.preprocessor,
+                                                                  original_text)
+                    update_data['language'] = language
+                    update_data['preprocessed_text'] = analyzed.preprocessed_text
+                    self.router.record(language, time.perf_counter() - start)
+                else:
+                    update_data['preprocessed_text'] = self.preprocessor.preprocess_text(original_text)
+
+                # $set is idempotent, so replaying a batch after a crash is harmless
+                bulk_updates.append(UpdateOne({'_id': doc['_id']},
+                                              {'$set': schema.encode(update_data)}))
                 processed_count += 1
 
             if bulk_updates:
-                self.collection.bulk_write(bulk_updates)  # bulk update here
+                self.collection.bulk_write(bulk_updates, ordered=False)  # bulk update here
+
+            # Only checkpoint once the batch is committed
+            self.checkpoints.save(self.STAGE, documents[-1]['_id'],
+                                  {'processed': processed_count})
 
             print(f"Processed {processed_count}/{total_docs} documents")
 
+        self.checkpoints.complete(self.STAGE)
         print("Preprocessing completed!")
+        if self.router is not None:
+            print("Throughput per language:")
+            self.router.print_throughput()
         return processed_count
 
 
-        
+# Preprocess a file-backed Parquet dataset (see parquet_dataset.py)
+def preprocess_dataset(dataset, preprocessor=None):
+    preprocessor = preprocessor or TextPreprocessor()
+
+    def preprocess_part(table):
+        texts = table.column('Text').to_pylist()
+        return {
+            'original_text': texts,
+            'preprocessed_text': [preprocessor.preprocess_text(text) for text in texts]
+        }
+
+    processed_count = dataset.map_stage('preprocessing', ['Text'], preprocess_part)
+    print(f"Preprocessed {processed_count} rows in {dataset.path}")
+    return processed_count
+
+
 def main():
-    mongo_preprocessor = MongoPreprocessor()
+    parser = add_resume_arguments(argparse.ArgumentParser(description="Preprocess posts in MongoDB"))
+    add_language_arguments(parser)
+    args = parser.parse_args()
+
+    mongo_preprocessor = MongoPreprocessor(checkpoint_path=args.checkpoint_file,
+                                           router=get_language_router(args))
     
     # Preprocess all documents
-    processed_count = mongo_preprocessor.preprocess_collection()
+    processed_count = mongo_preprocessor.preprocess_collection(resume=args.resume)
     
     # Show sample of preprocessed data
-    sample_docs = list(mongo_preprocessor.collection.find().limit(3))
+    sample_docs = map(decode_document, mongo_preprocessor.collection.find().limit(3))
     print("\nSample preprocessed documents:")
     for doc in sample_docs:
         print(f"Original: {doc.get('original_text', '')[:100]}...")
@@ -0,0 +1,430 @@
+"""
+Cached query service
+Typed API over the common queries of the posts index (high toxicity,
+negative sentiment, bullying posts, filtered searches, counts, top and
+trending terms from the term sketches of term_sketch.py) with a
+TTL/LRU result cache and coalescing of identical in-flight requests, so
+dashboards and alerting jobs firing the same queries cost Elasticsearch
+one request per cache period. The cache is dropped whenever an ingest
+writes to the index (see notify_index_changed). Can also be served over
+a local HTTP endpoint.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from connections import get_es_client, get_mongo_db
+from term_sketch import SKETCHES_COLLECTION, top_terms, trending_terms
+
+GENERATIONS_COLLECTION = 'index_generations'
+
+# Services of this process, invalidated directly by notify_index_changed
+_services = weakref.WeakSet()
+
+
+def notify_index_changed(index_name, db=None, es=None):
+    """Invalidate the cached results of an index after new data was written
+
+    Services in this process are invalidated at once; with db, the generation
+    counter polled by services of other processes is bumped too. With es, the
+    index is refreshed first, so queries after the notification see the new
+    documents; without it, services cache results for at most refresh_seconds
+    after the invalidation (see PostQueryService).
+    """
+    if es is not None:
+        es.indices.refresh(index=index_name)
+    for service in list(_services):
+        if service.index_name == index_name:
+            service.invalidate()
+    if db is not None:
+        db[GENERATIONS_COLLECTION].update_one({'_id': index_name},
+                                              {'$inc': {'generation': 1}}, upsert=True)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_entries=512, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()    # key -> (expires_at, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key, value, ttl=None):
+        """Cache a value for ttl seconds (default: the cache ttl)"""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PostFilter:
+    """Filters on the posts index; every criterion is optional"""
+
+    __slots__ = ('label', 'type', 'sentiment', 'language', 'min_toxicity', 'max_toxicity',
+                 'since', 'until', 'text')
+
+    def __init__(self, label=None, type=None, sentiment=None, language=None, min_toxicity=None,
+                 max_toxicity=None, since=None, until=None, text=None):
+        self.label = label
+        self.type = type
+        self.sentiment = sentiment
+        self.language = language
+        self.min_toxicity = min_toxicity
+        self.max_toxicity = max_toxicity
+        self.since = since          # created_at bounds, ES date strings or date math
+        self.until = until
+        self.text = text            # full-text match on contenu
+
+    def replace(self, **changes):
+        """Return a copy with some criteria changed"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return PostFilter(**values)
+
+    def to_query(self):
+        """Return the ES bool query of the filters (match_all when empty)"""
+        filters = [{"term": {field: getattr(self, attribute)}}
+                   for attribute, field in (('label', 'label'), ('type', 'type'),
+                                            ('sentiment', 'sentiment'),
+                                            ('language', 'language'))
+                   if getattr(self, attribute) is not None]
+        toxicity = {bound: value for bound, value in (('gte', self.min_toxicity),
+                                                      ('lte', self.max_toxicity))
+                    if value is not None}
+        if toxicity:
+            filters.append({"range": {"toxicity_score": toxicity}})
+        created_at = {bound: value for bound, value in (('gte', self.since), ('lte', self.until))
+                      if value is not None}
+        if created_at:
+            filters.append({"range": {"created_at": created_at}})
+        must = [{"match": {"contenu": self.text}}] if self.text else []
+
+        if not filters and not must:
+            return {"match_all": {}}
+        # Filters do not score, so Elasticsearch can cache them too
+        return {"bool": {"filter": filters, "must": must}}
+
+
+class PostQueryService:
+    """Cached, coalescing query API over the posts index"""
+
+    def __init__(self, es=None, index_name="harcelement_posts", db=None, ttl=30.0,
+                 max_entries=512, poll_seconds=1.0, refresh_seconds=1.0,
+                 term_bucket_seconds=86400):
+        """es defaults to the shared client (see connections.py)
+
+        With db, the generation counter bumped by ingests in other processes is
+        polled at most every poll_seconds; ingests in this process invalidate
+        the cache directly.
+        Written documents only become searchable at the next index refresh, so
+        results fetched less than refresh_seconds (the index refresh_interval)
+        after an invalidation are only cached until that refresh.
+        term_bucket_seconds is the time bucket the term sketches were built with.
+        """
+        self.es = es if es is not None else get_es_client()
+        self.index_name = index_name
+        self.db = db
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.poll_seconds = poll_seconds
+        self.refresh_seconds = refresh_seconds
+        self.term_bucket_seconds = term_bucket_seconds
+        self.invalidated_at = None
+        self.lock = threading.Lock()
+        self.in_flight = {}         # key -> Future of the request being run
+        self.generation = 0         # bumped on every invalidation
+        self.index_generation = None
+        self.next_poll = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0}
+        _services.add(self)
+
+    def invalidate(self):
+        """Drop every cached result; requests already running are not cached"""
+        with self.lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            self.stats['invalidations'] += 1
+        self.cache.clear()
+
+    def _poll_generation(self):
+        if self.db is None or time.monotonic() < self.next_poll:
+            return
+        self.next_poll = time.monotonic() + self.poll_seconds
+        info = self.db[GENERATIONS_COLLECTION].find_one({'_id': self.index_name}) or {}
+        generation = info.get('generation', 0)
+        if self.index_generation is not None and generation != self.index_generation:
+            self.invalidate()
+        self.index_generation = generation
+
+    def _entry_ttl(self):
+        """TTL of an entry filled now: shortened until the refresh after the last invalidation"""
+        if self.invalidated_at is None:
+            return None
+        until_refresh = self.invalidated_at + self.refresh_seconds - time.monotonic()
+        return until_refresh if 0 < until_refresh < self.cache.ttl else None
+
+    def _cached(self, key, fetch):
+        """Return the cached result of key, or run fetch once for all concurrent callers"""
+        self._poll_generation()
+        found, value = self.cache.get(key)
+        if found:
+            with self.lock:
+                self.stats['hits'] += 1
+            return value
+
+        with self.lock:
+            # The previous leader may have filled the cache since the lookup above
+            found, value = self.cache.get(key)
+            if found:
+                self.stats['hits'] += 1
+                return value
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                generation = self.generation
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            with self.lock:
+                # A result fetched across an invalidation may predate the new data
+                if generation == self.generation:
+                    self.cache.put(key, value, self._entry_ttl())
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def _search(self, body):
+        key = ('search', json.dumps(body, sort_keys=True, default=str))
+
+        def fetch():
+            result = self.es.search(index=self.index_name, body=body)
+            return {
+                'total_hits': result['hits']['total']['value'],
+                'documents': [dict(hit['_source'], _id=hit['_id'])
+                              for hit in result['hits']['hits']]
+            }
+
+        return self._cached(key, fetch)
+
+    def search(self, post_filter=None, size=10, sort_by_date=False):
+        """Return {'total_hits', 'documents'} of the posts matching a PostFilter"""
+        body = {"query": (post_filter or PostFilter()).to_query(), "size": size}
+        if sort_by_date:
+            body["sort"] = [{"created_at": "desc"}]
+        return self._search(body)
+
+    def high_toxicity(self, min_score=0.7, size=5, post_filter=None):
+        return self.search((post_filter or PostFilter()).replace(min_toxicity=min_score),
+                           size=size)
+
+    def negative_sentiment(self, size=5, post_filter=None):
+        return self.search((post_filter or PostFilter()).replace(sentiment='negative'),
+                           size=size)
+
+    def bullying_posts(self, size=5, post_filter=None):
+        return self.search((post_filter or PostFilter()).replace(label='B'), size=size)
+
+    def count(self, post_filter=None):
+        """Number of posts matching a PostFilter"""
+        query = (post_filter or PostFilter()).to_query()
+        key = ('count', json.dumps(query, sort_keys=True, default=str))
+        return self._cached(key, lambda: self.es.count(index=self.index_name,
+                                                       body={"query": query})['count'])
+
+    def _sketches(self):
+        if self.db is None:
+            raise ValueError("Term queries read the term sketches: the service needs a db")
+        return self.db[SKETCHES_COLLECTION]
+
+    def top_terms(self, post_filter=None, size=20):
+        """[(term, count, error)] most frequent in posts of a PostFilter (type, label, dates)"""
+        post_filter = post_filter or PostFilter()
+        key = ('top-terms', post_filter.type, post_filter.label, post_filter.since,
+               post_filter.until, size)
+        return self._cached(key, lambda: top_terms(
+            self._sketches(), post_filter.type, post_filter.label,
+            parse_date(post_filter.since), parse_date(post_filter.until), size))
+
+    def trending_terms(self, post_filter=None, size=20, window_days=7, baseline_days=28):
+        """Terms rising in the window_days before post_filter.until (see trending_terms)"""
+        post_filter = post_filter or PostFilter()
+        key = ('trending-terms', post_filter.type, post_filter.label, post_filter.until, size,
+               window_days, baseline_days)
+        return self._cached(key, lambda: trending_terms(
+            self._sketches(), post_filter.type, post_filter.label, parse_date(post_filter.until),
+            timedelta(days=window_days), timedelta(days=baseline_days), size,
+            bucket_seconds=self.term_bucket_seconds))
+
+    def sample_queries(self, size=5):
+        """The sample queries of ElasticsearchIngestor.create_sample_queries"""
+        return {
+            "High toxicity posts": self.high_toxicity(size=size),
+            "Negative sentiment posts": self.negative_sentiment(size=size),
+            "Bullying posts": self.bullying_posts(size=size),
+        }
+
+
+DATE_MATH = re.compile(r'now(?:([+-])(\d+)([smhdw]))?')
+DATE_MATH_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_date(value):
+    """Naive UTC datetime of an ISO date or of now[+-]N(s|m|h|d|w), as the term sketch buckets
+
+    Term sketches do not go through Elasticsearch, so only this subset of its
+    date math is understood; anything else raises ValueError.
+    """
+    if value is None:
+        return None
+    match = DATE_MATH.fullmatch(value)
+    if match is not None:
+        date = datetime.now(timezone.utc).replace(tzinfo=None)
+        sign, amount, unit = match.groups()
+        if amount is not None:
+            offset = timedelta(**{DATE_MATH_UNITS[unit]: int(amount)})
+            date = date + offset if sign == '+' else date - offset
+        return date
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"invalid date {value!r}: expected an ISO date or now-7d") from None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+FILTER_PARAMETERS = {
+    'label': str, 'type': str, 'sentiment': str, 'language': str, 'min_toxicity': float,
+    'max_toxicity': float, 'since': str, 'until': str, 'text': str,
+}
+
+# Routes reading the term sketches, whose dates are parsed by parse_date
+TERM_ROUTES = ('/top-terms', '/trending-terms')
+
+
+def make_handler(service):
+    """Build the HTTP handler serving the query service as JSON"""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        routes = {
+            '/search': lambda f, size: service.search(f, size=size),
+            '/high-toxicity': lambda f, size: service.high_toxicity(
+                min_score=f.min_toxicity if f.min_toxicity is not None else 0.7,
+                size=size, post_filter=f),
+            '/negative': lambda f, size: service.negative_sentiment(size=size, post_filter=f),
+            '/bullying': lambda f, size: service.bullying_posts(size=size, post_filter=f),
+            '/count': lambda f, size: {'count': service.count(f)},
+            '/top-terms': lambda f, size: service.top_terms(f, size=size),
+            '/trending-terms': lambda f, size: service.trending_terms(f, size=size),
+            '/stats': lambda f, size: dict(service.stats, cached=len(service.cache)),
+        }
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            route = self.routes.get(url.path)
+            if route is None:
+                return self._reply(404, {'error': f"unknown path {url.path}",
+                                         'paths': sorted(self.routes)})
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                post_filter = PostFilter(**{name: FILTER_PARAMETERS[name](value)
+                                            for name, value in params.items()
+                                            if name in FILTER_PARAMETERS})
+                size = int(params.get('size', 10))
+                if url.path in TERM_ROUTES:
+                    parse_date(post_filter.since)
+                    parse_date(post_filter.until)
+            except ValueError as e:
+                return self._reply(400, {'error': str(e)})
+            try:
+                self._reply(200, route(post_filter, size))
+            except Exception as e:
+                self._reply(502, {'error': str(e)})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload, default=str, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    """Serve the query service over HTTP until interrupted"""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Query service listening on http://{host}:{port} "
+          f"(paths: {', '.join(sorted(make_handler(service).routes))})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve cached queries over the posts index")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--index', default="harcelement_posts")
+    parser.add_argument('--ttl', type=float, default=30.0, help='cache lifetime in seconds')
+    parser.add_argument('--max-entries', type=int, default=512)
+    parser.add_argument('--bucket-hours', type=float, default=24,
+                        help='time bucket the term sketches were built with')
+    args = parser.parse_args()
+
+    service = PostQueryService(index_name=args.index, db=get_mongo_db(), ttl=args.ttl,
+                               max_entries=args.max_entries,
+                               term_bucket_seconds=int(args.bucket_hours * 3600))
+    serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
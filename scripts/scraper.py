@@ -10,10 +10,65 @@ types_mapping = {
 }
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient
+from connections import get_mongo_db
+from posts_schema import get_posts_schema
 from datetime import datetime
 from datetime import datetime, timedelta
 import random
+import argparse
+
+
+# Normalize a raw Types value (lowercase, common misspellings fixed)
+def normalize_types(val):
+    if pd.isna(val):
+        return np.nan
+    val = val.strip().lower()
+    return types_mapping.get(val, val)
+
+
+# Normalize a raw Label value to B / NB
+def normalize_label(val):
+    if pd.isna(val):
+        return np.nan
+    val = val.strip().lower()
+    if not val:
+        return np.nan
+    if val[0] == 'n':
+        return 'NB'
+    else :
+        return 'B'
+
+
+# Normalize one raw post record the way the CSV load does (for streamed records)
+# Raises ValueError when the record cannot be stored as a post
+def normalize_record(record):
+    if not isinstance(record, dict):
+        raise ValueError(f"record is not an object: {record!r:.80}")
+    for field in ('Text', 'Label', 'Types'):
+        if record.get(field) is not None and not isinstance(record[field], str):
+            raise ValueError(f"{field} is not a string: {record[field]!r:.80}")
+    label = normalize_label(record.get('Label'))
+    types = normalize_types(record.get('Types'))
+    if pd.isna(label):
+        label = 'NB'
+    if pd.isna(types):
+        types = 'none' if label == 'NB' else 'unknown'
+    created_at = record.get('created_at')
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    elif created_at is not None and not isinstance(created_at, datetime):
+        raise ValueError(f"created_at is not a date: {created_at!r:.80}")
+    normalized = {
+        'Text': record.get('Text', ''),
+        'Label': label,
+        'Types': types,
+        'created_at': created_at or datetime.now(),
+    }
+    if record.get('Id_post') is not None:
+        normalized['Id_post'] = record['Id_post']
+    return normalized
+
+
 class Scraper:
     def __init__(self, data_path):
         self.data_path = data_path
@@ -52,18 +107,9 @@ class Scraper:
         print(f"Dropped {initial - final} duplicate rows. Remaining records: {final}")
     
     def normalize_types(self,val):
-        if pd.isna(val):
-            return np.nan
-        val = val.strip().lower()
-        return types_mapping.get(val, val)
+        return normalize_types(val)
     def normalize_label(self,val):
-        if pd.isna(val):
-            return np.nan
-        val = val.strip().lower()
-        if val[0] == 'n':
-            return 'NB'
-        else :
-            return 'B'
+        return normalize_label(val)
     #apply a function to a column in the DataFrame
     def apply_function(self, column_name, func):
         if self.df is not None and column_name in self.df.columns:
@@ -114,15 +160,24 @@ class Scraper:
         return post_time
     def insert_to_mongo(self):
         try:
-            client = MongoClient("mongodb://localhost:27017/")
-            db = client['harcelement']
+            # Shared pooled client: no connection setup per call
+            db = get_mongo_db()
+            schema = get_posts_schema(db)
             collection = db['posts']
-            collection.insert_many(self.df.to_dict(orient='records'))
+            collection.insert_many([schema.encode_document(record)
+                                    for record in self.df.to_dict(orient='records')])
             print("Data loaded into MongoDB successfully.")
         except Exception as e:
             print(f"Error loading data into MongoDB: {e}")
-        finally:
-            client.close()
+
+    # Write the data as a row-partitioned Parquet dataset instead of MongoDB
+    def write_parquet(self, dataset_path, rows_per_file=100000):
+        from parquet_dataset import ParquetDataset
+
+        dataset = ParquetDataset(dataset_path)
+        part_count = dataset.write_dataframe(self.df, rows_per_file=rows_per_file)
+        print(f"Data written to {part_count} Parquet parts in {dataset_path}.")
+        return dataset
   
         
 
@@ -132,6 +187,11 @@ class Scraper:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the raw posts CSV")
+    parser.add_argument('--parquet', metavar='DIR', default=None,
+                        help='write a Parquet dataset to DIR instead of loading MongoDB')
+    args = parser.parse_args()
+
     scraper = Scraper(DATA_PATH)
     df = scraper.load_data()
     if df is None:
@@ -152,4 +212,7 @@ if __name__ == "__main__":
     df['created_at'] = [scraper.generate_post_time("2024-01-01", "2024-12-31") for _ in range(len(df))]
     scraper.visualization('Label')
     scraper.visualization('Types')
-    scraper.insert_to_mongo()
+    if args.parquet:
+        scraper.write_parquet(args.parquet)
+    else:
+        scraper.insert_to_mongo()
@@ -0,0 +1,323 @@
+"""
+Toxicity spike detection
+Streaming aggregator fed with the posts scored by the NLP pipeline. For each
+Types value and each auteur it keeps sliding-window statistics (post count,
+mean toxicity_score) in a ring of time buckets, and the EWMA mean/variance
+of the toxicity mass of past buckets (sum of toxicity_score per bucket).
+A bucket whose mass reaches `threshold` standard deviations above the EWMA
+emits a spike event to a callback, e.g. the toxicity_spikes collection.
+
+Work per post is O(1) and memory is bounded: buckets per key are fixed and
+keys are evicted least recently used. Time is the created_at of the posts,
+which must arrive roughly in that order: a late post still inside the window
+of its key updates the window statistics and the EWMA mean but cannot raise
+a spike, and a post older than the window is dropped (counted in `late`).
+The NLP pipeline sorts each batch by created_at, and replays a backfill
+(processed in _id order) in created_at order once it is scored, like
+`python spike_detector.py` does to backtest the detector.
+"""
+
+import argparse
+import json
+import math
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from analysis import anonymous_author
+from connections import get_mongo_db
+from posts_schema import decode_document, get_posts_schema
+
+SPIKES_COLLECTION = 'toxicity_spikes'
+
+# Key kind -> function returning the key of a logical post
+KEY_FUNCTIONS = {
+    'type': lambda doc: doc.get('Types') or 'unknown',
+    'auteur': lambda doc: doc.get('auteur') or anonymous_author(doc.get('Id_post', '')),
+}
+
+REPLAY_FIELDS = ('Id_post', 'Types', 'created_at', 'toxicity_score')
+
+# Floor of the EWMA standard deviation, so that a key with a quiet history needs
+# a few toxic posts in one bucket to spike, not a single one
+MIN_STD = 0.5
+
+
+def event_time(value):
+    """Seconds since the epoch of a created_at value (datetime, ISO string or number)"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return event_time(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    return None
+
+
+class WindowStats:
+    """Sliding window of one key: bucket ring plus EWMA of the bucket toxicity mass"""
+
+    __slots__ = ('counts', 'sums', 'window_count', 'window_sum', 'bucket', 'mean', 'var',
+                 'closed', 'alerted')
+
+    def __init__(self, bucket_count, bucket, closed=0):
+        self.counts = [0] * bucket_count
+        self.sums = [0.0] * bucket_count
+        self.window_count = 0
+        self.window_sum = 0.0
+        self.bucket = bucket        # index (time // bucket_seconds) of the current bucket
+        self.mean = 0.0             # EWMA of the toxicity mass of closed buckets
+        self.var = 0.0
+        self.closed = closed        # closed buckets seen, for the warm-up
+        self.alerted = False        # a spike was emitted for the current bucket
+
+
+class SpikeDetector:
+    """Per Types/auteur sliding-window statistics with EWMA z-score spike detection"""
+
+    def __init__(self, on_spike=None, keys=('type', 'auteur'), window_seconds=3600,
+                 bucket_seconds=300, alpha=0.1, threshold=4.0, min_posts=5, warmup_buckets=12,
+                 max_keys=10000):
+        """on_spike(event) receives every spike event (see spike_event)
+
+        A bucket is flagged when its toxicity mass is `threshold` EWMA standard
+        deviations above the EWMA mean (alpha per bucket) and it holds at least
+        min_posts posts, once the detector has seen warmup_buckets buckets. A key
+        seen for the first time has an empty history, so a new auteur posting a
+        burst is flagged too. At most max_keys keys per kind are kept.
+        """
+        self.on_spike = on_spike
+        self.key_functions = {kind: KEY_FUNCTIONS[kind] for kind in keys}
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = max(1, int(window_seconds // bucket_seconds))
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_posts = min_posts
+        self.warmup_buckets = warmup_buckets
+        self.max_keys = max_keys
+        self.windows = {kind: OrderedDict() for kind in self.key_functions}
+        self.first_bucket = None
+        self.observed = 0
+        self.late = 0
+        self.spikes = 0
+
+    def observe(self, doc, toxicity_score=None, created_at=None):
+        """Account one logical post; returns the spike events it triggered
+
+        toxicity_score and created_at default to the fields of doc; a post
+        without created_at counts at the current time.
+        """
+        if toxicity_score is None:
+            toxicity_score = doc.get('toxicity_score') or 0.0
+        timestamp = event_time(created_at if created_at is not None else doc.get('created_at'))
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc).timestamp()
+        bucket = int(timestamp // self.bucket_seconds)
+        if self.first_bucket is None:
+            self.first_bucket = bucket
+        self.observed += 1
+
+        events = []
+        late = False
+        for kind, key_function in self.key_functions.items():
+            key = key_function(doc)
+            window = self._window(kind, key, bucket)
+            if bucket <= window.bucket - self.bucket_count:
+                late = True
+                continue
+            event = self._add(window, bucket, float(toxicity_score))
+            if event is not None:
+                event.update(kind=kind, key=key, id_post=doc.get('Id_post'))
+                events.append(event)
+        self.late += late
+
+        for event in events:
+            self.spikes += 1
+            if self.on_spike is not None:
+                self.on_spike(event)
+        return events
+
+    def _window(self, kind, key, bucket):
+        windows = self.windows[kind]
+        window = windows.get(key)
+        if window is None:
+            window = windows[key] = WindowStats(self.bucket_count, bucket,
+                                                closed=max(0, bucket - self.first_bucket))
+            if len(windows) > self.max_keys:
+                windows.popitem(last=False)
+        else:
+            windows.move_to_end(key)
+        return window
+
+    def _close_bucket(self, window, mass):
+        # Incremental EWMA of mean and variance
+        delta = mass - window.mean
+        window.mean += self.alpha * delta
+        window.var = (1 - self.alpha) * (window.var + self.alpha * delta * delta)
+        window.closed += 1
+
+    def _close_empty_buckets(self, window, count):
+        # Closed form of count _close_bucket(window, 0.0) calls
+        decay = (1 - self.alpha) ** count
+        window.var = decay * (window.var + window.mean * window.mean * (1 - decay))
+        window.mean *= decay
+        window.closed += count
+
+    def _advance(self, window, bucket):
+        steps = bucket - window.bucket
+        slot = window.bucket % self.bucket_count
+        self._close_bucket(window, window.sums[slot])
+        if steps > 1:
+            self._close_empty_buckets(window, steps - 1)
+
+        if steps >= self.bucket_count:
+            window.counts = [0] * self.bucket_count
+            window.sums = [0.0] * self.bucket_count
+            window.window_count = 0
+            window.window_sum = 0.0
+        else:
+            for step in range(1, steps + 1):
+                slot = (window.bucket + step) % self.bucket_count
+                window.window_count -= window.counts[slot]
+                window.window_sum -= window.sums[slot]
+                window.counts[slot] = 0
+                window.sums[slot] = 0.0
+        window.bucket = bucket
+        window.alerted = False
+
+    def _add(self, window, bucket, toxicity_score):
+        if bucket > window.bucket:
+            self._advance(window, bucket)
+        slot = bucket % self.bucket_count
+        window.counts[slot] += 1
+        window.sums[slot] += toxicity_score
+        window.window_count += 1
+        window.window_sum += toxicity_score
+        if bucket < window.bucket:
+            # A late post goes to its own bucket, already closed: its score is added to the
+            # EWMA mean with the weight that bucket has now (the variance is left as is)
+            weight = self.alpha * (1 - self.alpha) ** (window.bucket - bucket - 1)
+            window.mean += weight * toxicity_score
+            return None
+
+        mass = window.sums[slot]
+        std = math.sqrt(window.var)
+        z_score = (mass - window.mean) / max(std, MIN_STD)
+        if (window.alerted or window.closed < self.warmup_buckets
+                or window.counts[slot] < self.min_posts or z_score < self.threshold):
+            return None
+        window.alerted = True
+        return self.spike_event(window, mass, z_score)
+
+    def spike_event(self, window, mass, z_score):
+        bucket_start = window.bucket * self.bucket_seconds
+        return {
+            'bucket_start': datetime.fromtimestamp(bucket_start, timezone.utc),
+            'bucket_end': datetime.fromtimestamp(bucket_start + self.bucket_seconds,
+                                                 timezone.utc),
+            'bucket_posts': window.counts[window.bucket % self.bucket_count],
+            'toxicity_mass': round(mass, 4),
+            'ewma_mean': round(window.mean, 4),
+            'ewma_std': round(math.sqrt(window.var), 4),
+            'z_score': round(z_score, 2),
+            'window_posts': window.window_count,
+            'window_mean_toxicity': round(window.window_sum / window.window_count, 4),
+            'detected_at': datetime.now(timezone.utc),
+        }
+
+    def snapshot(self, kind, key):
+        """Current window statistics of a key (None if not tracked)"""
+        window = self.windows[kind].get(key)
+        if window is None:
+            return None
+        return {
+            'window_posts': window.window_count,
+            'window_mean_toxicity': (window.window_sum / window.window_count
+                                     if window.window_count else 0.0),
+            'ewma_mean': window.mean,
+            'ewma_std': math.sqrt(window.var),
+        }
+
+
+def mongo_sink(collection):
+    """on_spike callback inserting spike events into a Mongo collection"""
+    def insert(event):
+        collection.insert_one(dict(event))
+    return insert
+
+
+def print_spike(event):
+    print(f"Spike {event['kind']}={event['key']} at {event['bucket_start']:%Y-%m-%d %H:%M}: "
+          f"{event['bucket_posts']} posts, mass {event['toxicity_mass']:.2f} "
+          f"(z={event['z_score']:.1f}, window mean {event['window_mean_toxicity']:.2f})")
+
+
+def replay(collection, detector, schema, since=None, until=None, batch_size=1000, query=None):
+    """Feed the scored posts of a collection to a detector in created_at order
+
+    query adds criteria (logical field names), e.g. the _id range of a run.
+    """
+    created_at = schema.field('created_at')
+    query = dict(query or {}, toxicity_score={'$exists': True})
+    bounds = {op: value for op, value in (('$gte', since), ('$lt', until)) if value is not None}
+    if bounds:
+        query['created_at'] = bounds
+    cursor = collection.find(schema.query(query), schema.projection(REPLAY_FIELDS),
+                             batch_size=batch_size).sort(created_at, 1)
+
+    replayed = 0
+    for doc in map(decode_document, cursor):
+        detector.observe(doc)
+        replayed += 1
+    return replayed
+
+
+def add_spike_arguments(parser):
+    """Add the detector options to an argument parser"""
+    parser.add_argument('--window-seconds', type=int, default=3600)
+    parser.add_argument('--bucket-seconds', type=int, default=300)
+    parser.add_argument('--alpha', type=float, default=0.1, help='EWMA weight of a new bucket')
+    parser.add_argument('--threshold', type=float, default=4.0, help='z-score of a spike')
+    parser.add_argument('--min-posts', type=int, default=5,
+                        help='posts needed in a bucket before it can spike')
+    return parser
+
+
+def get_spike_detector(args, on_spike):
+    return SpikeDetector(on_spike, window_seconds=args.window_seconds,
+                         bucket_seconds=args.bucket_seconds, alpha=args.alpha,
+                         threshold=args.threshold, min_posts=args.min_posts)
+
+
+def main():
+    parser = add_spike_arguments(argparse.ArgumentParser(
+        description="Backtest the toxicity spike detector on the scored posts"))
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--store', action='store_true',
+                        help=f'insert the spikes into {SPIKES_COLLECTION} (default: print them)')
+    parser.add_argument('--output', default=None, help='also write the spikes to this JSONL file')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    args = parser.parse_args()
+
+    db = get_mongo_db(args.mongo_uri)
+    spikes = []
+
+    def on_spike(event):
+        spikes.append(event)
+        print_spike(event)
+        if args.store:
+            db[SPIKES_COLLECTION].insert_one(dict(event, replay=True))
+
+    detector = get_spike_detector(args, on_spike)
+    replayed = replay(db.posts, detector, get_posts_schema(db), since=args.since, until=args.until)
+    print(f"✅ Replayed {replayed} posts: {len(spikes)} spikes")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for event in spikes:
+                f.write(json.dumps(event, default=str) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Spool directory ingest
+Tails the JSONL files that collectors drop into a spool directory and
+loads the posts continuously: records are normalized like the CSV load
+(scraper.py), grouped into micro-batches bounded in size and latency,
+inserted with insert_many and optionally run through the NLP and
+Elasticsearch stages at once.
+
+The read offset of every file is committed to the checkpoint store after
+its batch has gone through all stages, so a restart continues where the
+last committed batch ended. Post _ids are derived from the file, the time
+it was first seen (kept in the checkpoint, also by --from-start) and the
+line offset, so a replayed batch is skipped as duplicate keys instead of
+being inserted twice. A bounded queue sits between the reader and the writer:
+when MongoDB slows down the reader stops and the records wait on disk.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from checkpoint import get_checkpoint_store
+from connections import get_mongo_db
+from posts_schema import get_posts_schema
+from scraper import normalize_record
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_END_OF_SCAN = object()
+
+
+def record_id(file_state, offset):
+    """Deterministic ObjectId of the record starting at offset in a spool file
+
+    The timestamp part is the time the file was first seen, so posts of newer
+    files sort after older ones like generated ObjectIds.
+    """
+    digest = hashlib.blake2b(f"{file_state['name']}:{offset}".encode('utf-8'),
+                             digest_size=8).digest()
+    return ObjectId(int(file_state['first_seen']).to_bytes(4, 'big') + digest)
+
+
+class SpoolIngestor:
+    """Continuous micro-batched ingest of a spool directory of JSONL files"""
+    STAGE = 'spool'
+
+    def __init__(self, spool_dir, collection, checkpoints, schema=None, stages=(),
+                 pattern='*.jsonl', batch_size=500, max_latency=1.0, poll_interval=0.5,
+                 max_pending=4, from_start=False):
+        """stages are callables run on each inserted batch (stored documents)
+
+        A batch is flushed at batch_size records or max_latency seconds after
+        its first record. At most max_pending batches are buffered between the
+        reader and the writer. from_start reads every file again from its start;
+        the first_seen times are kept so the records get the same _ids.
+        """
+        self.spool_dir = spool_dir
+        self.collection = collection
+        self.checkpoints = checkpoints
+        self.schema = schema if schema is not None else get_posts_schema(collection.database)
+        self.stages = list(stages)
+        self.pattern = pattern
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.poll_interval = poll_interval
+        self.pending = queue.Queue(maxsize=max_pending * batch_size)
+        self.stop_event = threading.Event()
+        self.reading = {}       # name -> state of the reader, ahead of the committed offsets
+        self.listed = set()
+        self.reader_error = None
+        checkpoint = checkpoints.load(self.STAGE) or {}
+        self.files = dict(checkpoint.get('last_id') or {})     # name -> committed state
+        if from_start:
+            self.files = {name: dict(state, offset=0) for name, state in self.files.items()}
+        self.stats = dict({'inserted': 0, 'duplicates': 0, 'invalid': 0, 'batches': 0},
+                          **(checkpoint.get('stats') or {}))
+        self.latencies = []
+
+    def _mtime(self, name):
+        try:
+            return os.path.getmtime(os.path.join(self.spool_dir, name))
+        except FileNotFoundError:
+            return 0.0
+
+    def spool_files(self):
+        """Names of the spool files, oldest first"""
+        names = [name for name in os.listdir(self.spool_dir)
+                 if fnmatch.fnmatch(name, self.pattern)]
+        return sorted(names, key=lambda name: (self._mtime(name), name))
+
+    def read_records(self, name, state):
+        """Yield (record, file state, start, end) of the complete lines after state['read']"""
+        path = os.path.join(self.spool_dir, name)
+        if os.path.getsize(path) <= state['read']:
+            return
+        with open(path, 'rb') as f:
+            f.seek(state['read'])
+            for line in iter(f.readline, b''):
+                if not line.endswith(b'\n'):
+                    # A partial last line is read again once the collector finishes it
+                    return
+                start = state['read']
+                state['read'] += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping invalid line at {name}:{start}")
+                    self.stats['invalid'] += 1
+                    continue
+                yield record, state, start, state['read']
+
+    def scan(self):
+        """Queue the new records of every spool file; returns the number queued"""
+        queued = 0
+        names = self.spool_files()
+        self.listed = set(names)
+        for name in names:
+            committed = self.files.get(name)
+            state = self.reading.setdefault(name, {
+                'name': name,
+                'first_seen': committed['first_seen'] if committed else time.time(),
+                'read': committed['offset'] if committed else 0,
+            })
+            try:
+                for item in self.read_records(name, state):
+                    if not self._put(item):
+                        return queued
+                    queued += 1
+            except FileNotFoundError:
+                # Removed by the collector since the listing
+                continue
+        return queued
+
+    def _put(self, item):
+        # Blocks while the writer is behind: this is the backpressure
+        while not self.stop_event.is_set():
+            try:
+                self.pending.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_loop(self, once):
+        try:
+            while not self.stop_event.is_set():
+                if not self.scan() and once:
+                    break
+                if not once:
+                    self.stop_event.wait(self.poll_interval)
+        except Exception as e:
+            self.reader_error = e
+        finally:
+            self._put(_END_OF_SCAN)
+
+    def flush(self, items):
+        """Insert one micro-batch, run the stages, then commit the file offsets"""
+        start = time.perf_counter()
+        # _ids depend on the time a file was first seen: record it before inserting
+        new_files = {state['name']: {'offset': 0, 'first_seen': state['first_seen']}
+                     for _, state, _, _ in items if state['name'] not in self.files}
+        if new_files:
+            self.files.update(new_files)
+            self.checkpoints.save(self.STAGE, self.files, self.stats)
+
+        documents = []
+        for record, state, offset, _ in items:
+            # An invalid record is skipped like an invalid line: retrying would not fix it
+            try:
+                doc = normalize_record(record)
+            except ValueError as e:
+                logger.warning(f"Skipping invalid record at {state['name']}:{offset}: {e}")
+                self.stats['invalid'] += 1
+                continue
+            doc['_id'] = record_id(state, offset)
+            doc.setdefault('Id_post', int.from_bytes(doc['_id'].binary[4:10], 'big'))
+            documents.append(self.schema.encode_document(doc))
+
+        if documents:
+            self.insert(documents)
+            for stage in self.stages:
+                stage(documents)
+
+        for _, state, _, end in items:
+            self.files[state['name']] = {'offset': end, 'first_seen': state['first_seen']}
+        for name in [name for name in self.files if self.listed and name not in self.listed]:
+            del self.files[name]
+        self.stats['batches'] += 1
+        self.checkpoints.save(self.STAGE, self.files, self.stats)
+        self.latencies.append(time.perf_counter() - start)
+        del self.latencies[:-1000]
+
+    def insert(self, documents):
+        try:
+            self.stats['inserted'] += len(self.collection.insert_many(documents,
+                                                                      ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate keys mean the batch was inserted before a restart
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            self.stats['inserted'] += e.details.get('nInserted', 0)
+            self.stats['duplicates'] += len(errors)
+
+    def run(self, once=False):
+        """Ingest until stopped (or, with once, until the spool is drained)"""
+        self.reading = {}
+        self.reader_error = None
+        self.stop_event.clear()
+        reader = threading.Thread(target=self._read_loop, args=(once,), daemon=True)
+        reader.start()
+
+        batch = []
+        deadline = None
+        try:
+            while not self.stop_event.is_set():
+                timeout = (self.poll_interval if deadline is None
+                           else max(0.0, deadline - time.monotonic()))
+                try:
+                    item = self.pending.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _END_OF_SCAN:
+                    break
+                if item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.max_latency
+                if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    self.flush(batch)
+                    self.report()
+                    batch = []
+                    deadline = None
+            if batch:
+                self.flush(batch)
+                self.report()
+        finally:
+            self.stop_event.set()
+            reader.join()
+        if self.reader_error is not None:
+            raise self.reader_error
+        return self.stats['inserted']
+
+    def stop(self):
+        self.stop_event.set()
+
+    def report(self):
+        latencies = np.array(self.latencies) * 1000
+        logger.info(f"Inserted {self.stats['inserted']} posts in {self.stats['batches']} batches "
+                    f"({self.stats['duplicates']} already present, {self.stats['invalid']} "
+                    f"invalid), batch latency p50 {np.percentile(latencies, 50):.0f} ms "
+                    f"p99 {np.percentile(latencies, 99):.0f} ms, "
+                    f"{self.pending.qsize()} records pending")
+
+
+def nlp_stage(mongo_uri=None, **pipeline_options):
+    """Stage running the NLP pipeline, preprocessing included, on each inserted batch"""
+    # Imported on use: the NLP tools are only loaded when the stage is enabled
+    from nlp_pipeline import NLPPipeline
+    from preprocessing import TextPreprocessor
+
+    pipeline = NLPPipeline(mongo_uri, preprocessor=TextPreprocessor(), **pipeline_options)
+    return pipeline.process_batch
+
+
+def es_stage(collection, index_name="harcelement_posts", retries=3, backoff=1.0):
+    """Stage indexing each batch into Elasticsearch once the previous stages wrote it
+
+    Documents are indexed by _id, so a batch with rejected documents (e.g. 429
+    when the cluster is overloaded) is sent again, up to retries times with
+    exponential backoff. The stage then raises: the offsets of the batch are
+    not committed and it is replayed at the next start. After each indexed
+    batch the query services of other processes are invalidated too.
+    """
+    from es_ingest import ElasticsearchIngestor
+    from query_service import notify_index_changed
+
+    ingestor = ElasticsearchIngestor(index_name=index_name)
+
+    def index(documents):
+        stored = list(collection.find({'_id': {'$in': [doc['_id'] for doc in documents]}}))
+        for attempt in range(retries + 1):
+            _, error_count = ingestor.index_documents(stored)
+            if not error_count:
+                notify_index_changed(index_name, collection.database)
+                return
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+        raise RuntimeError(f"Elasticsearch rejected {error_count} of {len(stored)} documents "
+                           f"after {retries + 1} attempts")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuously ingest the JSONL files of a "
+                                                 "spool directory")
+    parser.add_argument('spool_dir')
+    parser.add_argument('--pattern', default='*.jsonl')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help='seconds before a partial batch is flushed')
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--max-pending', type=int, default=4,
+                        help='batches buffered before the reader waits for MongoDB')
+    parser.add_argument('--with-nlp', action='store_true',
+                        help='preprocess and analyze each batch as it is inserted')
+    parser.add_argument('--index', nargs='?', const="harcelement_posts", default=None,
+                        metavar='INDEX', help='also index each batch into Elasticsearch')
+    parser.add_argument('--once', action='store_true',
+                        help='exit once the spool is drained instead of tailing it')
+    parser.add_argument('--from-start', action='store_true',
+                        help='forget the committed offsets and read every file again')
+    parser.add_argument('--checkpoint-file', default=None,
+                        help='store offsets in this JSON file instead of the '
+                             'pipeline_state collection')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    args = parser.parse_args()
+
+    db = get_mongo_db(args.mongo_uri)
+    checkpoints = get_checkpoint_store(db, args.checkpoint_file)
+
+    stages = []
+    if args.with_nlp:
+        stages.append(nlp_stage(args.mongo_uri))
+    if args.index:
+        stages.append(es_stage(db.posts, args.index))
+
+    ingestor = SpoolIngestor(args.spool_dir, db.posts, checkpoints, schema=get_posts_schema(db),
+                             stages=stages, pattern=args.pattern, batch_size=args.batch_size,
+                             max_latency=args.max_latency, poll_interval=args.poll_interval,
+                             max_pending=args.max_pending, from_start=args.from_start)
+    logger.info(f"Watching {args.spool_dir} ({args.pattern})")
+    try:
+        ingestor.run(once=args.once)
+    except KeyboardInterrupt:
+        ingestor.stop()
+    print(f"✅ Inserted {ingestor.stats['inserted']} posts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Term analytics sketches
+Frequent and trending terms of preprocessed_text per Types, Label and time
+bucket, in fixed memory whatever the size of the corpus. Every (Types,
+Label, bucket) has a count-min sketch (estimated count of any term) and a
+space-saving summary (the top-k terms); both are mergeable, so workers
+update their own sketches and merge them into the term_sketches collection.
+
+The NLP pipeline updates the sketches as it processes posts; `python
+term_sketch.py top|trending` queries them, and `build` recomputes them from
+the posts collection. Merges are additive, so the posts whose counts were
+merged are marked with terms_counted_at and the pipeline skips marked posts:
+re-runs and replays do not count a post twice, and the counts a worker had
+not flushed when it died are counted again by the next run. A post is only
+counted twice when a worker dies between saving the sketches and marking
+the posts, or when two workers hold the same unit after a lost lease.
+`build` is the only exact path.
+"""
+
+import argparse
+import functools
+import hashlib
+import heapq
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson import Binary
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from checkpoint import iter_id_batches
+from connections import get_mongo_db
+from posts_schema import decode_document, get_posts_schema
+from spike_detector import event_time
+
+SKETCHES_COLLECTION = 'term_sketches'
+MARK_BATCH_SIZE = 10000    # _ids per update_many marking counted posts
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def term_hash(term):
+    """Two 32-bit hashes of a term, identical in every process (unlike hash())"""
+    digest = hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest[:4], 'little'), int.from_bytes(digest[4:], 'little') | 1
+
+
+class CountMinSketch:
+    """Count-min sketch: over-estimates term counts by at most ~e/width of the total"""
+
+    def __init__(self, width=1024, depth=4, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = (table if table is not None
+                      else np.zeros((depth, width), dtype=np.int64))
+
+    def _indexes(self, terms):
+        hashes = np.array([term_hash(term) for term in terms], dtype=np.uint64).reshape(-1, 2)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        # Double hashing: row i uses h1 + i * h2
+        return ((hashes[:, 0] + rows * hashes[:, 1]) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, terms, counts=None):
+        """Count every occurrence of terms (a list), or counts[i] occurrences of terms[i]"""
+        if not terms:
+            return
+        for row, indexes in enumerate(self._indexes(terms)):
+            self.table[row] += np.bincount(indexes, weights=counts,
+                                           minlength=self.width).astype(np.int64)
+
+    def estimate(self, term):
+        indexes = self._indexes([term])[:, 0]
+        return int(self.table[np.arange(self.depth), indexes].min())
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Count-min sketches of different sizes cannot be merged")
+        self.table += other.table
+        return self
+
+    def to_bytes(self):
+        return self.table.astype('<i8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, width, depth):
+        table = np.frombuffer(data, dtype='<i8').reshape(depth, width).astype(np.int64)
+        return cls(width, depth, table)
+
+
+class SpaceSaving:
+    """Space-saving top-k summary: term -> [count, error], count - error <= true count <= count"""
+
+    def __init__(self, k=100, counters=None):
+        self.k = k
+        self.counters = counters or {}
+        self._heap = [(count, term) for term, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def _min_term(self):
+        # Heap entries go stale when a count changes; skip them lazily
+        while True:
+            count, term = self._heap[0]
+            counter = self.counters.get(term)
+            if counter is not None and counter[0] == count:
+                return term
+            heapq.heappop(self._heap)
+
+    def add(self, term, count=1):
+        counter = self.counters.get(term)
+        if counter is None:
+            if len(self.counters) < self.k:
+                counter = self.counters[term] = [0, 0]
+            else:
+                victim = self._min_term()
+                floor = self.counters.pop(victim)[0]
+                counter = self.counters[term] = [floor, floor]
+        counter[0] += count
+        heapq.heappush(self._heap, (counter[0], term))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(count, term) for term, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def min_count(self):
+        """Count bound of the terms that are not kept (0 until the summary is full)"""
+        if len(self.counters) < self.k:
+            return 0
+        return self.counters[self._min_term()][0]
+
+    def merge(self, other):
+        """Merge another summary (a term missing from a full summary counts as its minimum)"""
+        own_floor, other_floor = self.min_count(), other.min_count()
+        merged = {}
+        for term in set(self.counters) | set(other.counters):
+            own = self.counters.get(term, (own_floor, own_floor))
+            theirs = other.counters.get(term, (other_floor, other_floor))
+            merged[term] = [own[0] + theirs[0], own[1] + theirs[1]]
+        self.counters = dict(heapq.nlargest(self.k, merged.items(), key=lambda item: item[1][0]))
+        self._heap = [(count, term) for term, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def top(self, n=None):
+        """[(term, count, error)] by decreasing count"""
+        key = lambda item: (-item[1][0], item[0])
+        ranked = (sorted(self.counters.items(), key=key) if n is None
+                  else heapq.nsmallest(n, self.counters.items(), key=key))
+        return [(term, count, error) for term, (count, error) in ranked]
+
+
+class TermSketch:
+    """Term statistics of one (Types, Label, bucket): total, count-min sketch and top-k"""
+
+    def __init__(self, width=1024, depth=4, k=100):
+        self.total = 0
+        self.cms = CountMinSketch(width, depth)
+        self.top = SpaceSaving(k)
+
+    def add(self, terms):
+        self.add_counts(Counter(terms))
+
+    def add_counts(self, counts):
+        """Add a Counter of terms"""
+        terms = list(counts)
+        self.total += sum(counts.values())
+        self.cms.add(terms, [counts[term] for term in terms])
+        for term, count in counts.most_common():
+            self.top.add(term, count)
+
+    def merge(self, other):
+        self.total += other.total
+        self.cms.merge(other.cms)
+        self.top.merge(other.top)
+        return self
+
+    def to_document(self):
+        return {
+            'total': self.total,
+            'width': self.cms.width,
+            'depth': self.cms.depth,
+            'cms': Binary(self.cms.to_bytes()),
+            'k': self.top.k,
+            'top': [list(entry) for entry in self.top.top()],
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        sketch = cls.__new__(cls)
+        sketch.total = doc['total']
+        sketch.cms = CountMinSketch.from_bytes(doc['cms'], doc['width'], doc['depth'])
+        sketch.top = SpaceSaving(doc['k'], {term: [count, error]
+                                            for term, count, error in doc['top']})
+        return sketch
+
+
+def bucket_start(created_at, bucket_seconds):
+    """Start (naive UTC datetime, like the stored dates) of the bucket of a created_at value"""
+    timestamp = event_time(created_at)
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).timestamp()
+    start = timestamp - timestamp % bucket_seconds
+    return datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None)
+
+
+def sketch_id(types, label, bucket):
+    return f"{types}|{label}|{bucket:%Y-%m-%dT%H:%M}"
+
+
+def save_sketch(collection, types, label, bucket, sketch, retries=20):
+    """Merge a sketch into the stored one, with optimistic concurrency between workers"""
+    doc_id = sketch_id(types, label, bucket)
+    for _ in range(retries):
+        stored = collection.find_one({'_id': doc_id})
+        if stored is None:
+            try:
+                collection.insert_one(dict(sketch.to_document(), _id=doc_id, types=types,
+                                           label=label, bucket=bucket, version=1))
+                return
+            except DuplicateKeyError:
+                continue
+        merged = TermSketch.from_document(stored).merge(sketch)
+        result = collection.replace_one(
+            {'_id': doc_id, 'version': stored['version']},
+            dict(merged.to_document(), types=types, label=label, bucket=bucket,
+                 version=stored['version'] + 1))
+        if result.matched_count:
+            return
+    raise RuntimeError(f"Could not save term sketch {doc_id}: too many concurrent updates")
+
+
+class TermAnalytics:
+    """Updates the term sketches from processed posts, flushed to MongoDB in bounded memory"""
+
+    def __init__(self, collection, bucket_seconds=86400, width=1024, depth=4, k=100,
+                 max_pending=200000, flush_interval=60.0, posts=None, schema=None):
+        """Term counts are kept exactly until they are merged into the stored sketches,
+        when there are max_pending distinct (key, term) counts or flush_interval
+        seconds after the last flush. With posts (the posts collection, stored with
+        schema), the counted posts are then marked with terms_counted_at."""
+        self.collection = collection
+        self.bucket_seconds = bucket_seconds
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.pending = {}   # (types, label, bucket) -> Counter of terms not yet saved
+        self.pending_terms = 0
+        self.pending_ids = []   # _ids of the posts counted in pending
+        self.counted = 0
+        self.posts = posts
+        self.schema = (schema if schema is not None or posts is None
+                       else get_posts_schema(posts.database))
+        self.last_flush = time.monotonic()
+        self.collection.create_index([('bucket', ASCENDING), ('types', ASCENDING)])
+
+    def observe(self, doc, preprocessed_text=None):
+        """Count the terms of one logical post"""
+        text = preprocessed_text if preprocessed_text is not None else doc.get('preprocessed_text')
+        terms = text.split() if isinstance(text, str) else []
+        self.counted += 1
+        if self.posts is not None and doc.get('_id') is not None:
+            self.pending_ids.append(doc['_id'])
+        if not terms:
+            return
+        key = (doc.get('Types') or 'unknown', doc.get('Label') or 'NB',
+               bucket_start(doc.get('created_at'), self.bucket_seconds))
+        counts = self.pending.get(key)
+        if counts is None:
+            counts = self.pending[key] = Counter()
+        size = len(counts)
+        counts.update(terms)
+        self.pending_terms += len(counts) - size
+        if (self.pending_terms >= self.max_pending
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Merge the pending sketches into the stored ones, then mark the counted posts"""
+        for (types, label, bucket), counts in self.pending.items():
+            sketch = TermSketch(self.width, self.depth, self.k)
+            sketch.add_counts(counts)
+            save_sketch(self.collection, types, label, bucket, sketch)
+        saved = len(self.pending)
+        self.pending = {}
+        self.pending_terms = 0
+        if self.pending_ids:
+            # Only once their counts are stored: posts of lost counts are counted again
+            counted_at = datetime.now()
+            field = self.schema.field('terms_counted_at')
+            for start in range(0, len(self.pending_ids), MARK_BATCH_SIZE):
+                self.posts.update_many(
+                    {'_id': {'$in': self.pending_ids[start:start + MARK_BATCH_SIZE]}},
+                    {'$set': {field: counted_at}})
+            self.pending_ids = []
+        self.last_flush = time.monotonic()
+        return saved
+
+
+def sketch_query(types=None, label=None, since=None, until=None):
+    query = {}
+    if types is not None:
+        query['types'] = types
+    if label is not None:
+        query['label'] = label
+    bounds = {op: value for op, value in (('$gte', since), ('$lt', until)) if value is not None}
+    if bounds:
+        query['bucket'] = bounds
+    return query
+
+
+def merge_sketches(collection, query, with_cms=False):
+    """Merge the stored sketches matching a query (None if there are none)
+
+    The top-k summaries are merged in one pass and nothing is dropped, so the
+    merged counts are exact where no summary was full. Without with_cms the
+    count-min tables are not read and the merged sketch has cms None.
+    """
+    projection = None if with_cms else {'cms': 0}
+    total = 0
+    floors = 0
+    table = None
+    counters = {}   # term -> [count, error, floors of the summaries holding the term]
+    for doc in collection.find(query, projection):
+        total += doc['total']
+        floor = min(count for _, count, _ in doc['top']) if len(doc['top']) >= doc['k'] else 0
+        floors += floor
+        for term, count, error in doc['top']:
+            counter = counters.get(term)
+            if counter is None:
+                counter = counters[term] = [0, 0, 0]
+            counter[0] += count
+            counter[1] += error
+            counter[2] += floor
+        if with_cms:
+            cms = CountMinSketch.from_bytes(doc['cms'], doc['width'], doc['depth'])
+            table = cms if table is None else table.merge(cms)
+    if not total:
+        return None
+
+    merged = TermSketch.__new__(TermSketch)
+    merged.total = total
+    merged.cms = table
+    # A term missing from a full summary may have up to its minimum count there
+    merged.top = SpaceSaving(max(len(counters), 1), {
+        term: [count + floors - held, error + floors - held]
+        for term, (count, error, held) in counters.items()})
+    return merged
+
+
+def top_terms(collection, types=None, label=None, since=None, until=None, n=20):
+    """[(term, count, error)] of the most frequent terms; reads only the top-k summaries"""
+    merged = merge_sketches(collection, sketch_query(types, label, since, until))
+    return merged.top.top(n) if merged is not None else []
+
+
+def latest_bucket(collection):
+    doc = collection.find_one({}, {'bucket': 1}, sort=[('bucket', -1)])
+    return doc['bucket'] if doc else None
+
+
+def trending_terms(collection, types=None, label=None, until=None, window=timedelta(days=7),
+                   baseline=timedelta(days=28), n=20, min_count=5, bucket_seconds=86400):
+    """Terms whose share of the recent window grew most against the preceding baseline
+
+    until defaults to the end of the latest stored bucket (buckets of
+    bucket_seconds, as the sketches were built with). Baseline counts come
+    from the count-min sketches, so terms absent from the baseline top-k are
+    scored too.
+    """
+    if until is None:
+        latest = latest_bucket(collection)
+        if latest is None:
+            return []
+        until = latest + timedelta(seconds=bucket_seconds)
+    recent = merge_sketches(collection, sketch_query(types, label, until - window, until))
+    if recent is None:
+        return []
+    past = merge_sketches(collection,
+                          sketch_query(types, label, until - window - baseline, until - window),
+                          with_cms=True)
+
+    trending = []
+    for term, count, _ in recent.top.top():
+        if count < min_count:
+            continue
+        recent_share = count / recent.total
+        baseline_count = past.cms.estimate(term) if past is not None else 0
+        baseline_share = (baseline_count + 1) / ((past.total if past is not None else 0) + 1)
+        trending.append({'term': term, 'count': count, 'baseline_count': baseline_count,
+                         'lift': round(recent_share / baseline_share, 2)})
+    trending.sort(key=lambda entry: -entry['lift'])
+    return trending[:n]
+
+
+def add_term_arguments(parser):
+    """Add the sketch size options to an argument parser"""
+    parser.add_argument('--bucket-hours', type=float, default=24,
+                        help='time bucket of the term sketches')
+    parser.add_argument('--sketch-width', type=int, default=1024)
+    parser.add_argument('--top-k', type=int, default=100, help='terms kept per sketch')
+    return parser
+
+
+def get_term_analytics(args, db):
+    return TermAnalytics(db[SKETCHES_COLLECTION], bucket_seconds=int(args.bucket_hours * 3600),
+                         width=args.sketch_width, k=args.top_k, posts=db.posts,
+                         schema=get_posts_schema(db))
+
+
+def build(db, analytics, batch_size=1000):
+    """Recompute the sketches from the preprocessed posts of the collection
+
+    Every post is counted, marked or not, and marked again.
+    """
+    db[SKETCHES_COLLECTION].delete_many({})
+    schema = get_posts_schema(db)
+    projection = schema.projection(['Types', 'Label', 'created_at', 'preprocessed_text'])
+    counted = 0
+    for documents in iter_id_batches(db.posts, batch_size, projection=projection):
+        for doc in map(decode_document, documents):
+            analytics.observe(doc)
+        counted += len(documents)
+    analytics.flush()
+    return counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or rebuild the term analytics sketches")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_term_arguments(subparsers.add_parser('build', help='recompute every sketch from posts'))
+    for name in ('top', 'trending'):
+        query_parser = subparsers.add_parser(name, help=f'print the {name} terms')
+        query_parser.add_argument('--types', default=None)
+        query_parser.add_argument('--label', default=None)
+        query_parser.add_argument('-n', type=int, default=20)
+        query_parser.add_argument('--since', type=datetime.fromisoformat, default=None)
+        query_parser.add_argument('--until', type=datetime.fromisoformat, default=None)
+        query_parser.add_argument('--window-days', type=float, default=7)
+        query_parser.add_argument('--baseline-days', type=float, default=28)
+        query_parser.add_argument('--bucket-hours', type=float, default=24,
+                                  help='time bucket the sketches were built with')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    args = parser.parse_args()
+
+    db = get_mongo_db(args.mongo_uri)
+    collection = db[SKETCHES_COLLECTION]
+    if args.command == 'build':
+        counted = build(db, get_term_analytics(args, db))
+        print(f"✅ Built term sketches from {counted} posts")
+    elif args.command == 'top':
+        for term, count, error in top_terms(collection, args.types, args.label, args.since,
+                                            args.until, args.n):
+            print(f"{term:<24}{count:>10}" + (f"  (±{error})" if error else ""))
+    else:
+        for entry in trending_terms(collection, args.types, args.label, args.until,
+                                    timedelta(days=args.window_days),
+                                    timedelta(days=args.baseline_days), args.n,
+                                    bucket_seconds=int(args.bucket_hours * 3600)):
+            print(f"{entry['term']:<24}{entry['count']:>8}  x{entry['lift']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Toxicity model
+Linear classifier over hashed word n-grams of preprocessed_text, trained
+offline on the labeled posts collection. Scores new posts that have no
+Label with one sparse matrix-vector product per batch.
+"""
+
+import argparse
+import zlib
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from checkpoint import iter_id_batches
+from connections import get_mongo_db
+from posts_schema import PostSchema, decode_document, get_posts_schema
+
+MODEL_FORMAT_VERSION = 1
+
+
+def make_vectorizer(n_features, ngram_range):
+    """Stateless feature extractor shared by training and inference"""
+    return HashingVectorizer(
+        n_features=n_features,
+        ngram_range=ngram_range,
+        alternate_sign=False,
+        norm='l2',
+        lowercase=False,          # preprocessed_text is already lowercased
+        token_pattern=r'\S+',     # and already tokenized on whitespace
+        dtype=np.float32
+    )
+
+
+class ToxicityModel:
+    """Hashed n-gram logistic model producing a toxicity probability"""
+
+    def __init__(self, weights, intercept, n_features=2 ** 20, ngram_range=(1, 2)):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.intercept = float(intercept)
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.vectorizer = make_vectorizer(n_features, self.ngram_range)
+
+    def predict_proba(self, texts):
+        """Return the toxicity probability of every text as a float64 array"""
+        features = self.vectorizer.transform([text or '' for text in texts])
+        logits = features @ self.weights + self.intercept
+        return 1.0 / (1.0 + np.exp(-logits.astype(np.float64)))
+
+    def save(self, path):
+        """Store only the non-zero weights, so the file stays small and loads fast"""
+        indices = np.flatnonzero(self.weights).astype(np.int32)
+        np.savez_compressed(
+            path,
+            version=np.int32(MODEL_FORMAT_VERSION),
+            indices=indices,
+            values=self.weights[indices],
+            intercept=np.float64(self.intercept),
+            n_features=np.int64(self.n_features),
+            ngram_range=np.array(self.ngram_range, dtype=np.int32)
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != MODEL_FORMAT_VERSION:
+                raise ValueError(f"Unsupported toxicity model version {int(data['version'])}")
+            n_features = int(data['n_features'])
+            weights = np.zeros(n_features, dtype=np.float32)
+            weights[data['indices']] = data['values']
+            return cls(weights, float(data['intercept']), n_features,
+                       tuple(int(n) for n in data['ngram_range']))
+
+
+def is_holdout(doc_id, holdout_percent):
+    """Deterministic train/holdout split on the document _id"""
+    return zlib.crc32(str(doc_id).encode('utf-8')) % 100 < holdout_percent
+
+
+def train_from_collection(collection, n_features=2 ** 20, ngram_range=(1, 2), batch_size=5000,
+                          epochs=3, alpha=1e-5, holdout_percent=10, schema=None):
+    """Train on labeled posts by streaming batches through SGD (constant memory)"""
+    vectorizer = make_vectorizer(n_features, ngram_range)
+    classifier = SGDClassifier(loss='log_loss', alpha=alpha, random_state=0)
+    schema = schema or PostSchema()
+    query = schema.query({'Label': {'$in': ['B', 'NB']}, 'preprocessed_text': {'$exists': True}})
+    projection = schema.projection(['preprocessed_text', 'Label'])
+
+    holdout_texts, holdout_labels = [], []
+    for epoch in range(epochs):
+        for documents in iter_id_batches(collection, batch_size, query=query,
+                                         projection=projection):
+            texts, labels = [], []
+            for doc in map(decode_document, documents):
+                text = doc.get('preprocessed_text') or ''
+                label = 1 if doc['Label'] == 'B' else 0
+                if is_holdout(doc['_id'], holdout_percent):
+                    if epoch == 0:
+                        holdout_texts.append(text)
+                        holdout_labels.append(label)
+                    continue
+                texts.append(text)
+                labels.append(label)
+            if texts:
+                classifier.partial_fit(vectorizer.transform(texts), labels, classes=[0, 1])
+        print(f"Epoch {epoch + 1}/{epochs} done")
+
+    model = ToxicityModel(classifier.coef_[0], classifier.intercept_[0], n_features, ngram_range)
+    metrics = evaluate(model, holdout_texts, holdout_labels)
+    return model, metrics
+
+
+def evaluate(model, texts, labels, threshold=0.5):
+    """Return accuracy, precision and recall on a labeled sample"""
+    if not texts:
+        return {}
+    labels = np.asarray(labels)
+    predicted = model.predict_proba(texts) >= threshold
+    true_positives = int(np.sum(predicted & (labels == 1)))
+    return {
+        'samples': len(texts),
+        'accuracy': float(np.mean(predicted == (labels == 1))),
+        'precision': true_positives / max(int(predicted.sum()), 1),
+        'recall': true_positives / max(int((labels == 1).sum()), 1)
+    }
+
+
+def main():
+    """Train the toxicity model on the labeled posts collection"""
+    parser = argparse.ArgumentParser(description="Train the hashed n-gram toxicity model")
+    parser.add_argument('--model', default='toxicity_model.npz', help='output model file')
+    parser.add_argument('--mongo-uri', default=None, help='default: $MONGO_URI or localhost')
+    parser.add_argument('--n-features', type=int, default=2 ** 20)
+    parser.add_argument('--max-ngram', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=3)
+    args = parser.parse_args()
+
+    db = get_mongo_db(args.mongo_uri)
+    model, metrics = train_from_collection(db.posts,
+                                           n_features=args.n_features,
+                                           ngram_range=(1, args.max_ngram),
+                                           epochs=args.epochs,
+                                           schema=get_posts_schema(db))
+
+    model.save(args.model)
+    print(f"Model saved to {args.model}")
+    print(f"Holdout metrics: {metrics}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Lease-based work distribution
+Splits the _id space of a collection into work units stored in a jobs
+collection so that workers on any host can claim them with atomic leases
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+
+def default_worker_id():
+    """Identify a worker by host, pid and a random suffix"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaseWorkQueue:
+    """Work units over an _id range, claimed with leases that expire if a worker dies.
+
+    Lease expiry is computed with the server clock ($$NOW) so that workers on
+    hosts with skewed clocks still agree on when a lease is stale.
+    """
+
+    def __init__(self, jobs_collection, job_name, lease_seconds=60, worker_id=None):
+        self.jobs = jobs_collection
+        self.job_name = job_name
+        self.lease_ms = int(lease_seconds * 1000)
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or default_worker_id()
+        self.jobs.create_index([('job', ASCENDING), ('status', ASCENDING), ('unit', ASCENDING)])
+
+    def plan(self, collection, unit_size=1000):
+        """Split the collection into units of unit_size documents, once per job.
+
+        Boundaries are deterministic, so several workers planning at the same
+        time insert identical units and the duplicates are simply ignored.
+        """
+        if self.jobs.count_documents({'job': self.job_name}, limit=1):
+            return 0
+
+        boundaries = []
+        cursor = collection.find({}, {'_id': 1}).sort('_id', ASCENDING)
+        for position, doc in enumerate(cursor):
+            if position % unit_size == 0:
+                boundaries.append(doc['_id'])
+        if not boundaries:
+            return 0
+
+        units = []
+        for index, lower in enumerate(boundaries):
+            upper = boundaries[index + 1] if index + 1 < len(boundaries) else None
+            units.append({
+                '_id': f"{self.job_name}:{index:08d}",
+                'job': self.job_name,
+                'unit': index,
+                'min_id': lower,
+                'max_id': upper,
+                'status': 'pending',
+                'owner': None,
+                'lease_expires': None,
+                'attempts': 0
+            })
+
+        try:
+            self.jobs.insert_many(units, ordered=False)
+        except BulkWriteError as e:
+            # Another worker planned the same units concurrently
+            if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+        return len(units)
+
+    def reset(self):
+        """Drop all units of the job"""
+        self.jobs.delete_many({'job': self.job_name})
+
+    def claim(self):
+        """Atomically lease the next pending or expired unit, or return None"""
+        return self.jobs.find_one_and_update(
+            {
+                'job': self.job_name,
+                '$or': [
+                    {'status': 'pending'},
+                    {'status': 'leased', '$expr': {'$lt': ['$lease_expires', '$$NOW']}}
+                ]
+            },
+            [{'$set': {
+                'status': 'leased',
+                'owner': self.worker_id,
+                'lease_expires': {'$add': ['$$NOW', self.lease_ms]},
+                'attempts': {'$add': [{'$ifNull': ['$attempts', 0]}, 1]}
+            }}],
+            sort=[('unit', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew(self, unit):
+        """Extend the lease of a unit; False if another worker has taken it over"""
+        result = self.jobs.update_one(
+            {'_id': unit['_id'], 'owner': self.worker_id, 'status': 'leased'},
+            [{'$set': {'lease_expires': {'$add': ['$$NOW', self.lease_ms]}}}]
+        )
+        return result.modified_count == 1
+
+    def complete(self, unit, stats=None):
+        """Mark a unit as done; False if the lease was lost in the meantime"""
+        result = self.jobs.update_one(
+            {'_id': unit['_id'], 'owner': self.worker_id, 'status': 'leased'},
+            [{'$set': {'status': 'done', 'stats': stats or {}, 'finished_at': '$$NOW'}}]
+        )
+        return result.modified_count == 1
+
+    def release(self, unit):
+        """Hand a unit back to the pool, e.g. after a processing error"""
+        self.jobs.update_one(
+            {'_id': unit['_id'], 'owner': self.worker_id, 'status': 'leased'},
+            {'$set': {'status': 'pending', 'owner': None, 'lease_expires': None}}
+        )
+
+    def progress(self):
+        """Return the number of units per status"""
+        pipeline = [
+            {'$match': {'job': self.job_name}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ]
+        counts = {'pending': 0, 'leased': 0, 'done': 0}
+        for row in self.jobs.aggregate(pipeline):
+            counts[row['_id']] = row['count']
+        return counts
+
+    def is_finished(self):
+        """True once every unit of the job is done"""
+        return self.jobs.count_documents(
+            {'job': self.job_name, 'status': {'$ne': 'done'}}, limit=1
+        ) == 0
+
+
+def unit_query(unit):
+    """Return the Mongo filter selecting the documents of a unit"""
+    id_filter = {'$gte': unit['min_id']}
+    if unit.get('max_id') is not None:
+        id_filter['$lt'] = unit['max_id']
+    return {'_id': id_filter}
+
+
+class LeaseHeartbeat:
+    """Background thread renewing a lease while its unit is being processed"""
+
+    def __init__(self, queue, unit, interval=None):
+        self.queue = queue
+        self.unit = unit
+        self.interval = interval or max(1.0, queue.lease_seconds / 3)
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.renew(self.unit):
+                    self.lost.set()
+                    return
+            except Exception:
+                # A transient Mongo error is retried at the next beat; the lease
+                # only lapses if renewals keep failing for a whole interval
+                continue
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_worker(queue, process_unit, idle_wait=5.0):
+    """Claim and process units until the whole job is done.
+
+    process_unit(unit, heartbeat) must be idempotent: a unit whose worker
+    died is processed again by whoever claims its expired lease.
+    """
+    completed_units = 0
+    while True:
+        unit = queue.claim()
+        if unit is None:
+            if queue.is_finished():
+                return completed_units
+            # Remaining units are leased by other workers; wait for them to
+            # finish or for one of their leases to expire
+            time.sleep(idle_wait)
+            continue
+
+        with LeaseHeartbeat(queue, unit) as heartbeat:
+            try:
+                stats = process_unit(unit, heartbeat)
+            except Exception:
+                queue.release(unit)
+                raise
+
+        if heartbeat.lost.is_set():
+            continue
+        if queue.complete(unit, stats):
+            completed_units += 1
@@ -0,0 +1,209 @@
+"""
+Preloaded NLP workers
+Loads the NLP models (NLTK stopwords, WordNet and tagger, langid, langdetect,
+VADER, TextBlob, abuse lexicon, toxicity model) once in a parent process and
+forks the distributed NLP workers from it. Workers share the model pages
+copy-on-write instead of each loading their own copy, and start at once.
+
+gc.freeze() is called before forking so that garbage collections in the
+workers never write to (and thereby copy) the pages of the preloaded
+objects. The large numeric tables (langid model, toxicity model weights)
+are numpy arrays that are only read, so their buffers stay shared.
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+
+from textblob import TextBlob
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from connections import get_mongo_db
+from language_router import add_language_arguments, detect_language, get_language_router
+from lexicon import AbuseLexicon, DEFAULT_LEXICON_PATH
+from nlp_pipeline import NLPPipeline
+from preprocessing import TextPreprocessor
+from term_sketch import SKETCHES_COLLECTION, add_term_arguments, get_term_analytics
+from toxicity_model import ToxicityModel
+
+WARM_UP_TEXT = "You are not welcome here, this is a short warm up sentence."
+
+
+def memory_usage(pid=None):
+    """RSS, PSS and USS (private pages) of a process in MB, from /proc (Linux only)"""
+    path = f"/proc/{pid or os.getpid()}/smaps_rollup"
+    try:
+        with open(path, encoding='utf-8') as f:
+            values = {line.split(':')[0]: int(line.split()[1]) for line in f
+                      if line.split()[-1] == 'kB'}
+    except (OSError, ValueError):
+        return None
+    return {
+        'rss': values.get('Rss', 0) / 1024,
+        'pss': values.get('Pss', 0) / 1024,
+        'uss': (values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)) / 1024,
+    }
+
+
+class PreloadedModels:
+    """NLP models loaded once in the parent process, shared by the forked workers"""
+
+    def __init__(self, with_preprocessing=False, lexicon_path=None, toxicity_model_path=None,
+                 router=None):
+        self.preprocessor = TextPreprocessor() if with_preprocessing else None
+        self.vader_analyzer = SentimentIntensityAnalyzer()
+        self.lexicon = AbuseLexicon.from_file(lexicon_path) if lexicon_path else None
+        self.toxicity_model = (ToxicityModel.load(toxicity_model_path)
+                               if toxicity_model_path else None)
+        self.router = router
+        self.unavailable = []
+
+    def warm_up(self):
+        """Run every model once, so that lazily loaded data is loaded in the parent"""
+        detect_language(WARM_UP_TEXT)
+        self.vader_analyzer.polarity_scores(WARM_UP_TEXT)
+        TextBlob(WARM_UP_TEXT).sentiment
+        if self.preprocessor is not None:
+            try:
+                self.preprocessor.lemmatizer.lemmatize('warming')
+            except LookupError:
+                self.unavailable.append('wordnet')
+            analyzed = self.preprocessor.analyze_text(WARM_UP_TEXT)
+            if analyzed.pos_tags is None:
+                # The stages fall back to lemmatizing without POS tags
+                self.unavailable.append('averaged_perceptron_tagger')
+        if self.lexicon is not None and self.preprocessor is not None:
+            self.lexicon.count(self.preprocessor.preprocess_text(WARM_UP_TEXT))
+        return self
+
+    def pipeline(self, **options):
+        """NLPPipeline on the preloaded models; call it in the worker, as it opens connections"""
+        return NLPPipeline(preprocessor=self.preprocessor, lexicon=self.lexicon,
+                           toxicity_model=self.toxicity_model, router=self.router,
+                           vader_analyzer=self.vader_analyzer, **options)
+
+
+class WorkerPool:
+    """Forks workers from the current process and restarts the ones that fail"""
+
+    def __init__(self, target, workers=4, max_restarts=3):
+        """target(index) is run in every worker; a worker exiting with an error is restarted"""
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("Preloaded workers need the fork start method (Linux/macOS)")
+        self.context = multiprocessing.get_context('fork')
+        self.target = target
+        self.workers = workers
+        self.max_restarts = max_restarts
+        self.processes = {}     # index -> Process
+        self.restarts = 0
+        self.spawn_seconds = []
+
+    def spawn(self, index):
+        start = time.perf_counter()
+        process = self.context.Process(target=self.target, args=(index,),
+                                       name=f"nlp-worker-{index}", daemon=False)
+        process.start()
+        self.spawn_seconds.append(time.perf_counter() - start)
+        self.processes[index] = process
+        return process
+
+    def start(self):
+        # Objects allocated so far are never collected again: their pages are left untouched
+        gc.freeze()
+        for index in range(self.workers):
+            self.spawn(index)
+
+    def join(self):
+        """Wait for every worker; returns {index: exit code}"""
+        exit_codes = {}
+        while self.processes:
+            by_sentinel = {process.sentinel: index for index, process in self.processes.items()}
+            for sentinel in wait(list(by_sentinel)):
+                index = by_sentinel[sentinel]
+                process = self.processes.pop(index)
+                process.join()
+                if process.exitcode != 0 and self.restarts < self.max_restarts:
+                    self.restarts += 1
+                    print(f"Worker {index} exited with {process.exitcode}, restarting it")
+                    self.spawn(index)
+                else:
+                    exit_codes[index] = process.exitcode
+        return exit_codes
+
+    def terminate(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.processes.clear()
+
+    def memory_report(self):
+        """memory_usage of the parent and of every running worker"""
+        report = {'parent': memory_usage()}
+        for index, process in self.processes.items():
+            report[f"worker {index}"] = memory_usage(process.pid)
+        return report
+
+
+def print_memory_report(report):
+    for name, usage in report.items():
+        if usage is not None:
+            print(f"{name:<12} RSS {usage['rss']:8.1f} MB  PSS {usage['pss']:8.1f} MB  "
+                  f"private {usage['uss']:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run distributed NLP workers forked from "
+                                                 "one process holding the models")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--job-name', default=NLPPipeline.STAGE,
+                        help='name of the distributed job (new name = new run)')
+    parser.add_argument('--unit-size', type=int, default=1000,
+                        help='documents per distributed work unit')
+    parser.add_argument('--lease-seconds', type=float, default=60,
+                        help='lease duration before a silent worker loses its unit')
+    parser.add_argument('--with-preprocessing', action='store_true',
+                        help='preprocess Text in the same pass (each post is tokenized once)')
+    parser.add_argument('--lexicon', nargs='?', const=DEFAULT_LEXICON_PATH, default=None,
+                        metavar='PATH',
+                        help='count abuse lexicon hits per category (default list if no PATH)')
+    parser.add_argument('--toxicity-model', default=None, metavar='PATH',
+                        help='write predicted_toxicity with a model trained by toxicity_model.py')
+    parser.add_argument('--term-analytics', action='store_true',
+                        help=f'update the top/trending term sketches in {SKETCHES_COLLECTION}')
+    parser.add_argument('--max-restarts', type=int, default=3)
+    add_language_arguments(parser)
+    add_term_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    models = PreloadedModels(args.with_preprocessing, args.lexicon, args.toxicity_model,
+                             get_language_router(args)).warm_up()
+    print(f"Models loaded in {time.perf_counter() - start:.1f}s"
+          + (f" (unavailable: {', '.join(models.unavailable)})" if models.unavailable else ""))
+
+    def run(index):
+        # Each worker merges its own sketches into the stored ones
+        term_analytics = get_term_analytics(args, get_mongo_db()) if args.term_analytics else None
+        models.pipeline(term_analytics=term_analytics).run_distributed_worker(
+            job_name=args.job_name, unit_size=args.unit_size, lease_seconds=args.lease_seconds)
+
+    pool = WorkerPool(run, workers=args.workers, max_restarts=args.max_restarts)
+    pool.start()
+    print(f"Forked {args.workers} workers in {sum(pool.spawn_seconds) * 1000:.0f} ms")
+    print_memory_report(pool.memory_report())
+    try:
+        exit_codes = pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    failed = sorted(index for index, code in exit_codes.items() if code != 0)
+    print(f"✅ {args.workers - len(failed)} workers finished"
+          + (f", workers {failed} failed" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
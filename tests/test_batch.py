@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from batch import PostBatch, Vocabulary, VOCABULARIES
+from posts_schema import CATEGORY_CODES, PostSchema
+
+
+class TestPostBatch(unittest.TestCase):
+    def setUp(self):
+        self.batch = PostBatch(3, processed_at='now')
+        self.batch.append_analysis(1, 'en', {'sentiment': 'negative', 'polarity': -0.5,
+                                             'subjectivity': 0.9, 'vader_compound': -0.7}, 0.9)
+        self.batch.append_analysis(2, 'eu', {'sentiment': 'neutral', 'polarity': 0.0,
+                                             'subjectivity': 0.0, 'vader_compound': 0.0}, 0.1)
+
+    # Test numeric fields are stored as NumPy columns over the filled rows
+    def test_numeric_columns(self):
+        self.assertEqual(len(self.batch), 2)
+        np.testing.assert_array_equal(self.batch.column('toxicity_score'), [0.9, 0.1])
+        self.assertEqual(self.batch.column('toxicity_score').dtype, np.float64)
+
+    # Test categorical fields are interned codes shared across batches
+    def test_categorical_codes(self):
+        self.assertEqual(self.batch.column('language'), ['en', 'eu'])
+        other = PostBatch(1)
+        other.append(3, {'language': 'eu'})
+        self.assertEqual(other.category_codes('language')[0], self.batch.category_codes('language')[1])
+
+    # Test row views and Mongo updates expose native values
+    def test_rows_and_updates(self):
+        row = next(iter(self.batch))
+        self.assertEqual(row.sentiment, 'negative')
+        self.assertEqual(row['polarity'], -0.5)
+        self.assertFalse(hasattr(row, '__dict__'))
+
+        updates = list(self.batch.iter_updates(('sentiment', 'toxicity_score')))
+        self.assertEqual(updates[1], (2, {'sentiment': 'neutral', 'toxicity_score': 0.1,
+                                          'nlp_processed_at': 'now'}))
+        self.assertIsInstance(updates[0][1]['toxicity_score'], float)
+
+    # Test updates in the v2 layout are encoded once per column, like PostSchema.encode
+    def test_updates_in_stored_layout(self):
+        schema = PostSchema(2)
+        fields = ('sentiment', 'language', 'toxicity_score')
+        updates = list(self.batch.iter_updates(fields, schema))
+        expected = [schema.encode(update) for _, update in self.batch.iter_updates(fields)]
+        self.assertEqual([update for _, update in updates], expected)
+        self.assertEqual([row_id for row_id, _ in updates], [1, 2])
+
+    def test_full_batch(self):
+        self.batch.append(3, {'Label': 'B'})
+        with self.assertRaises(IndexError):
+            self.batch.append(4, {'Label': 'NB'})
+
+    def test_vocabulary(self):
+        vocabulary = Vocabulary(['B'])
+        self.assertEqual(vocabulary.code('NB'), 1)
+        self.assertEqual(vocabulary.value(1), 'NB')
+        self.assertIsNone(vocabulary.value(vocabulary.code(None)))
+
+    # Test batch codes are the stored codes of the v2 schema
+    def test_vocabularies_match_schema_codes(self):
+        for field, codes in CATEGORY_CODES.items():
+            for value, code in codes.items():
+                self.assertEqual(VOCABULARIES[field].code(value), code)
+
+
+if __name__ == '__main__':
+    unittest.main()
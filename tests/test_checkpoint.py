@@ -0,0 +1,70 @@
+import unittest
+import tempfile
+import os
+import sys
+from unittest.mock import MagicMock
+
+from bson import ObjectId
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from checkpoint import FileCheckpointStore, iter_id_batches, resume_point
+
+
+class TestFileCheckpointStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'state.json')
+        self.store = FileCheckpointStore(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    # Test the last _id survives a save/load round trip
+    def test_save_and_load(self):
+        last_id = ObjectId()
+        self.store.save('nlp', last_id, {'processed': 50})
+
+        checkpoint = FileCheckpointStore(self.path).load('nlp')
+        self.assertEqual(checkpoint['last_id'], last_id)
+        self.assertEqual(checkpoint['stats'], {'processed': 50})
+        self.assertEqual(checkpoint['status'], 'running')
+
+    # Test resume_point returns the checkpoint only when resuming
+    def test_resume_point(self):
+        last_id = ObjectId()
+        self.store.save('nlp', last_id, {'processed': 50})
+
+        self.assertEqual(resume_point(self.store, 'nlp', True), (last_id, {'processed': 50}))
+        self.assertEqual(resume_point(self.store, 'nlp', False), (None, {}))
+        # A fresh run forgets the previous checkpoint
+        self.assertIsNone(self.store.load('nlp'))
+
+    # Test completing a stage keeps its last _id
+    def test_complete(self):
+        last_id = ObjectId()
+        self.store.save('preprocessing', last_id)
+        self.store.complete('preprocessing')
+
+        checkpoint = self.store.load('preprocessing')
+        self.assertEqual(checkpoint['status'], 'completed')
+        self.assertEqual(checkpoint['last_id'], last_id)
+
+
+class TestIterIdBatches(unittest.TestCase):
+    # Test batches are fetched with a range query starting after the last _id
+    def test_range_queries(self):
+        first = [{'_id': 1}, {'_id': 2}]
+        second = [{'_id': 3}]
+        collection = MagicMock()
+        cursor = collection.find.return_value.sort.return_value.limit
+        cursor.side_effect = [first, second, []]
+
+        batches = list(iter_id_batches(collection, 2, start_after=0))
+
+        self.assertEqual(batches, [first, second])
+        queries = [call.args[0] for call in collection.find.call_args_list]
+        self.assertEqual(queries, [{'_id': {'$gt': 0}}, {'_id': {'$gt': 2}}, {'_id': {'$gt': 3}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
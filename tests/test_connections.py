@@ -0,0 +1,46 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import connections
+
+
+class TestConnections(unittest.TestCase):
+    def tearDown(self):
+        connections.close_all()
+
+    # Test clients are created once per process and configuration
+    def test_clients_are_shared(self):
+        self.assertIs(connections.get_mongo_client(), connections.get_mongo_client())
+        self.assertIsNot(connections.get_mongo_client(),
+                         connections.get_mongo_client(maxPoolSize=5))
+        self.assertIs(connections.get_es_client(), connections.get_es_client())
+
+    # Test hosts and pool settings come from the environment
+    @patch.dict(os.environ, {'MONGO_URI': 'mongodb://mongodb:27017/', 'ES_HOST': 'http://es:9200',
+                             'MONGO_MAX_POOL_SIZE': '8', 'MONGO_COMPRESSORS': 'zlib'})
+    def test_environment(self):
+        self.assertEqual(connections.mongo_uri(), 'mongodb://mongodb:27017/')
+        self.assertEqual(connections.mongo_uri('mongodb://other/'), 'mongodb://other/')
+        self.assertEqual(connections.es_host(), 'http://es:9200')
+
+        client = connections.get_mongo_client()
+        self.assertEqual(client.options.pool_options.max_pool_size, 8)
+        self.assertEqual(client.options.pool_options._compression_settings.compressors, ['zlib'])
+
+    # Test the ES client compresses request bodies by default
+    def test_es_http_compress(self):
+        connection = connections.get_es_client().transport.get_connection()
+        self.assertTrue(connection.http_compress)
+
+    # Test closed clients are replaced by new ones
+    def test_close_all(self):
+        client = connections.get_mongo_client()
+        connections.close_all()
+        self.assertIsNot(connections.get_mongo_client(), client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+import os
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from dump_loader import detect_format, iter_batches, iter_es_dump, iter_mongo_dump
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TestDumpLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    # Test Extended JSON wrappers are converted back to native values
+    def test_mongo_array_extended_json(self):
+        path = self.write('posts.json', '[{"_id":{"$oid":"685429784c4fc8522ed5ec21"},'
+                                        '"Id_post":12345,"created_at":{"$date":"2024-04-16T19:16:53Z"},'
+                                        '"Text":"hello"}, {"_id":{"$oid":"685429784c4fc8522ed5ec22"}}]')
+        docs = list(iter_mongo_dump(path, chunk_size=7))
+
+        self.assertEqual(len(docs), 2)
+        self.assertEqual(docs[0]['_id'], ObjectId("685429784c4fc8522ed5ec21"))
+        self.assertIsInstance(docs[0]['created_at'], datetime)
+        # Numbers split across chunk boundaries are not truncated
+        self.assertEqual(docs[0]['Id_post'], 12345)
+        self.assertEqual(detect_format(path), 'mongo')
+
+    # Test mongoexport JSON lines are supported
+    def test_mongo_json_lines(self):
+        path = self.write('posts.jsonl', '{"_id":{"$oid":"685429784c4fc8522ed5ec21"},"Label":"B"}\n'
+                                         '{"_id":{"$oid":"685429784c4fc8522ed5ec22"},"Label":"NB"}\n')
+        self.assertEqual([doc['Label'] for doc in iter_mongo_dump(path, chunk_size=5)], ['B', 'NB'])
+        self.assertEqual(detect_format(path), 'mongo')
+
+    # Test hits are extracted from concatenated scroll responses
+    def test_es_scroll_responses(self):
+        response = ('{"_scroll_id":"abc","took":74,"_shards":{"total":1},'
+                    '"hits":{"total":{"value":2},"max_score":1.0,'
+                    '"hits":[{"_id":"%s","_source":{"id_post":"%s"}}]}}')
+        path = self.write('es.json', response % ('a', '1') + '\n' + response % ('b', '2'))
+
+        hits = list(iter_es_dump(path, chunk_size=9))
+        self.assertEqual(hits, [('a', {'id_post': '1'}), ('b', {'id_post': '2'})])
+        self.assertEqual(detect_format(path), 'es')
+
+    # Test the dumps shipped with the repository
+    def test_repository_dumps(self):
+        mongo_path = os.path.join(REPO_ROOT, 'Mongodb_data.json')
+        es_path = os.path.join(REPO_ROOT, 'elasticsearch.json')
+
+        self.assertEqual(sum(1 for _ in iter_mongo_dump(mongo_path, chunk_size=65536)), 6261)
+        self.assertEqual(sum(1 for _ in iter_es_dump(es_path, chunk_size=65536)), 1000)
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
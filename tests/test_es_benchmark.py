@@ -0,0 +1,34 @@
+import unittest
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from es_benchmark import DASHBOARD_QUERIES, benchmark_profile
+
+
+class TestMappingBenchmark(unittest.TestCase):
+    # Test one profile is ingested, measured, queried and cleaned up
+    def test_benchmark_profile(self):
+        documents = [{'_id': i, 'Id_post': i, 'Text': f'post {i}',
+                      'created_at': datetime(2024, 1, 1)} for i in range(5)]
+        es = MagicMock()
+        es.bulk.return_value = {'items': [{'index': {'status': 201}}] * 2}
+        index_name = 'harcelement_posts_bench_lean'
+        es.indices.stats.return_value = {'indices': {index_name: {'primaries': {
+            'docs': {'count': 5}, 'store': {'size_in_bytes': 2048}}}}}
+
+        with patch('es_ingest.get_es_client', return_value=es):
+            result = benchmark_profile('lean', documents, batch_size=2, query_runs=3)
+
+        self.assertEqual(es.bulk.call_count, 3)
+        self.assertEqual(result['store_bytes'], 2048)
+        self.assertEqual(set(result['queries']), set(DASHBOARD_QUERIES))
+        # One warm-up run per query plus the timed runs
+        self.assertEqual(es.search.call_count, 4 * len(DASHBOARD_QUERIES))
+        es.indices.delete.assert_called_with(index=index_name, ignore=[404])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+import json
+import tempfile
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from es_ingest import (ElasticsearchIngestor, LEAN_MAPPING, STANDARD_MAPPING, encode_bulk_body,
+                       get_serializer)
+
+
+def search_pages(body):
+    """Fake sliced search: two pages per slice then an empty one"""
+    slice_id = body.get('slice', {}).get('id', 0)
+    page = len(body.get('search_after', []))
+    if page >= 2:
+        return {'pit_id': 'pit', 'hits': {'hits': []}}
+    hits = [{'_id': f"{slice_id}-{page}", '_source': {'id_post': str(slice_id)},
+             'sort': [0] * (page + 1)}]
+    return {'pit_id': 'pit', 'hits': {'hits': hits}}
+
+
+class TestElasticsearchExport(unittest.TestCase):
+    def setUp(self):
+        self.ingestor = ElasticsearchIngestor()
+        self.ingestor.es = MagicMock()
+        self.ingestor.es.open_point_in_time.return_value = {'id': 'pit'}
+        self.ingestor.es.search.side_effect = lambda body: search_pages(body)
+        self.ingestor.es.indices.get_mapping.return_value = {'posts-000001': STANDARD_MAPPING}
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    # Test every slice is paged with search_after and written to the JSONL file
+    def test_export_jsonl(self):
+        path = os.path.join(self.tmp_dir.name, 'posts.jsonl')
+        count = self.ingestor.export(path, fields=['id_post'], slices=3, page_size=1)
+
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(count, 6)
+        self.assertEqual(sorted(row['_id'] for row in rows),
+                         ['0-0', '0-1', '1-0', '1-1', '2-0', '2-1'])
+
+        body = self.ingestor.es.search.call_args_list[0].kwargs['body']
+        self.assertEqual(body['_source'], ['id_post'])
+        self.assertEqual(body['pit']['id'], 'pit')
+        self.assertEqual(body['slice']['max'], 3)
+        self.ingestor.es.close_point_in_time.assert_called_once_with(body={'id': 'pit'})
+
+    # Test the Parquet schema comes from the mapping, not from the first rows
+    def test_export_parquet_schema(self):
+        import pyarrow.parquet as pq
+        pages = [
+            [{'_id': 'a', 'id_post': '1', 'toxicity_score': 1}],
+            [{'_id': 'b', 'id_post': '2', 'toxicity_score': 0.5, 'lexicon_total': 2,
+              'lexicon_hits': {'troll': 2, 'custom': 1}}],
+        ]
+
+        def search(body):
+            page = len(body.get('search_after', []))
+            if page >= len(pages):
+                return {'pit_id': 'pit', 'hits': {'hits': []}}
+            return {'pit_id': 'pit', 'hits': {'hits': [
+                {'_id': row.pop('_id'), '_source': row, 'sort': [0] * (page + 1)}
+                for row in pages[page]]}}
+
+        self.ingestor.es.search.side_effect = search
+        path = os.path.join(self.tmp_dir.name, 'posts.parquet')
+        self.ingestor.export(path, slices=1, page_size=1)
+
+        table = pq.read_table(path)
+        self.assertEqual(str(table.schema.field('toxicity_score').type), 'double')
+        rows = table.to_pylist()
+        self.assertEqual([row['toxicity_score'] for row in rows], [1.0, 0.5])
+        self.assertEqual([row['lexicon_total'] for row in rows], [None, 2])
+        self.assertEqual(dict(rows[1]['lexicon_hits']), {'troll': 2, 'custom': 1})
+
+    # Test the Parquet schema follows the live index when it was created with another profile
+    def test_export_parquet_live_mapping(self):
+        import pyarrow.parquet as pq
+        self.ingestor.es.indices.get_mapping.return_value = {'posts-000001': LEAN_MAPPING}
+        self.assertEqual(self.ingestor.mapping_profile, 'standard')
+        path = os.path.join(self.tmp_dir.name, 'posts.parquet')
+        self.ingestor.export(path, slices=1, page_size=1)
+
+        names = pq.read_schema(path).names
+        self.assertIn('lexicon_hits', names)
+        for dropped in ('titre', 'url', 'original_text'):
+            self.assertNotIn(dropped, names)
+        self.ingestor.es.indices.get_mapping.assert_called_once_with(
+            index=self.ingestor.index_name)
+
+    # Test a failing slice is reported and the point-in-time is still closed
+    def test_export_slice_error(self):
+        self.ingestor.es.search.side_effect = RuntimeError("node down")
+        path = os.path.join(self.tmp_dir.name, 'posts.jsonl')
+
+        with self.assertRaises(RuntimeError):
+            self.ingestor.export(path, slices=2)
+        self.ingestor.es.close_point_in_time.assert_called_once()
+
+
+class TestBulkSerialization(unittest.TestCase):
+    def setUp(self):
+        self.ingestor = ElasticsearchIngestor(checkpoint_path=os.devnull)
+        self.documents = [
+            {'_id': 1, 'Id_post': 'abc', 'Text': 'hello "world"', 'Label': 'B',
+             'created_at': datetime(2024, 4, 16, 19, 16, 53)},
+            {'_id': 2, 'Id_post': 'def', 'Text': 'bonjour', 'Label': 'NB'},
+        ]
+
+    # Test both serializers pre-encode the same NDJSON bulk body
+    def test_encode_bulk_body(self):
+        actions = self.ingestor.transform_batch(self.documents)
+        bodies = [encode_bulk_body('posts', actions, get_serializer(name))
+                  for name in ('json', 'orjson')]
+
+        for body in bodies:
+            lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+            self.assertEqual(lines[0], {'index': {'_index': 'posts', '_id': '1'}})
+            self.assertEqual(lines[1]['contenu'], 'hello "world"')
+            self.assertEqual(lines[1]['date'], '2024-04-16T19:16:53')
+            self.assertEqual(lines[2]['index']['_id'], '2')
+            self.assertTrue(body.endswith(b'\n'))
+        # Missing dates share the batch timestamp
+        self.assertEqual(actions[1][1]['date'], actions[1][1]['nlp_processed_at'])
+
+    # Test the pre-encoded path sends one body per chunk and counts item errors
+    def test_bulk_index_pre_encoded(self):
+        self.ingestor.es = MagicMock()
+        self.ingestor.es.bulk.return_value = {'items': [{'index': {'status': 201}},
+                                                        {'index': {'status': 400}}]}
+        self.ingestor.checkpoints = MagicMock()
+        self.ingestor.collection = MagicMock()
+        self.ingestor.collection.count_documents.return_value = 2
+        self.ingestor.collection.find.return_value.sort.return_value.limit.side_effect = \
+            [self.documents, []]
+
+        success_count, error_count = self.ingestor.bulk_index_documents(
+            batch_size=2, thread_count=1, pre_encode=True)
+
+        self.assertEqual((success_count, error_count), (1, 1))
+        body = self.ingestor.es.bulk.call_args.kwargs['body']
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(len(body.splitlines()), 4)
+        self.ingestor.checkpoints.save.assert_called_once()
+
+    # Test an unknown serializer name is rejected
+    def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            get_serializer('ujson')
+
+
+class TestMappingProfiles(unittest.TestCase):
+    # Test the lean profile leaves out the fields it does not map
+    def test_lean_transform(self):
+        ingestor = ElasticsearchIngestor(mapping_profile='lean')
+        es_doc = ingestor.transform_document({'Id_post': 7, 'Text': 'hello', 'Label': 'B'})
+
+        self.assertEqual(set(es_doc), set(LEAN_MAPPING['mappings']['properties']))
+        self.assertEqual(es_doc['contenu'], 'hello')
+        self.assertNotIn('original_text', es_doc)
+
+    # Test the index is created with the mapping of the selected profile
+    def test_create_lean_index(self):
+        ingestor = ElasticsearchIngestor(mapping_profile='lean')
+        ingestor.es = MagicMock()
+        ingestor.es.indices.exists.return_value = False
+        ingestor.create_index_mapping()
+
+        body = ingestor.es.indices.create.call_args.kwargs['body']
+        self.assertEqual(body['settings']['index.sort.field'], 'created_at')
+        self.assertFalse(body['mappings']['properties']['polarity']['index'])
+
+    # Test an unknown profile is rejected
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            ElasticsearchIngestor(mapping_profile='tiny')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import tempfile
+import json
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import argparse
+from language_router import (LanguageRouter, FULL_CHAIN, PASSTHROUGH_CHAIN,
+                             add_language_arguments, detect_language_confidence,
+                             get_language_router)
+from analysis import AnalyzedDocument
+from nlp_pipeline import NLPPipeline
+
+
+def fake_detector(text):
+    return 'eu' if text.startswith('kaixo') else 'en'
+
+
+class TestLanguageRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = LanguageRouter(detector=fake_detector)
+
+    # Test the default routes keep English on the full chain
+    def test_default_routes(self):
+        self.assertIs(self.router.route('en'), FULL_CHAIN)
+        self.assertIs(self.router.route('unknown'), FULL_CHAIN)
+        self.assertIs(self.router.route('eu'), PASSTHROUGH_CHAIN)
+
+    # Test routes loaded from a file, with an unsupported chain rejected
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'routes.json')
+            with open(path, 'w') as f:
+                json.dump({'en': 'passthrough', '*': 'full'}, f)
+            router = LanguageRouter.from_file(path)
+
+        self.assertIs(router.route('en'), PASSTHROUGH_CHAIN)
+        self.assertIs(router.route('fr'), FULL_CHAIN)
+        with self.assertRaises(ValueError):
+            LanguageRouter({'fr': 'french'})
+
+    # Test only the full chain runs the English preprocessing
+    def test_analyze_text(self):
+        preprocessor = MagicMock()
+        language, _ = self.router.analyze_text(preprocessor, 'kaixo mundua')
+        self.assertEqual(language, 'eu')
+        preprocessor.passthrough_text.assert_called_once_with('kaixo mundua')
+        preprocessor.analyze_text.assert_not_called()
+
+    # Test uncertain detections keep the full chain, whatever the language
+    def test_uncertain_detection(self):
+        router = LanguageRouter(detector=lambda text: ('it', 0.6 if len(text) < 30 else 0.99))
+        self.assertEqual(router.detect('Blonde people are bad'), ('it', FULL_CHAIN))
+        self.assertEqual(router.detect('Le persone bionde sono cattive, davvero.'),
+                         ('it', PASSTHROUGH_CHAIN))
+        self.assertEqual(detect_language_confidence('You look so sexy right now')[1], 0.0)
+        self.assertEqual(detect_language_confidence('ok'), ('unknown', 0.0))
+
+    # Test routing is off unless asked for
+    def test_routing_is_opt_in(self):
+        parser = add_language_arguments(argparse.ArgumentParser())
+        self.assertIsNone(get_language_router(parser.parse_args([])))
+        self.assertIsInstance(get_language_router(parser.parse_args(['--language-routing'])),
+                              LanguageRouter)
+
+    # Test the throughput report is kept per language
+    def test_throughput(self):
+        self.router.record('en', 0.5, posts=10)
+        self.router.record('eu', 0.1)
+        report = self.router.throughput()
+        self.assertEqual(list(report), ['en', 'eu'])
+        self.assertEqual(report['en']['posts_per_second'], 20.0)
+        self.assertEqual(report['eu']['chain'], 'passthrough')
+
+
+class TestNLPPipelineRouting(unittest.TestCase):
+    # Test non-English posts skip VADER/TextBlob and the English preprocessing
+    def test_analyze_batch_routes_languages(self):
+        preprocessor = MagicMock()
+        preprocessor.analyze_text.side_effect = AnalyzedDocument
+        preprocessor.passthrough_text.side_effect = AnalyzedDocument
+        pipeline = NLPPipeline(preprocessor=preprocessor,
+                               router=LanguageRouter(detector=fake_detector))
+        sentiment = {'sentiment': 'negative', 'polarity': -0.5, 'subjectivity': 0.5,
+                     'vader_compound': -0.6}
+
+        with patch.object(pipeline, 'analyze_sentiment',
+                          side_effect=lambda text: sentiment if text else
+                          {'sentiment': 'neutral', 'polarity': 0.0, 'subjectivity': 0.0}):
+            batch, failed = pipeline.analyze_batch([
+                {'_id': 1, 'Text': 'you are stupid', 'Label': 'B'},
+                {'_id': 2, 'Text': 'kaixo mundua', 'Label': 'NB', 'language': 'en'},
+            ])
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(batch.column('language'), ['en', 'eu'])
+        self.assertEqual(batch.column('sentiment'), ['negative', 'neutral'])
+        preprocessor.analyze_text.assert_called_once_with('you are stupid')
+        preprocessor.passthrough_text.assert_called_once_with('kaixo mundua')
+        self.assertEqual(pipeline.router.stats['eu'][0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from lexicon import AbuseLexicon, AhoCorasick
+
+
+class TestAhoCorasick(unittest.TestCase):
+    # Test overlapping and nested multi-word patterns are all reported
+    def test_overlapping_patterns(self):
+        automaton = AhoCorasick()
+        automaton.add(['a', 'b', 'c'], 'abc')
+        automaton.add(['b', 'c'], 'bc')
+        automaton.add(['b'], 'b')
+        automaton.add(['c', 'd'], 'cd')
+        automaton.compile()
+
+        matches = list(automaton.iter_matches('x a b c d'.split()))
+        self.assertEqual(sorted(matches), ['abc', 'b', 'bc', 'cd'])
+
+
+class TestAbuseLexicon(unittest.TestCase):
+    def setUp(self):
+        self.lexicon = AbuseLexicon({
+            'threats': ['kill', 'watch back'],
+            'troll': ['stupid', 'loser'],
+        })
+
+    # Test hits are counted per category and only on whole words
+    def test_count(self):
+        hits = self.lexicon.count('stupid loser watch back kill killer')
+        self.assertEqual(hits, {'threats': 2, 'troll': 2})
+
+    def test_count_empty(self):
+        self.assertEqual(self.lexicon.count(''), {'threats': 0, 'troll': 0})
+        self.assertEqual(self.lexicon.count(None), {'threats': 0, 'troll': 0})
+
+    # Test the shared lemmas are counted like their preprocessed text
+    def test_count_words(self):
+        words = ['stupid', 'loser', 'watch', 'back', 'kill', 'killer']
+        self.assertEqual(self.lexicon.count_words(words), self.lexicon.count(' '.join(words)))
+        self.assertEqual(self.lexicon.count_words([]), {'threats': 0, 'troll': 0})
+
+    def test_count_batch(self):
+        counts = self.lexicon.count_batch(['kill kill', 'nice day', 'stupid'])
+        self.assertEqual(counts.tolist(), [[2, 0], [0, 0], [0, 1]])
+
+    # Test the default lexicon covers the normalized Types categories
+    def test_default_lexicon(self):
+        lexicon = AbuseLexicon.from_file()
+        for category in ('religion', 'ethnicity', 'sexual', 'threats', 'vocational'):
+            self.assertIn(category, lexicon.categories)
+
+    # Test everyday work and injury words are not counted as abuse on their own
+    def test_default_lexicon_common_words(self):
+        lexicon = AbuseLexicon.from_file()
+        hits = lexicon.count('boss fire job die cast beat deadline hurt knee shut door '
+                             'dead battery')
+        self.assertEqual(sum(hits.values()), 0)
+        self.assertEqual(lexicon.count('hope die')['threats'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
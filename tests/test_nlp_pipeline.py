@@ -3,9 +3,11 @@ Unit tests for the NLP pipeline module
 """
 
 import unittest
+from datetime import datetime
 from unittest.mock import Mock, patch
+import os
 import sys
-sys.path.append('../scripts')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
 
 from scripts.nlp_pipeline import NLPPipeline
 
@@ -85,6 +87,16 @@ class TestNLPPipeline(unittest.TestCase):
         self.assertLess(score, 0.5)  # Should be low for normal content
         self.assertGreaterEqual(score, 0.0)  # Should not be negative
     
+    def test_calculate_toxicity_score_shared_word_count(self):
+        """Test a word count from the shared analysis gives the same score"""
+        text = "one two three four five six seven eight nine ten eleven"
+        sentiment_data = {'vader_compound': 0.0}
+
+        self.assertEqual(
+            self.nlp_pipeline.calculate_toxicity_score(text, 'NB', sentiment_data),
+            self.nlp_pipeline.calculate_toxicity_score(text, 'NB', sentiment_data, word_count=11)
+        )
+
     def test_process_document(self):
         """Test complete document processing"""
         sample_doc = {
@@ -110,5 +122,74 @@ class TestNLPPipeline(unittest.TestCase):
         self.assertIsInstance(result['subjectivity'], float)
         self.assertIsInstance(result['toxicity_score'], float)
 
+    def test_process_document_feeds_spike_detector(self):
+        """Test scored documents are fed to the spike detector"""
+        self.nlp_pipeline.spike_detector = Mock()
+        sample_doc = {'original_text': 'You are stupid and ugly', 'label': 'B', 'Types': 'troll'}
+
+        result = self.nlp_pipeline.process_document(sample_doc)
+
+        self.nlp_pipeline.spike_detector.observe.assert_called_once_with(
+            sample_doc, result['toxicity_score'])
+
+    def test_observe_terms(self):
+        """Test processed posts are counted once in the term sketches"""
+        from scripts.batch import PostBatch
+        self.nlp_pipeline.term_analytics = Mock()
+        documents = [{'_id': 1, 'preprocessed_text': 'stored text',
+                      'nlp_processed_at': datetime(2024, 3, 1)}, {'_id': 2},
+                     {'_id': 3, 'terms_counted_at': datetime(2024, 3, 1)}]
+        batch = PostBatch(3)
+        sentiment = {'sentiment': 'neutral', 'polarity': 0.0, 'subjectivity': 0.0}
+        batch.append_analysis(1, 'en', sentiment, 0.1)
+        index = batch.append_analysis(2, 'en', sentiment, 0.2)
+        batch.set_extra(index, 'preprocessed_text', 'fresh text')
+        # Already in the stored sketches: a replay does not count it again
+        index = batch.append_analysis(3, 'en', sentiment, 0.3)
+        batch.set_extra(index, 'preprocessed_text', 'replayed text')
+
+        self.nlp_pipeline.observe_terms(documents, batch)
+
+        calls = self.nlp_pipeline.term_analytics.observe.call_args_list
+        self.assertEqual([call[0] for call in calls],
+                         [(documents[0], None), (documents[1], 'fresh text')])
+        self.assertEqual(self.nlp_pipeline.terms_skipped, 1)
+
+    def test_observe_spikes_in_created_at_order(self):
+        """Test the posts of a batch reach the spike detector in created_at order"""
+        from scripts.batch import PostBatch
+        self.nlp_pipeline.spike_detector = Mock()
+        documents = [{'_id': _id, 'created_at': datetime(2024, 3, day)}
+                     for _id, day in ((1, 9), (2, 1), (3, 5))]
+        batch = PostBatch(3)
+        sentiment = {'sentiment': 'neutral', 'polarity': 0.0, 'subjectivity': 0.0}
+        for doc in documents:
+            batch.append_analysis(doc['_id'], 'en', sentiment, 0.1 * doc['_id'])
+
+        self.nlp_pipeline.observe_spikes(documents, batch)
+
+        calls = self.nlp_pipeline.spike_detector.observe.call_args_list
+        self.assertEqual([call[0][0]['_id'] for call in calls], [2, 3, 1])
+
+    def test_process_collection_replays_spikes(self):
+        """Test a backfill in _id order feeds the spike detector by replay, in created_at order"""
+        self.nlp_pipeline.spike_detector = Mock(spikes=0)
+        self.nlp_pipeline.checkpoints = Mock()
+        self.nlp_pipeline.checkpoints.load.return_value = {'last_id': 4, 'stats': {}}
+        self.nlp_pipeline.collection = Mock()
+        self.nlp_pipeline.collection.count_documents.return_value = 1
+        self.nlp_pipeline._schema = Mock()
+        with patch('scripts.nlp_pipeline.iter_id_batches', return_value=[[{'_id': 5}]]), \
+                patch.object(self.nlp_pipeline, 'process_batch', return_value=(1, 0)) as process, \
+                patch('scripts.nlp_pipeline.replay') as replay:
+            self.nlp_pipeline.process_collection(resume=True)
+
+        process.assert_called_once_with([{'_id': 5}], observe_spikes=False)
+        replay.assert_called_once_with(self.nlp_pipeline.collection,
+                                       self.nlp_pipeline.spike_detector,
+                                       self.nlp_pipeline.schema, query={'_id': {'$gt': 4}})
+        with self.assertRaises(ValueError):
+            self.nlp_pipeline.run_distributed_worker()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+import os
+import sys
+
+import pandas as pd
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from parquet_dataset import ParquetDataset, load_to_elasticsearch, load_to_mongo
+
+
+class TestParquetDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset = ParquetDataset(self.tmp_dir.name)
+        df = pd.DataFrame({
+            'Id_post': [1, 2, 3],
+            'Text': ['You are stupid', 'Nice day', 'Go away'],
+            'Label': ['B', 'NB', 'B']
+        })
+        self.dataset.write_dataframe(df, rows_per_file=2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    # Test rows are split into parts
+    def test_parts(self):
+        self.assertEqual(self.dataset.parts(), ['part-00000', 'part-00001'])
+
+    # Test a stage reads only its input columns and its results are joined back
+    def test_map_stage(self):
+        seen_columns = []
+
+        def upper(table):
+            seen_columns.append(table.column_names)
+            return {'upper_text': [t.upper() for t in table.column('Text').to_pylist()]}
+
+        self.assertEqual(self.dataset.map_stage('upper', ['Text'], upper), 3)
+        self.assertEqual(seen_columns, [['Text'], ['Text']])
+
+        docs = list(self.dataset.iter_documents(['Id_post', 'upper_text']))
+        self.assertEqual(docs[2], {'Id_post': 3, 'upper_text': 'GO AWAY'})
+        self.assertEqual(self.dataset.stages('part-00000'), ['base', 'upper'])
+
+    # Test a stage must return one value per row
+    def test_write_stage_row_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.dataset.write_stage('part-00000', 'bad', {'x': [1]})
+
+    # Test loading twice replaces the same documents, with the ES _id of es_ingest
+    def test_load_ids_are_deterministic(self):
+        collection = MagicMock()
+        load_to_mongo(self.dataset, collection)
+        load_to_mongo(self.dataset, collection)
+        first, second = [[request._filter['_id'] for request in call[0][0]]
+                         for call in collection.bulk_write.call_args_list]
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(first)), 3)
+
+        ingestor = MagicMock(index_name='posts')
+        ingestor.transform_document.side_effect = lambda doc: {}
+        indexed = []
+        with patch('parquet_dataset.helpers.streaming_bulk',
+                                 lambda es, actions, **kwargs: indexed.extend(actions) or []):
+            load_to_elasticsearch(self.dataset, ingestor)
+        self.assertEqual([action['_id'] for action in indexed], [str(i) for i in first])
+
+    def test_missing_column(self):
+        with self.assertRaises(KeyError):
+            self.dataset.read_columns('part-00000', ['preprocessed_text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
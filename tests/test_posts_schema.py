@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import os
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import bson
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from posts_schema import PostSchema, decode_document, get_posts_schema, migrate_collection
+
+
+def v1_post(i=1):
+    text = 'You are so stupid, nobody likes you'
+    return {'_id': i, 'Text': text, 'original_text': text, 'Label': 'B', 'Types': 'troll',
+            'Id_post': i, 'created_at': datetime(2024, 4, 16, 19, 16, 53),
+            'preprocessed_text': 'stupid nobody like', 'language': 'en', 'sentiment': 'negative',
+            'polarity': -0.8, 'subjectivity': 1.0, 'vader_compound': -0.6, 'toxicity_score': 0.9,
+            'nlp_processed_at': datetime(2025, 6, 19, 16, 37, 58)}
+
+
+class TestPostSchema(unittest.TestCase):
+    def setUp(self):
+        self.schema = PostSchema(2)
+
+    # Test a v2 document decodes back to the v1 post and is smaller
+    def test_round_trip(self):
+        post = v1_post()
+        stored = self.schema.encode_document(post)
+
+        self.assertNotIn('original_text', stored)
+        self.assertEqual(stored['l'], 1)
+        self.assertEqual(decode_document(stored), post)
+        self.assertLess(len(bson.encode(stored)), 0.8 * len(bson.encode(post)))
+
+    # Test unknown category values are kept as strings and v1 documents pass through
+    def test_unknown_values_and_v1(self):
+        stored = self.schema.encode_document(dict(v1_post(), language='tlh'))
+        self.assertEqual(stored['g'], 'tlh')
+        self.assertEqual(decode_document(stored)['language'], 'tlh')
+
+        post = v1_post()
+        self.assertIs(decode_document(post), post)
+        self.assertIs(PostSchema(1).encode_document(post), post)
+
+    # Test filters and projections on logical fields use the stored names and codes
+    def test_query_and_projection(self):
+        query = self.schema.query({'Label': {'$in': ['B', 'NB']},
+                                   'preprocessed_text': {'$exists': True},
+                                   '$or': [{'sentiment': 'negative'}, {'_id': {'$gt': 3}}]})
+        self.assertEqual(query, {'l': {'$in': [1, 0]}, 'p': {'$exists': True},
+                                 '$or': [{'s': 2}, {'_id': {'$gt': 3}}]})
+        self.assertEqual(self.schema.projection(['original_text', 'Label']),
+                         {'t': 1, 'l': 1, '_v': 1})
+
+    # Test a $set update leaves the derived original_text out
+    def test_encode_update(self):
+        update = self.schema.encode({'original_text': 'x', 'preprocessed_text': 'y',
+                                     'sentiment': 'neutral'})
+        self.assertEqual(update, {'p': 'y', 's': 0})
+
+
+class TestSchemaMigration(unittest.TestCase):
+    # Test the collection is rewritten batch by batch and the version recorded last
+    def test_migrate_collection(self):
+        db = MagicMock()
+        collection = db.posts
+        collection.find.return_value.sort.return_value.limit.side_effect = [
+            [v1_post(1), v1_post(2)], [v1_post(3)], []]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            count = migrate_collection(db, 2, batch_size=2,
+                                       checkpoint_path=os.path.join(tmp_dir, 'state.json'))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(collection.bulk_write.call_count, 2)
+        replacement = collection.bulk_write.call_args_list[0].args[0][0]._doc
+        self.assertEqual(replacement['_v'], 2)
+        last_update = db['schema_versions'].update_one.call_args
+        self.assertEqual(last_update.args[1]['$set'], {'version': 2})
+
+    # Test stages refuse to read a half-migrated collection
+    def test_schema_while_migrating(self):
+        db = MagicMock()
+        db['schema_versions'].find_one.return_value = {'_id': 'posts', 'version': 1,
+                                                       'migrating_to': 2}
+        with self.assertRaises(RuntimeError):
+            get_posts_schema(db)
+
+        db['schema_versions'].find_one.return_value = None
+        self.assertEqual(get_posts_schema(db).version, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
 import unittest
 from unittest.mock import Mock, patch
+import os
 import sys
-sys.path.append('../scripts')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
 
 from scripts.preprocessing import TextPreprocessor
 
@@ -84,5 +85,16 @@ class TestTextPreprocessor(unittest.TestCase):
         # Should result in empty or very short string after removing stopwords
         self.assertTrue(len(processed) < len(stopword_text))
 
+    def test_analyze_text_keeps_intermediate_results(self):
+        """Test the shared analysis matches preprocess_text and keeps its lemmas"""
+        text = "The cats were flying over the houses"
+        analyzed = self.preprocessor.analyze_text(text)
+
+        self.assertEqual(analyzed.preprocessed_text, self.preprocessor.preprocess_text(text))
+        self.assertEqual(analyzed.text, text)
+        self.assertEqual(analyzed.word_count, 7)
+        self.assertNotIn('the', analyzed.lemmas)
+        self.assertEqual(analyzed.preprocessed_text.split(), analyzed.lemmas)
+
 if __name__ == '__main__':
     unittest.main()
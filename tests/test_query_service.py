@@ -0,0 +1,199 @@
+import unittest
+import json
+import threading
+import time
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from http.server import ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from query_service import (PostFilter, PostQueryService, TTLCache, make_handler,
+                           notify_index_changed, parse_date)
+
+
+def search_response(index, body):
+    return {'hits': {'total': {'value': 1},
+                     'hits': [{'_id': '1', '_source': {'contenu': 'hello', 'size': body['size']}}]}}
+
+
+class SlowES:
+    """Fake client answering searches after a delay and counting them"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.searches = 0
+        self.lock = threading.Lock()
+
+    def search(self, index, body):
+        with self.lock:
+            self.searches += 1
+        time.sleep(self.delay)
+        return search_response(index, body)
+
+
+class TestQueryService(unittest.TestCase):
+    # Test concurrent identical requests are coalesced into one ES search
+    def test_coalescing(self):
+        es = SlowES()
+        service = PostQueryService(es, index_name='posts_test')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.high_toxicity()))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(es.searches, 1)
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[0]['documents'][0]['_id'], '1')
+        self.assertEqual(service.stats['misses'], 1)
+
+    # Test results are cached until an ingest notifies a change of the index
+    def test_cache_and_invalidation(self):
+        es = SlowES(delay=0)
+        service = PostQueryService(es, index_name='posts_test')
+        service.bullying_posts()
+        service.bullying_posts()
+        service.negative_sentiment()
+        self.assertEqual(es.searches, 2)
+
+        notify_index_changed('posts_test')
+        service.bullying_posts()
+        self.assertEqual(es.searches, 3)
+
+        # Other indices are left alone
+        notify_index_changed('other_index')
+        service.bullying_posts()
+        self.assertEqual(es.searches, 3)
+
+    # Test results fetched before the index refresh are not cached for the full TTL
+    def test_cache_until_refresh(self):
+        es = SlowES(delay=0)
+        service = PostQueryService(es, index_name='posts_refresh', refresh_seconds=0.05)
+        notify_index_changed('posts_refresh')
+        service.bullying_posts()
+        service.bullying_posts()
+        self.assertEqual(es.searches, 1)
+        time.sleep(0.06)
+        service.bullying_posts()
+        service.bullying_posts()
+        self.assertEqual(es.searches, 2)
+
+        # Notifying with the client refreshes the index before invalidating
+        client = MagicMock()
+        notify_index_changed('posts_refresh', es=client)
+        client.indices.refresh.assert_called_once_with(index='posts_refresh')
+
+    # Test an ingest in another process is seen through the generation counter
+    def test_generation_polling(self):
+        es = SlowES(delay=0)
+        db = MagicMock()
+        db['index_generations'].find_one.return_value = {'generation': 1}
+        service = PostQueryService(es, index_name='posts_test', db=db, poll_seconds=0)
+        service.search()
+        service.search()
+        db['index_generations'].find_one.return_value = {'generation': 2}
+        service.search()
+        self.assertEqual(es.searches, 2)
+
+    # Test a failed search is raised to every waiting caller and not cached
+    def test_error_not_cached(self):
+        es = MagicMock()
+        es.search.side_effect = [RuntimeError("node down"),
+                                 search_response('posts_test', {'size': 10})]
+        service = PostQueryService(es, index_name='posts_test')
+        with self.assertRaises(RuntimeError):
+            service.search()
+        self.assertEqual(service.search()['total_hits'], 1)
+
+    # Test the typed filters build one bool query
+    def test_post_filter(self):
+        post_filter = PostFilter(label='B', min_toxicity=0.7, since='now-7d', text='stupid')
+        query = post_filter.to_query()
+        self.assertIn({'term': {'label': 'B'}}, query['bool']['filter'])
+        self.assertIn({'range': {'toxicity_score': {'gte': 0.7}}}, query['bool']['filter'])
+        self.assertIn({'range': {'created_at': {'gte': 'now-7d'}}}, query['bool']['filter'])
+        self.assertEqual(query['bool']['must'], [{'match': {'contenu': 'stupid'}}])
+        self.assertEqual(PostFilter().to_query(), {'match_all': {}})
+        self.assertIsNone(post_filter.replace(label=None).label)
+        self.assertEqual(post_filter.label, 'B')
+
+
+class TestTTLCache(unittest.TestCase):
+    # Test entries expire after the TTL and the least recently used is evicted
+    def test_ttl_and_lru(self):
+        cache = TTLCache(max_entries=2, ttl=0.05)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        time.sleep(0.06)
+        self.assertEqual(cache.get('a'), (False, None))
+
+
+class TestQueryEndpoint(unittest.TestCase):
+    # Test the HTTP endpoint serves the typed queries as JSON
+    def test_endpoint(self):
+        es = SlowES(delay=0)
+        service = PostQueryService(es, index_name='posts_test')
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            with urlopen(f"{base_url}/high-toxicity?min_toxicity=0.9&size=2") as response:
+                payload = json.loads(response.read())
+            with urlopen(f"{base_url}/stats") as response:
+                stats = json.loads(response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(payload['total_hits'], 1)
+        self.assertEqual(payload['documents'][0]['size'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    # Test invalid term query dates are rejected with 400 before reaching the sketches
+    def test_endpoint_invalid_date(self):
+        service = PostQueryService(SlowES(delay=0), index_name='posts_test', db=MagicMock())
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            with self.assertRaises(HTTPError) as raised:
+                urlopen(f"{base_url}/top-terms?since=now-7d/d")
+            error = json.loads(raised.exception.read())
+            raised.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(raised.exception.code, 400)
+        self.assertIn('now-7d/d', error['error'])
+        service.db.__getitem__.assert_not_called()
+
+
+class TestParseDate(unittest.TestCase):
+    # Test the date math subset and ISO dates give naive UTC datetimes
+    def test_parse_date(self):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        week_ago = parse_date('now-7d')
+        self.assertLess(abs(week_ago - (now - timedelta(days=7))), timedelta(seconds=5))
+        self.assertLess(abs(parse_date('now+2h') - (now + timedelta(hours=2))),
+                        timedelta(seconds=5))
+        self.assertEqual(parse_date('2024-03-01T12:00:00+02:00'), datetime(2024, 3, 1, 10))
+        self.assertEqual(parse_date('2024-03-01'), datetime(2024, 3, 1))
+        self.assertIsNone(parse_date(None))
+        for value in ('yesterday', 'now-7x', 'now-d'):
+            with self.assertRaises(ValueError):
+                parse_date(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
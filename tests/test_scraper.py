@@ -7,7 +7,8 @@ import sys
 from unittest.mock import MagicMock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
-from scraper import Scraper
+from scraper import Scraper, normalize_record
+from posts_schema import PostSchema
 
 
 class TestDataScraper(unittest.TestCase):
@@ -61,6 +62,18 @@ class TestDataScraper(unittest.TestCase):
         self.scraper.apply_function('Label', self.scraper.normalize_label)
         self.assertListEqual(self.scraper.df['Label'].tolist(), ['B', 'NB'])
     
+    # Test a streamed record gets the same normalization and defaults as the CSV load
+    def test_normalize_record(self):
+        record = normalize_record({'Text': 'hi', 'Label': ' Bullying', 'Types': 'Religon',
+                                   'created_at': '2024-02-03T04:05:06'})
+        self.assertEqual((record['Label'], record['Types']), ('B', 'religion'))
+        self.assertEqual(record['created_at'].day, 3)
+        self.assertNotIn('Id_post', record)
+
+        record = normalize_record({'Text': 'hi', 'Id_post': 12})
+        self.assertEqual((record['Label'], record['Types'], record['Id_post']), ('NB', 'none', 12))
+        self.assertIsNotNone(record['created_at'])
+
     # Test unique value printing does not raise errors
     def test_print_unique_values(self):
         try:
@@ -70,17 +83,16 @@ class TestDataScraper(unittest.TestCase):
     
     
     #Test MongoDB insertion with mock
-    @patch("scraper.MongoClient")
-    def test_insert_to_mongo(self, mock_mongo_client):
+    @patch("scraper.get_posts_schema", return_value=PostSchema(1))
+    @patch("scraper.get_mongo_db")
+    def test_insert_to_mongo(self, mock_get_mongo_db, mock_get_posts_schema):
         
-        mock_client_instance = MagicMock()
         mock_db = MagicMock()
         mock_collection = MagicMock()
 
-        mock_client_instance.__getitem__.return_value = mock_db
         mock_db.__getitem__.return_value = mock_collection
 
-        mock_mongo_client.return_value = mock_client_instance
+        mock_get_mongo_db.return_value = mock_db
 
         self.scraper.insert_to_mongo()
         mock_collection.insert_many.assert_called_once()
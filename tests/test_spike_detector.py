@@ -0,0 +1,175 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+import os
+import random
+import subprocess
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from analysis import anonymous_author
+from spike_detector import SpikeDetector, WindowStats, event_time, mongo_sink, replay
+from posts_schema import PostSchema
+
+START = datetime(2024, 3, 1)
+
+
+def post(minutes, toxicity_score, types='religion', id_post=1):
+    return {'Id_post': id_post, 'Types': types, 'toxicity_score': toxicity_score,
+            'created_at': START + timedelta(minutes=minutes)}
+
+
+def background(detector, hours=3):
+    """One mildly toxic post every 10 minutes, from a rotating set of authors"""
+    for minute in range(0, hours * 60, 10):
+        detector.observe(post(minute, 0.2, id_post=minute))
+
+
+class TestSpikeDetector(unittest.TestCase):
+    # Test a burst of toxic posts of one type is reported once per bucket
+    def test_spike_on_burst(self):
+        spikes = []
+        detector = SpikeDetector(spikes.append, keys=('type',))
+        background(detector)
+        self.assertEqual(spikes, [])
+
+        for second in range(20):
+            detector.observe(post(180 + second / 60, 0.9, id_post=1000 + second))
+
+        self.assertEqual(len(spikes), 1)
+        spike = spikes[0]
+        self.assertEqual((spike['kind'], spike['key']), ('type', 'religion'))
+        self.assertEqual(spike['bucket_start'].hour, 3)
+        self.assertGreaterEqual(spike['z_score'], 4.0)
+        self.assertGreaterEqual(spike['bucket_posts'], 5)
+
+    # Test a repeated author spikes on its own key
+    def test_author_spike(self):
+        spikes = []
+        detector = SpikeDetector(spikes.append)
+        background(detector)
+        for second in range(10):
+            detector.observe(post(200 + second / 60, 0.95, types='none', id_post=7))
+        self.assertIn(('auteur', anonymous_author(7)),
+                      [(spike['kind'], spike['key']) for spike in spikes])
+
+    # Test no spike is emitted before the warm-up or below min_posts
+    def test_warmup_and_min_posts(self):
+        spikes = []
+        detector = SpikeDetector(spikes.append, keys=('type',))
+        for second in range(20):
+            detector.observe(post(second / 60, 0.9))
+        detector = SpikeDetector(spikes.append, keys=('type',), min_posts=50)
+        background(detector)
+        for second in range(20):
+            detector.observe(post(180 + second / 60, 0.9))
+        self.assertEqual(spikes, [])
+
+    # Test posts leave the sliding window and the EWMA follows idle buckets
+    def test_sliding_window(self):
+        detector = SpikeDetector(keys=('type',), window_seconds=3600, bucket_seconds=300)
+        for minute in range(0, 60, 5):
+            detector.observe(post(minute, 0.5))
+        self.assertEqual(detector.snapshot('type', 'religion')['window_posts'], 12)
+
+        detector.observe(post(90, 0.5))
+        stats = detector.snapshot('type', 'religion')
+        self.assertEqual(stats['window_posts'], 6)
+        self.assertAlmostEqual(stats['window_mean_toxicity'], 0.5)
+
+        # After a long gap the window is empty and the EWMA has decayed
+        detector.observe(post(60 * 24 * 30, 0.5))
+        stats = detector.snapshot('type', 'religion')
+        self.assertEqual(stats['window_posts'], 1)
+        self.assertLess(stats['ewma_mean'], 0.01)
+
+    # Test idle buckets are folded into the EWMA in one step
+    def test_empty_buckets_closed_form(self):
+        detector = SpikeDetector(alpha=0.1)
+        stepwise, folded = WindowStats(12, 0), WindowStats(12, 0)
+        for window in (stepwise, folded):
+            window.mean, window.var = 2.0, 0.7
+        for _ in range(37):
+            detector._close_bucket(stepwise, 0.0)
+        detector._close_empty_buckets(folded, 37)
+        self.assertAlmostEqual(stepwise.mean, folded.mean)
+        self.assertAlmostEqual(stepwise.var, folded.var)
+        self.assertEqual(stepwise.closed, folded.closed)
+
+    # Test posts arriving out of created_at order do not spike the current bucket
+    def test_out_of_order_posts(self):
+        spikes = []
+        posts = [post(minute, 0.5, id_post=minute) for minute in range(6 * 60)]
+        random.Random(0).shuffle(posts)
+        detector = SpikeDetector(spikes.append, keys=('type',))
+        for doc in posts:
+            detector.observe(doc)
+        self.assertEqual(spikes, [])
+        self.assertGreater(detector.late, 0)
+
+        # A late post inside the window is counted, one older than the window is dropped
+        detector = SpikeDetector(keys=('type',), window_seconds=3600, bucket_seconds=300)
+        detector.observe(post(120, 0.5))
+        detector.observe(post(100, 0.5))
+        detector.observe(post(30, 0.5))
+        self.assertEqual(detector.snapshot('type', 'religion')['window_posts'], 2)
+        self.assertEqual((detector.observed, detector.late), (3, 1))
+
+    # Test the number of tracked keys is bounded
+    def test_max_keys(self):
+        detector = SpikeDetector(keys=('auteur',), max_keys=10)
+        for id_post in range(100):
+            detector.observe(post(0, 0.1, id_post=id_post))
+        self.assertEqual(len(detector.windows['auteur']), 10)
+        self.assertIsNotNone(detector.snapshot('auteur', anonymous_author(99)))
+
+    # Test a post gets the same auteur in every process, whatever its hash seed
+    def test_author_is_stable(self):
+        script = ("import sys; sys.path.insert(0, sys.argv[1]); "
+                  "from analysis import anonymous_author; print(anonymous_author('1234'))")
+        scripts_dir = os.path.join(os.path.dirname(__file__), '..', 'scripts')
+        authors = {subprocess.run([sys.executable, '-c', script, scripts_dir], capture_output=True,
+                                  text=True, env=dict(os.environ, PYTHONHASHSEED=seed),
+                                  check=True).stdout.strip()
+                   for seed in ('1', '2', '3')}
+        self.assertEqual(authors, {anonymous_author('1234')})
+        self.assertEqual(anonymous_author(1234), anonymous_author('1234'))
+
+    # Test created_at values of every stored form are understood
+    def test_event_time(self):
+        self.assertEqual(event_time('2024-03-01T00:00:00Z'), event_time(START))
+        self.assertEqual(event_time(1709251200), event_time(START))
+        self.assertIsNone(event_time(None))
+
+    # Test the Mongo sink stores the spike events
+    def test_mongo_sink(self):
+        collection = MagicMock()
+        detector = SpikeDetector(mongo_sink(collection), keys=('type',))
+        background(detector)
+        for second in range(20):
+            detector.observe(post(180 + second / 60, 0.9))
+        collection.insert_one.assert_called_once()
+        self.assertEqual(collection.insert_one.call_args[0][0]['key'], 'religion')
+
+
+class TestReplay(unittest.TestCase):
+    # Test replay reads the scored posts in created_at order, in the stored layout
+    def test_replay_v2(self):
+        collection = MagicMock()
+        collection.find.return_value.sort.return_value = [
+            {'_v': 2, 'i': 1, 'y': 1, 'c': START, 'x': 0.9},
+            {'_v': 2, 'i': 2, 'y': 2, 'c': START, 'x': 0.1},
+        ]
+        detector = SpikeDetector(keys=('type',))
+
+        replayed = replay(collection, detector, PostSchema(2), since=START)
+
+        self.assertEqual(replayed, 2)
+        query = collection.find.call_args[0][0]
+        self.assertEqual(query, {'x': {'$exists': True}, 'c': {'$gte': START}})
+        collection.find.return_value.sort.assert_called_once_with('c', 1)
+        self.assertEqual(set(detector.windows['type']), {'religion', 'ethnicity'})
+
+
+if __name__ == '__main__':
+    unittest.main()
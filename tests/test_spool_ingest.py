@@ -0,0 +1,223 @@
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import BulkWriteError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from spool_ingest import SpoolIngestor, es_stage
+from checkpoint import FileCheckpointStore
+from posts_schema import PostSchema
+
+
+def insert_many_result(documents, ordered=False):
+    result = MagicMock()
+    result.inserted_ids = [doc['_id'] for doc in documents]
+    return result
+
+
+class TestSpoolIngestor(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(tempfile.mkdtemp(), 'spool_state.json')
+        self.collection = MagicMock()
+        self.collection.insert_many.side_effect = insert_many_result
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+        shutil.rmtree(os.path.dirname(self.checkpoint_path))
+
+    def write(self, name, records, partial=None):
+        with open(os.path.join(self.spool_dir, name), 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            if partial is not None:
+                f.write(partial)
+
+    def ingestor(self, **options):
+        return SpoolIngestor(self.spool_dir, self.collection,
+                             FileCheckpointStore(self.checkpoint_path), schema=PostSchema(1),
+                             poll_interval=0.01, **options)
+
+    def inserted(self):
+        return [doc for call in self.collection.insert_many.call_args_list
+                for doc in call[0][0]]
+
+    # Test complete lines are normalized, inserted in micro-batches and passed to the stages
+    def test_drain_spool(self):
+        self.write('a.jsonl', [{'Text': 'hello', 'Label': 'Not-Bullying'},
+                               {'Text': 'you idiot', 'Label': 'bullying', 'Types': 'Racism'},
+                               {'Text': 'x', 'Label': 'B', 'created_at': '2024-05-01T10:00:00Z'}],
+                   partial='{"Text": "still being wri')
+        stage = MagicMock()
+
+        inserted_count = self.ingestor(batch_size=2, stages=[stage]).run(once=True)
+
+        self.assertEqual(inserted_count, 3)
+        self.assertEqual(self.collection.insert_many.call_count, 2)
+        self.assertEqual(stage.call_count, 2)
+        docs = self.inserted()
+        self.assertEqual([doc['Label'] for doc in docs], ['NB', 'B', 'B'])
+        self.assertEqual([doc['Types'] for doc in docs], ['none', 'ethnicity', 'unknown'])
+        self.assertEqual(docs[2]['created_at'].year, 2024)
+        self.assertEqual(len({doc['_id'] for doc in docs}), 3)
+
+    # Test a restart continues after the committed offsets, including a line finished since
+    def test_restart_from_offsets(self):
+        self.write('a.jsonl', [{'Text': 'one'}], partial='{"Text": "tw')
+        self.ingestor().run(once=True)
+        with open(os.path.join(self.spool_dir, 'a.jsonl'), 'a', encoding='utf-8') as f:
+            f.write('o"}\n')
+        self.write('a.jsonl', [{'Text': 'three'}])
+
+        self.ingestor().run(once=True)
+
+        self.assertEqual([doc['Text'] for doc in self.inserted()], ['one', 'two', 'three'])
+
+    # Test a batch replayed after a crash is skipped as duplicate keys
+    def test_replay_is_idempotent(self):
+        self.write('a.jsonl', [{'Text': 'one'}, {'Text': 'two'}])
+        self.ingestor().run(once=True)
+        first_ids = [doc['_id'] for doc in self.inserted()]
+
+        # Offsets lost after the insert: the same _ids are generated again
+        state = FileCheckpointStore(self.checkpoint_path)
+        checkpoint = state.load('spool')
+        checkpoint['last_id']['a.jsonl']['offset'] = 0
+        state.save('spool', checkpoint['last_id'], checkpoint['stats'])
+        self.collection.insert_many.side_effect = BulkWriteError({
+            'nInserted': 0, 'writeErrors': [{'code': 11000}, {'code': 11000}]})
+
+        ingestor = self.ingestor()
+        ingestor.run(once=True)
+
+        self.assertEqual([doc['_id'] for doc in self.inserted()[2:]], first_ids)
+        self.assertEqual(ingestor.stats['duplicates'], 2)
+        self.assertEqual(ingestor.stats['inserted'], 2)
+
+    # Test --from-start reads every file again with the same _ids, so nothing is inserted twice
+    def test_from_start_inserts_nothing_new(self):
+        stored = set()
+
+        def insert_many(documents, ordered=False):
+            duplicates = [doc for doc in documents if doc['_id'] in stored]
+            stored.update(doc['_id'] for doc in documents)
+            if duplicates:
+                raise BulkWriteError({'nInserted': len(documents) - len(duplicates),
+                                      'writeErrors': [{'code': 11000} for _ in duplicates]})
+            return insert_many_result(documents)
+
+        self.collection.insert_many.side_effect = insert_many
+        self.write('a.jsonl', [{'Text': 'one'}, {'Text': 'two'}])
+        self.ingestor().run(once=True)
+        self.write('b.jsonl', [{'Text': 'three'}])
+
+        ingestor = self.ingestor(from_start=True)
+        ingestor.run(once=True)
+
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(ingestor.stats['duplicates'], 2)
+        self.assertEqual([doc['Text'] for doc in self.inserted()[2:]], ['one', 'two', 'three'])
+
+    # Test invalid lines are skipped and counted
+    def test_invalid_lines(self):
+        self.write('a.jsonl', [{'Text': 'one'}], partial='not json\n\n')
+        ingestor = self.ingestor()
+        ingestor.run(once=True)
+        self.assertEqual(ingestor.stats['inserted'], 1)
+        self.assertEqual(ingestor.stats['invalid'], 1)
+
+    # Test records that cannot be normalized are skipped and counted, not retried forever
+    def test_invalid_records(self):
+        self.write('a.jsonl', [{'Text': 'empty label', 'Label': ''},
+                               {'Text': 'numeric label', 'Label': 1},
+                               {'Text': 'bad date', 'created_at': 'yesterday'},
+                               ['not', 'an', 'object'],
+                               {'Text': 'fine', 'Label': 'bullying'}])
+        ingestor = self.ingestor()
+        ingestor.run(once=True)
+        self.assertEqual([doc['Text'] for doc in self.inserted()], ['empty label', 'fine'])
+        self.assertEqual(self.inserted()[0]['Label'], 'NB')
+        self.assertEqual(ingestor.stats['invalid'], 3)
+
+        # The offsets were committed past the invalid records
+        self.write('b.jsonl', [{'Text': 'bad date', 'created_at': 'yesterday'}])
+        ingestor = self.ingestor()
+        ingestor.run(once=True)
+        self.assertEqual(len(self.inserted()), 2)
+        self.assertEqual(ingestor.stats['invalid'], 4)
+
+    # Test documents rejected by Elasticsearch are retried, then fail the batch
+    def test_es_rejections_fail_the_batch(self):
+        self.write('a.jsonl', [{'Text': 'one'}, {'Text': 'two'}])
+        self.collection.find.side_effect = lambda query: [{'_id': _id}
+                                                          for _id in query['_id']['$in']]
+        with patch('es_ingest.ElasticsearchIngestor') as ingestor_class, \
+                patch('spool_ingest.time.sleep') as sleep:
+            ingestor_class.return_value.index_documents.side_effect = [(1, 1), (1, 1), (2, 0)]
+            self.ingestor(stages=[es_stage(self.collection, retries=2)]).run(once=True)
+            self.assertEqual(sleep.call_count, 2)
+            # The indexed batch bumps the generation polled by other processes
+            generations = self.collection.database['index_generations']
+            generations.update_one.assert_called_once_with(
+                {'_id': 'harcelement_posts'}, {'$inc': {'generation': 1}}, upsert=True)
+
+            ingestor_class.return_value.index_documents.side_effect = None
+            ingestor_class.return_value.index_documents.return_value = (1, 1)
+            self.write('a.jsonl', [{'Text': 'three'}])
+            with self.assertRaises(RuntimeError):
+                self.ingestor(stages=[es_stage(self.collection, retries=2)]).run(once=True)
+
+        # The rejected batch was not committed: a restart reads it again
+        checkpoint = FileCheckpointStore(self.checkpoint_path).load('spool')
+        self.assertEqual(checkpoint['stats']['batches'], 1)
+        self.collection.insert_many.reset_mock()
+        self.ingestor().run(once=True)
+        self.assertEqual([doc['Text'] for doc in self.inserted()], ['three'])
+
+    # Test the reader stops reading while MongoDB is slow
+    def test_backpressure(self):
+        self.write('a.jsonl', [{'Text': f'post {i}'} for i in range(200)])
+        release = threading.Event()
+
+        def slow_insert(documents, ordered=False):
+            release.wait(5)
+            return insert_many_result(documents)
+
+        self.collection.insert_many.side_effect = slow_insert
+        ingestor = self.ingestor(batch_size=10, max_pending=2)
+        runner = threading.Thread(target=ingestor.run, kwargs={'once': True})
+        runner.start()
+        time.sleep(0.2)
+        read_while_blocked = ingestor.reading['a.jsonl']['read']
+        release.set()
+        runner.join(5)
+
+        file_size = os.path.getsize(os.path.join(self.spool_dir, 'a.jsonl'))
+        self.assertLess(read_while_blocked, file_size / 2)
+        self.assertEqual(ingestor.stats['inserted'], 200)
+
+    # Test a partial batch is flushed after max_latency while tailing
+    def test_latency_bound(self):
+        ingestor = self.ingestor(batch_size=1000, max_latency=0.05)
+        runner = threading.Thread(target=ingestor.run)
+        runner.start()
+        try:
+            self.write('a.jsonl', [{'Text': 'one'}, {'Text': 'two'}])
+            deadline = time.monotonic() + 5
+            while not self.collection.insert_many.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            ingestor.stop()
+            runner.join(5)
+        self.assertEqual(len(self.inserted()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
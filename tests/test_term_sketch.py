@@ -0,0 +1,177 @@
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+import os
+import random
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from posts_schema import PostSchema
+from term_sketch import (CountMinSketch, SpaceSaving, TermAnalytics, TermSketch, bucket_start,
+                         save_sketch, top_terms, trending_terms)
+
+DAY = datetime(2024, 3, 1)
+
+
+def zipf_terms(count, seed=0, vocabulary=500):
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    return rng.choices(words, weights, k=count)
+
+
+def stored(sketch, types='religion', label='B', bucket=DAY):
+    return dict(sketch.to_document(), types=types, label=label, bucket=bucket, version=1)
+
+
+class TestTermSketch(unittest.TestCase):
+    # Test count-min estimates never under-count and stay close on frequent terms
+    def test_count_min_estimates(self):
+        terms = zipf_terms(20000)
+        truth = Counter(terms)
+        cms = CountMinSketch(width=512, depth=4)
+        cms.add(terms[:10000])
+        cms.add(list(Counter(terms[10000:])), list(Counter(terms[10000:]).values()))
+
+        for term, count in truth.most_common(50):
+            self.assertGreaterEqual(cms.estimate(term), count)
+            self.assertLessEqual(cms.estimate(term), count + 0.01 * len(terms))
+        self.assertEqual(cms.estimate('absent'), cms.estimate('absent'))
+
+    # Test space-saving keeps the heavy hitters with bounded errors
+    def test_space_saving_top_k(self):
+        terms = zipf_terms(20000)
+        truth = Counter(terms)
+        summary = SpaceSaving(k=50)
+        for term in terms:
+            summary.add(term)
+
+        top = summary.top(5)
+        self.assertEqual([term for term, _, _ in top], [term for term, _ in truth.most_common(5)])
+        for term, count, error in summary.top():
+            self.assertLessEqual(count - error, truth[term])
+            self.assertGreaterEqual(count, truth[term])
+
+    # Test sketches built by separate workers merge into the sketch of all their posts
+    def test_merge_across_workers(self):
+        terms = zipf_terms(6000, seed=1)
+        whole = TermSketch(width=256, k=40)
+        whole.add(terms)
+        parts = [TermSketch(width=256, k=40) for _ in range(3)]
+        for index, part in enumerate(parts):
+            part.add(terms[index::3])
+        merged = parts[0].merge(parts[1]).merge(parts[2])
+
+        self.assertEqual(merged.total, whole.total)
+        self.assertTrue((merged.cms.table == whole.cms.table).all())
+        self.assertEqual([term for term, _, _ in merged.top.top(5)],
+                         [term for term, _, _ in whole.top.top(5)])
+        with self.assertRaises(ValueError):
+            merged.merge(TermSketch(width=128))
+
+    # Test a sketch survives a round trip through its stored document
+    def test_document_round_trip(self):
+        sketch = TermSketch(width=64, depth=3, k=5)
+        sketch.add("stupid ugly stupid loser stupid".split())
+        restored = TermSketch.from_document(sketch.to_document())
+
+        self.assertEqual(restored.total, 5)
+        self.assertEqual(restored.cms.estimate('stupid'), 3)
+        self.assertEqual(restored.top.top(1), [('stupid', 3, 0)])
+
+    # Test stored sketches are merged with optimistic concurrency
+    def test_save_sketch(self):
+        collection = MagicMock()
+        collection.find_one.return_value = None
+        sketch = TermSketch(width=64, k=5)
+        sketch.add(['hate', 'hate'])
+        save_sketch(collection, 'religion', 'B', DAY, sketch)
+        inserted = collection.insert_one.call_args[0][0]
+        self.assertEqual(inserted['_id'], 'religion|B|2024-03-01T00:00')
+        self.assertEqual(inserted['top'], [['hate', 2, 0]])
+
+        collection.find_one.return_value = dict(inserted)
+        collection.replace_one.side_effect = [MagicMock(matched_count=0),
+                                              MagicMock(matched_count=1)]
+        save_sketch(collection, 'religion', 'B', DAY, sketch)
+        query, replacement = collection.replace_one.call_args[0]
+        self.assertEqual(query, {'_id': 'religion|B|2024-03-01T00:00', 'version': 1})
+        self.assertEqual((replacement['total'], replacement['version']), (4, 2))
+        self.assertEqual(collection.replace_one.call_count, 2)
+
+    # Test posts are counted per Types, Label and bucket and flushed in bounded memory
+    def test_analytics_observe_and_flush(self):
+        collection = MagicMock()
+        collection.find_one.return_value = None
+        analytics = TermAnalytics(collection, width=64, k=10, max_pending=5)
+        analytics.observe({'Types': 'troll', 'Label': 'B', 'created_at': DAY,
+                           'preprocessed_text': 'loser loser'})
+        analytics.observe({'Types': 'troll', 'Label': 'B', 'created_at': DAY + timedelta(hours=3)},
+                          'loser idiot')
+        analytics.observe({'Types': 'none', 'Label': 'NB', 'created_at': DAY,
+                           'preprocessed_text': ''})
+        self.assertEqual(collection.insert_one.call_count, 0)
+        self.assertEqual(list(analytics.pending), [('troll', 'B', DAY)])
+
+        analytics.observe({'Types': 'troll', 'Label': 'B', 'created_at': DAY + timedelta(days=1)},
+                          'one two three')
+        self.assertEqual(analytics.pending, {})
+        saved = {call[0][0]['_id']: call[0][0] for call in collection.insert_one.call_args_list}
+        self.assertEqual(saved['troll|B|2024-03-01T00:00']['top'], [['loser', 3, 0],
+                                                                    ['idiot', 1, 0]])
+        self.assertEqual(bucket_start('2024-03-01T18:30:00', 3600), datetime(2024, 3, 1, 18))
+
+    # Test counted posts are marked only once their sketches are saved
+    def test_flush_marks_counted_posts(self):
+        collection, posts = MagicMock(), MagicMock()
+        collection.find_one.return_value = None
+        analytics = TermAnalytics(collection, width=64, k=10, posts=posts, schema=PostSchema(2))
+        analytics.observe({'_id': 1, 'Types': 'troll', 'Label': 'B', 'created_at': DAY},
+                          'loser loser')
+        analytics.observe({'_id': 2, 'Types': 'none', 'Label': 'NB', 'created_at': DAY}, '')
+        posts.update_many.assert_not_called()
+
+        analytics.flush()
+        collection.insert_one.assert_called_once()
+        query, update = posts.update_many.call_args[0]
+        self.assertEqual(query, {'_id': {'$in': [1, 2]}})
+        self.assertEqual(list(update['$set']), ['tc'])
+        self.assertEqual((analytics.counted, analytics.pending_ids), (2, []))
+
+    # Test top and trending terms are read from the stored sketches
+    def test_top_and_trending_terms(self):
+        old, recent = TermSketch(width=256), TermSketch(width=256)
+        old.add(['video'] * 50 + ['like'] * 50)
+        recent.add(['video'] * 10 + ['like'] * 10 + ['raid'] * 20)
+        documents = [stored(old, bucket=DAY), stored(recent, bucket=DAY + timedelta(days=10))]
+
+        def find(query, projection=None):
+            bucket = query.get('bucket', {})
+            return [doc for doc in documents
+                    if doc['bucket'] >= bucket.get('$gte', datetime.min)
+                    and doc['bucket'] < bucket.get('$lt', datetime.max)]
+
+        collection = MagicMock()
+        collection.find.side_effect = find
+        collection.find_one.return_value = {'bucket': DAY + timedelta(days=10)}
+
+        self.assertEqual(top_terms(collection, n=2), [('like', 60, 0), ('video', 60, 0)])
+        self.assertEqual(top_terms(collection, until=DAY + timedelta(days=1), n=1),
+                         [('like', 50, 0)])
+        trending = trending_terms(collection, n=3)
+        self.assertEqual(trending[0]['term'], 'raid')
+        self.assertEqual(trending[0]['baseline_count'], 0)
+        self.assertLess(trending[-1]['lift'], 1)
+
+        # Hourly sketches: the window ends one hour, not one day, after the latest bucket
+        collection.find.reset_mock()
+        trending_terms(collection, window=timedelta(hours=6), baseline=timedelta(hours=24),
+                       bucket_seconds=3600)
+        latest = DAY + timedelta(days=10, hours=1)
+        self.assertEqual(collection.find.call_args_list[0][0][0]['bucket'],
+                         {'$gte': latest - timedelta(hours=6), '$lt': latest})
+
+
+if __name__ == '__main__':
+    unittest.main()
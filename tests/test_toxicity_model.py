@@ -0,0 +1,53 @@
+import unittest
+import tempfile
+import os
+import sys
+from unittest.mock import MagicMock
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from toxicity_model import ToxicityModel, train_from_collection
+
+
+def labeled_posts():
+    toxic = ['stupid loser', 'kill stupid idiot', 'ugly loser idiot', 'hate stupid']
+    clean = ['nice day friend', 'love sunny day', 'great job team', 'happy friend']
+    docs = []
+    for i in range(40):
+        docs.append({'_id': 2 * i, 'preprocessed_text': toxic[i % 4], 'Label': 'B'})
+        docs.append({'_id': 2 * i + 1, 'preprocessed_text': clean[i % 4], 'Label': 'NB'})
+    return docs
+
+
+class TestToxicityModel(unittest.TestCase):
+    def setUp(self):
+        collection = MagicMock()
+        cursor = collection.find.return_value.sort.return_value.limit
+        # One batch per epoch followed by the end of the collection
+        cursor.side_effect = [labeled_posts(), []] * 5
+        self.model, self.metrics = train_from_collection(collection, n_features=2 ** 12,
+                                                         batch_size=100, epochs=5)
+
+    # Test the model separates toxic from clean texts
+    def test_predict_proba(self):
+        scores = self.model.predict_proba(['stupid idiot loser', 'nice sunny day', '', None])
+        self.assertGreater(scores[0], 0.5)
+        self.assertLess(scores[1], 0.5)
+        self.assertEqual(scores.shape, (4,))
+        self.assertGreater(self.metrics['accuracy'], 0.9)
+
+    # Test the sparse on-disk format round-trips
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'model.npz')
+            self.model.save(path)
+            loaded = ToxicityModel.load(path)
+
+        texts = ['stupid idiot', 'nice day']
+        np.testing.assert_allclose(loaded.predict_proba(texts), self.model.predict_proba(texts))
+        self.assertEqual(loaded.ngram_range, (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from unittest.mock import MagicMock
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from connections import mongo_uri
+from work_queue import LeaseHeartbeat, LeaseWorkQueue, run_worker, unit_query
+
+TEST_DB = 'harcelement_test_work_queue'
+
+
+def mongo_reachable():
+    """True if the MongoDB server of $MONGO_URI (or localhost) answers"""
+    try:
+        client = MongoClient(mongo_uri(), serverSelectionTimeoutMS=500)
+        try:
+            client.admin.command('ping')
+        finally:
+            client.close()
+        return True
+    except PyMongoError:
+        return False
+
+
+def run_worker_process(uri, worker_id, barrier):
+    """Worker process of the integration tests: plans the job, then drains it"""
+    client = MongoClient(uri)
+    try:
+        db = client[TEST_DB]
+        queue = LeaseWorkQueue(db.jobs, 'nlp', lease_seconds=5, worker_id=worker_id)
+        barrier.wait()
+        queue.plan(db.posts, unit_size=5)
+
+        def process_unit(unit, heartbeat):
+            db.claims.insert_one({'unit': unit['_id'], 'worker': worker_id})
+            time.sleep(0.05)
+            return {'worker': worker_id}
+
+        run_worker(queue, process_unit, idle_wait=0.1)
+    finally:
+        client.close()
+
+
+class TestLeaseWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.jobs = MagicMock()
+        self.jobs.count_documents.return_value = 0
+        self.queue = LeaseWorkQueue(self.jobs, 'nlp', lease_seconds=30, worker_id='w1')
+
+    # Test the _id space is split into contiguous units
+    def test_plan_units(self):
+        collection = MagicMock()
+        collection.find.return_value.sort.return_value = [{'_id': i} for i in range(1, 8)]
+
+        planned = self.queue.plan(collection, unit_size=3)
+
+        self.assertEqual(planned, 3)
+        units = self.jobs.insert_many.call_args.args[0]
+        self.assertEqual([(u['min_id'], u['max_id']) for u in units],
+                         [(1, 4), (4, 7), (7, None)])
+        self.assertTrue(all(u['status'] == 'pending' for u in units))
+
+    # Test planning is skipped when the job already has units
+    def test_plan_existing_job(self):
+        self.jobs.count_documents.return_value = 1
+        self.assertEqual(self.queue.plan(MagicMock()), 0)
+        self.jobs.insert_many.assert_not_called()
+
+    # Test the last unit has no upper bound
+    def test_unit_query(self):
+        self.assertEqual(unit_query({'min_id': 1, 'max_id': 4}), {'_id': {'$gte': 1, '$lt': 4}})
+        self.assertEqual(unit_query({'min_id': 7, 'max_id': None}), {'_id': {'$gte': 7}})
+
+
+class TestRunWorker(unittest.TestCase):
+    # Test units are processed and completed until the job is finished
+    def test_processes_until_finished(self):
+        queue = MagicMock()
+        queue.lease_seconds = 30
+        queue.claim.side_effect = [{'_id': 'nlp:0'}, {'_id': 'nlp:1'}, None]
+        queue.is_finished.return_value = True
+        queue.complete.return_value = True
+        process_unit = MagicMock(return_value={'processed': 10})
+
+        self.assertEqual(run_worker(queue, process_unit), 2)
+        self.assertEqual(process_unit.call_count, 2)
+        queue.complete.assert_called_with({'_id': 'nlp:1'}, {'processed': 10})
+
+    # Test a failing unit is handed back to the pool
+    def test_release_on_error(self):
+        queue = MagicMock()
+        queue.lease_seconds = 30
+        queue.claim.return_value = {'_id': 'nlp:0'}
+        process_unit = MagicMock(side_effect=RuntimeError("mongo down"))
+
+        with self.assertRaises(RuntimeError):
+            run_worker(queue, process_unit)
+        queue.release.assert_called_once_with({'_id': 'nlp:0'})
+        queue.complete.assert_not_called()
+
+
+@unittest.skipUnless(mongo_reachable(), 'needs a MongoDB server ($MONGO_URI or localhost)')
+class TestLeaseWorkQueueMongo(unittest.TestCase):
+    def setUp(self):
+        self.client = MongoClient(mongo_uri())
+        self.client.drop_database(TEST_DB)
+        self.db = self.client[TEST_DB]
+        self.db.posts.insert_many([{'_id': i} for i in range(100)])
+
+    def tearDown(self):
+        self.client.drop_database(TEST_DB)
+        self.client.close()
+
+    def queue(self, worker_id, lease_seconds=30):
+        return LeaseWorkQueue(self.db.jobs, 'nlp', lease_seconds=lease_seconds,
+                              worker_id=worker_id)
+
+    # Test worker processes planning and claiming together process every unit once
+    def test_concurrent_workers(self):
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(4)
+        workers = [context.Process(target=run_worker_process,
+                                   args=(mongo_uri(), f"w{index}", barrier))
+                   for index in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+
+        units = list(self.db.jobs.find({'job': 'nlp'}))
+        self.assertEqual(len(units), 20)
+        self.assertTrue(all(unit['status'] == 'done' for unit in units))
+        self.assertTrue(all(unit['stats']['worker'] == unit['owner'] for unit in units))
+        claims = Counter(claim['unit'] for claim in self.db.claims.find())
+        self.assertEqual(claims, Counter(unit['_id'] for unit in units))
+        self.assertGreater(len(self.db.claims.distinct('worker')), 1)
+
+    # Test an expired lease is taken over on the server clock and the old owner is fenced
+    def test_lease_expiry(self):
+        first = self.queue('w1', lease_seconds=0.5)
+        second = self.queue('w2')
+        first.plan(self.db.posts, unit_size=100)
+
+        unit = first.claim()
+        self.assertIsNone(second.claim())
+        time.sleep(1)
+        taken = second.claim()
+
+        self.assertEqual(taken['_id'], unit['_id'])
+        self.assertEqual((taken['owner'], taken['attempts']), ('w2', 2))
+        self.assertFalse(first.renew(unit))
+        self.assertFalse(first.complete(unit))
+        self.assertTrue(second.complete(taken))
+        self.assertTrue(second.is_finished())
+
+    # Test a renewed lease outlives its duration and lapses once renewals stop
+    def test_renewal(self):
+        first = self.queue('w1', lease_seconds=1)
+        second = self.queue('w2')
+        first.plan(self.db.posts, unit_size=100)
+
+        unit = first.claim()
+        with LeaseHeartbeat(first, unit, interval=0.2) as heartbeat:
+            time.sleep(2)
+            self.assertIsNone(second.claim())
+        self.assertFalse(heartbeat.lost.is_set())
+
+        time.sleep(1.5)
+        self.assertEqual(second.claim()['_id'], unit['_id'])
+        self.assertFalse(first.renew(unit))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import gc
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from worker_pool import PreloadedModels, WorkerPool, memory_usage
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        gc.unfreeze()
+        for name in os.listdir(self.output_dir):
+            os.remove(os.path.join(self.output_dir, name))
+        os.rmdir(self.output_dir)
+
+    # Test workers are forked with the objects of the parent already loaded
+    def test_workers_share_parent_objects(self):
+        table = {'loaded_in': os.getpid()}
+
+        def target(index):
+            with open(os.path.join(self.output_dir, str(index)), 'w') as f:
+                f.write(f"{table['loaded_in']} {os.getpid()}")
+
+        pool = WorkerPool(target, workers=3)
+        pool.start()
+        exit_codes = pool.join()
+
+        self.assertEqual(exit_codes, {0: 0, 1: 0, 2: 0})
+        for index in range(3):
+            with open(os.path.join(self.output_dir, str(index))) as f:
+                loaded_in, pid = map(int, f.read().split())
+            self.assertEqual(loaded_in, os.getpid())
+            self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(len(pool.spawn_seconds), 3)
+
+    # Test a failing worker is restarted, up to max_restarts
+    def test_restart_failed_worker(self):
+        marker = os.path.join(self.output_dir, 'attempts')
+
+        def target(index):
+            with open(marker, 'a') as f:
+                f.write('x')
+            with open(marker) as f:
+                if len(f.read()) < 2:
+                    raise SystemExit(3)
+
+        pool = WorkerPool(target, workers=1, max_restarts=2)
+        pool.start()
+        self.assertEqual(pool.join(), {0: 0})
+        self.assertEqual(pool.restarts, 1)
+
+        pool = WorkerPool(lambda index: os._exit(4), workers=1, max_restarts=1)
+        pool.start()
+        self.assertEqual(pool.join(), {0: 4})
+
+    # Test the workers' pipelines use the preloaded models
+    def test_pipeline_uses_preloaded_models(self):
+        models = PreloadedModels()
+        pipeline = models.pipeline()
+        self.assertIs(pipeline.vader_analyzer, models.vader_analyzer)
+        self.assertIsNone(pipeline.preprocessor)
+
+    # Test memory usage is read from /proc where available
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps_rollup'), 'needs /proc smaps_rollup')
+    def test_memory_usage(self):
+        usage = memory_usage()
+        self.assertGreater(usage['rss'], 0)
+        self.assertLessEqual(usage['uss'], usage['rss'])
+
+
+if __name__ == '__main__':
+    unittest.main()